@@ -0,0 +1,238 @@
+"""
+Match all aliases of a vocabulary in a text with a single scan.
+
+The regular expressions created by aliasregex.regex_from_alias only use a small
+subset of the regular expression syntax: case insensitive literal characters,
+digits (\\d), any character (.), optional separators between words, camel case
+transitions and numbers (\\s?[- _.]?) and word boundaries around the alias.
+
+AliasMatcher parses these expressions into token sequences and stores them in a
+trie. The text is scanned once for positions where an alias may start, and the
+trie is walked from each of these positions. Matches are identical to running
+findall for each of the expressions (each expression returns its own
+non-overlapping matches, preferring to include separators), but the cost no
+longer grows with the number of aliases.
+
+Expressions using other regular expression syntax (e.g. aliases containing
+parentheses) or non-ASCII characters are not supported by the trie and are
+returned by unsupported_patterns, so they can be matched as regular expressions.
+Case insensitive matching in re is not the same as str.lower() for all
+characters (e.g. "ı" is equal to "i"), so only ASCII literals are used in the
+trie, and the text is folded with the same exceptions as re.
+"""
+
+from typing import Dict, Iterable, List, Optional, Set, Text, Tuple
+import re
+
+# Tokens, in addition to literal characters
+SEP = r"\s?[- _.]?"
+DIGIT = r"\d"
+ANY = r"[^\n]"
+
+SEPARATORS = "- _."
+
+# Max number of tokens used in the regular expression that finds start positions
+START_DEPTH = 3
+
+# Characters matching an ASCII letter with re.IGNORECASE, where str.lower() differs
+CASE_FOLD = {
+    "\u0130": "i",  # LATIN CAPITAL LETTER I WITH DOT ABOVE
+    "\u0131": "i",  # LATIN SMALL LETTER DOTLESS I
+    "\u017f": "s",  # LATIN SMALL LETTER LONG S
+}
+
+
+class UnsupportedPattern(Exception):
+    """Regular expression syntax not supported by the AliasMatcher"""
+
+    pass
+
+
+def tokenize(pattern: Text) -> List[Text]:
+    """Split regular expression from aliasregex.regex_from_alias into tokens. Tokens
+    are SEP, DIGIT, ANY or a single (lowercase) ASCII literal character"""
+
+    if not (pattern.startswith(r"\b(") and pattern.endswith(r")\b")):
+        raise UnsupportedPattern(pattern)
+
+    body = pattern[3:-3]
+    tokens = []
+    i = 0
+
+    while i < len(body):
+        if body.startswith(SEP, i):
+            tokens.append(SEP)
+            i += len(SEP)
+        elif body.startswith(DIGIT, i):
+            tokens.append(DIGIT)
+            i += len(DIGIT)
+        elif body[i] == "\\" and i + 1 < len(body) and not body[i + 1].isalnum():
+            tokens.append(literal(pattern, body[i + 1]))  # Escaped literal character
+            i += 2
+        elif body[i] == ".":
+            tokens.append(ANY)
+            i += 1
+        elif body[i] in "\\^$*+?{}[]|()":
+            raise UnsupportedPattern(pattern)
+        else:
+            tokens.append(literal(pattern, body[i]))
+            i += 1
+
+    if not tokens:
+        raise UnsupportedPattern(pattern)
+
+    return tokens
+
+
+def literal(pattern: Text, char: Text) -> Text:
+    """Return token for a literal character in pattern"""
+
+    if not char.isascii():
+        raise UnsupportedPattern(pattern)
+
+    return char.lower()
+
+
+def fold(char: Text) -> Text:
+    """Fold character in the text to the token it matches with re.IGNORECASE"""
+
+    return CASE_FOLD.get(char) or char.lower()
+
+
+def is_word(text: Text, pos: int) -> bool:
+    """True if there is a word character at pos (same definition as \\w)"""
+
+    return 0 <= pos < len(text) and (text[pos].isalnum() or text[pos] == "_")
+
+
+def is_boundary(text: Text, pos: int) -> bool:
+    """True if there is a word boundary at pos (same definition as \\b)"""
+
+    return is_word(text, pos - 1) != is_word(text, pos)
+
+
+class Node:
+    """Trie node"""
+
+    __slots__ = ["children", "patterns"]
+
+    def __init__(self) -> None:
+        self.children: Dict[Text, "Node"] = {}
+        self.patterns: List[int] = []  # Patterns ending in this node
+
+
+class AliasMatcher:
+    """Match a set of regular expressions from aliasregex.regex_from_alias"""
+
+    def __init__(self, patterns: Iterable[Text]) -> None:
+        self.root = Node()
+        self.patterns: List[Text] = []
+        self.unsupported_patterns: List[Text] = []
+
+        for pattern in patterns:
+            try:
+                tokens = tokenize(pattern)
+            except UnsupportedPattern:
+                self.unsupported_patterns.append(pattern)
+                continue
+
+            node = self.root
+            for token in tokens:
+                node = node.children.setdefault(token, Node())
+            node.patterns.append(len(self.patterns))
+            self.patterns.append(pattern)
+
+        if self.patterns:
+            self.start = re.compile(
+                r"\b(?={})".format(self.start_regex(self.root, START_DEPTH) or ""),
+                re.IGNORECASE)
+        else:
+            self.start = re.compile("(?!)")  # Never match
+
+    def start_regex(self, node: Node, depth: int) -> Optional[Text]:
+        """Regular expression matching the first tokens of all patterns below node,
+        used to find the positions where a pattern may start"""
+
+        if depth == 0 or node.patterns or SEP in node.children:
+            return None  # Patterns may end or continue with a separator here
+
+        alternatives = []
+
+        for token, child in sorted(node.children.items()):
+            if token in (DIGIT, ANY):
+                prefix = token
+            else:
+                prefix = re.escape(token)
+
+            alternatives.append(prefix + (self.start_regex(child, depth - 1) or ""))
+
+        return "(?:{})".format("|".join(alternatives))
+
+    def match_at(self, text: Text, start: int) -> Dict[int, int]:
+        """Return the end of the match for all patterns matching at start. If there are
+        several possible matches, the match found by the regular expression
+        (preferring to include separators) is returned"""
+
+        found: Dict[int, int] = {}
+        seen: Set[Tuple[int, int]] = set()
+        stack: List[Tuple[Node, int]] = [(self.root, start)]
+
+        # Depth first search, where states are pushed in reverse order of preference
+        while stack:
+            node, pos = stack.pop()
+
+            if (id(node), pos) in seen:
+                continue
+            seen.add((id(node), pos))
+
+            if node.patterns and is_boundary(text, pos):
+                for pattern in node.patterns:
+                    found.setdefault(pattern, pos)
+
+            char = text[pos] if pos < len(text) else ""
+            lower = fold(char)
+
+            next_states = []
+
+            if char:
+                if lower in node.children:
+                    next_states.append((node.children[lower], pos + 1))
+                if DIGIT in node.children and char.isdecimal():
+                    next_states.append((node.children[DIGIT], pos + 1))
+                if ANY in node.children and char != "\n":
+                    next_states.append((node.children[ANY], pos + 1))
+
+            sep = node.children.get(SEP)
+
+            if sep:
+                # \s?[- _.]? in order of preference
+                if char.isspace():
+                    if pos + 1 < len(text) and text[pos + 1] in SEPARATORS:
+                        next_states.append((sep, pos + 2))
+                    next_states.append((sep, pos + 1))
+                if char and char in SEPARATORS:
+                    next_states.append((sep, pos + 1))
+                next_states.append((sep, pos))
+
+            stack.extend(reversed(next_states))
+
+        return found
+
+    def finditer(self, text: Text) -> Iterable[Tuple[int, int]]:
+        """Return (start, end) of all matches in text. As with findall for each
+        pattern, matches for the same pattern do not overlap"""
+
+        next_start = [0] * len(self.patterns)
+
+        for m in self.start.finditer(text):
+            start = m.start()
+
+            for pattern, end in sorted(self.match_at(text, start).items()):
+                if start >= next_start[pattern]:
+                    next_start[pattern] = end
+                    yield start, end
+
+    def findall(self, text: Text) -> List[Text]:
+        """Return all matches in text"""
+
+        return [text[start:end] for start, end in self.finditer(text)]
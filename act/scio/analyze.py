@@ -3,11 +3,15 @@
 """ SCIO Analyze module """
 
 from act.scio import plugin
-from typing import Optional, List, Dict, Text
+from act.scio.blobstore import BlobStore, blob_name
+from act.scio.plugin_pool import PluginPool
+from act.scio.result_cache import ResultCache, plugin_versions
+from typing import Optional, List, Dict, Set, Text, Tuple
 
 import addict  # type: ignore
 import argparse
 import asyncio
+import concurrent.futures
 import datetime
 import greenstalk  # type: ignore
 import gzip
@@ -17,12 +21,15 @@ import os.path
 import requests
 import pytz
 import re
+import signal
 import sys
 
 import caep
 
 import act.scio.logsetup
 import act.scio.config
+import act.scio.es
+import act.scio.metrics
 
 DEFAULT_METADATA_DATE_FIELDS = [
     "Creation-Date",
@@ -47,6 +54,15 @@ DEFAULT_METADATA_DATE_FIELDS = [
 
 ISO8601_DATE_RE = re.compile(r'^\d\d\d\d-\d\d-\d\dT\d\d:\d\d:\d\dZ$')
 
+# Seconds to wait for a beanstalk job before checking whether we should stop
+RESERVE_TIMEOUT = 5
+
+# Seconds between checks whether buffered elasticsearch documents should be flushed
+FLUSH_CHECK_INTERVAL = 1
+
+# Seconds between each time metrics are written to --metrics-file
+METRICS_WRITE_INTERVAL = 15
+
 
 def parse_args() -> argparse.Namespace:
     """Helper setting up the argsparse configuration"""
@@ -56,11 +72,52 @@ def parse_args() -> argparse.Namespace:
     arg_parser.add_argument('--metadata-date-fields', default=",".join(DEFAULT_METADATA_DATE_FIELDS))
     arg_parser.add_argument('--proxy-string', help="Proxy to use webdump upload")
     arg_parser.add_argument('--webdump', dest='webdump', type=str, help="URI to post result data")
+    arg_parser.add_argument('--processes', type=int, default=0,
+                            help="Run plugins in a pool of worker processes. " +
+                            "Default 0 (run plugins in the main process)")
+    arg_parser.add_argument('--concurrency', type=int, default=1,
+                            help="Number of documents to analyze concurrently. Default 1")
+    arg_parser.add_argument('--es-bulk-size', type=int, default=100,
+                            help="Max documents buffered before sent to elasticsearch. " +
+                            "Default 100")
+    arg_parser.add_argument('--es-bulk-bytes', type=int, default=10 * 1024 * 1024,
+                            help="Max bytes buffered before sent to elasticsearch. " +
+                            "Default 10MB")
+    arg_parser.add_argument('--es-flush-interval', type=float, default=5.0,
+                            help="Max seconds documents are buffered before sent to " +
+                            "elasticsearch. Default 5")
+    arg_parser.add_argument('--indicator-index', default=act.scio.es.INDICATOR_INDEX,
+                            help="Elasticsearch index with one document per indicator, " +
+                            "updated with each analyzed document. Set to an empty " +
+                            "value to disable. Default " + act.scio.es.INDICATOR_INDEX)
+    arg_parser.add_argument('--metrics-port', type=int, default=0,
+                            help="Serve plugin metrics in Prometheus format on " +
+                            "http://<metrics-host>:<metrics-port>/metrics")
+    arg_parser.add_argument('--metrics-host', default="127.0.0.1",
+                            help="Interface to serve metrics on (default=127.0.0.1)")
+    arg_parser.add_argument('--metrics-file',
+                            help="Periodically write plugin metrics in Prometheus format to file")
+    arg_parser.add_argument('--timings', action="store_true",
+                            help="Add plugin timings to the result under the _timings key")
+    arg_parser.add_argument('--trace-memory', action="store_true",
+                            help="Trace memory allocations to measure the peak memory of " +
+                            "each plugin (slows down the plugins)")
+    arg_parser.add_argument('--result-cache',
+                            help="sqlite database used to cache plugin results " +
+                            "(default: no cache)")
+    arg_parser.add_argument('--result-cache-size', type=int, default=1024,
+                            help="Max size of the result cache in MB. Default 1024")
+    arg_parser.add_argument('--blob-store',
+                            help="Directory of the blob store used by scio-tika-server " +
+                            "for extracted documents (default: documents inline in jobs)")
 
     args = caep.config.handle_args(arg_parser, "scio/etc", "scio.ini", "analyze")
 
     args.metadata_date_fields = [field.strip() for field in args.metadata_date_fields.split(",")]
 
+    if args.concurrency < 1:
+        arg_parser.error("--concurrency must be at least 1")
+
     return args
 
 
@@ -81,8 +138,17 @@ def remove_non_iso_dates(metadata: Dict, isodate_fields: List[Text]) -> Dict:
     return filtered
 
 
-def get_input(beanstalk_client: Optional[greenstalk.Client] = None) -> addict.Dict:
-    """Helper function to abstract away how we get the text to work on"""
+def get_input(beanstalk_client: Optional[greenstalk.Client] = None,
+              timeout: Optional[int] = None,
+              blob_store: Optional[BlobStore] = None) -> addict.Dict:
+    """Helper function to abstract away how we get the text to work on.
+
+    If timeout is specified, greenstalk.TimedOutError is raised if no job is
+    available from beanstalk within timeout seconds.
+
+    If the job points to a document in the blob store, the document is read
+    from the blob store and deleted from the store. If the blob can not be
+    read, the job is buried, so it can be kicked when the blob store is fixed."""
 
     nlpdata = addict.Dict()
     if not beanstalk_client:
@@ -92,27 +158,81 @@ def get_input(beanstalk_client: Optional[greenstalk.Client] = None) -> addict.Di
     else:
         # ADD BEANSTALK JOB CONSUMPTION
         logging.info("Waiting for work from beanstalk")
-        job = beanstalk_client.reserve()
+        job = beanstalk_client.reserve(timeout=timeout)
+        bury = False
         try:
-            nlpdata = addict.Dict(json.loads(gzip.decompress(job.body)))
+            body = job.body
+            name = blob_name(body)
+            if name:
+                if not blob_store:
+                    logging.error("Job points to blob %s, but no blob store is configured",
+                                  name)
+                    bury = True
+                    return nlpdata
+                try:
+                    body = blob_store.get(name)
+                except OSError as e:
+                    logging.error("Unable to read blob %s: %s", name, e)
+                    bury = True
+                    return nlpdata
+            nlpdata = addict.Dict(json.loads(gzip.decompress(body)))
             logging.info("Started work on %s", nlpdata.get("hexdigest", "No Hexdigest"))
+            if name:
+                blob_store.delete(name)  # type: ignore
         except OSError as e:
-            # File not found - log error
+            # Invalid document - log error
             logging.error(e)
         finally:
-            # Remove job, either on success or file not found
-            beanstalk_client.delete(job)
+            if bury:
+                # Keep the job (and the blob), so it is not lost
+                beanstalk_client.bury(job)
+            else:
+                # Remove job, either on success or invalid document
+                beanstalk_client.delete(job)
 
     return nlpdata
 
 
 async def analyze(plugins: List[plugin.BasePlugin],
-                  beanstalk_client: Optional[greenstalk.Client] = None) -> addict.Dict:
-    """Main analyze loop running all plugins on the text"""
+                  beanstalk_client: Optional[greenstalk.Client] = None,
+                  pool: Optional[PluginPool] = None) -> addict.Dict:
+    """Main analyze loop running all plugins on the text. If a pool is specified,
+    the plugins are executed in the worker processes of the pool"""
+
+    nlpdata: addict.Dict = get_input(beanstalk_client)
+
+    return await analyze_document(plugins, nlpdata, pool)
+
+
+async def run_plugin(p: plugin.BasePlugin,
+                     nlpdata: addict.Dict,
+                     pool: Optional[PluginPool] = None,
+                     timed: bool = False) -> Tuple[plugin.Result, Optional[Dict[Text, float]]]:
+    """Run plugin, in the pool if specified. Returns the result and the
+    measurements of the plugin execution if timed is True (otherwise None)"""
+
+    if pool:
+        return await pool.analyze(p, nlpdata, timed)
+
+    if timed:
+        return await act.scio.metrics.measure(p, nlpdata)
+
+    return await p.analyze(nlpdata), None
+
+
+async def analyze_document(plugins: List[plugin.BasePlugin],
+                           nlpdata: addict.Dict,
+                           pool: Optional[PluginPool] = None,
+                           metrics: Optional[act.scio.metrics.Metrics] = None,
+                           cache: Optional[ResultCache] = None) -> addict.Dict:
+    """Run all plugins on a document. If metrics is specified, each plugin execution is
+    measured and recorded, and optionally added to the document under "_timings".
+
+    If cache is specified, plugin results for documents with a hexdigest are looked up
+    in the cache before the plugin is run, and stored to the cache after the plugin is run."""
 
     loop = asyncio.get_event_loop()
 
-    nlpdata: addict.Dict = get_input(beanstalk_client)
     if not nlpdata.content:
         logging.error("Missing content")
         return addict.Dict({})
@@ -124,36 +244,63 @@ async def analyze(plugins: List[plugin.BasePlugin],
     nlpdata["Creation-Date"] = (nlpdata.get("metadata", {})
                                 .get("Creation-Date", nlpdata["Analyzed-Date"]))
 
-    staged = []  # for plugins with dependencies
-    pipeline = []  # for plugins to be run now
-
-    for p in plugins:
-        if p.dependencies:
-            staged.append(p)
-        else:
-            pipeline.append(p)
-
-    while pipeline:
-        tasks = []
-        for p in pipeline:
-            tasks.append(loop.create_task(p.analyze(nlpdata)))
-
-        await asyncio.gather(*tasks, return_exceptions=True)
-
-        for task in tasks:
+    pending = list(plugins)  # plugins not yet started
+    running: Dict[asyncio.Task, plugin.BasePlugin] = {}
+    finished: Set[Text] = set()  # plugins that finished without exceptions
+
+    hexdigest = nlpdata.get("hexdigest")
+    versions = plugin_versions(plugins) if cache and hexdigest else {}
+
+    def start_ready_plugins() -> None:
+        """Start all plugins where all dependencies are finished. Plugins with cached
+        results are finished immediately, which may make other plugins ready."""
+        started = True
+        while started:
+            started = False
+            for p in pending[:]:
+                if not all(dep in finished for dep in p.dependencies):
+                    continue
+
+                pending.remove(p)
+
+                cached = cache.get(hexdigest, p.name, versions[p.name]) if versions else None
+
+                if cached is not None:
+                    logging.debug("Using cached result for %s on %s", p.name, hexdigest)
+                    nlpdata[p.name] = cached
+                    finished.add(p.name)
+                    started = True
+                else:
+                    task = loop.create_task(run_plugin(p, nlpdata, pool, timed=bool(metrics)))
+                    running[task] = p
+
+    start_ready_plugins()
+
+    # Start dependent plugins as soon as their dependencies are finished,
+    # not waiting for other unrelated plugins
+    while running:
+        done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+
+        for task in done:
+            p = running.pop(task)
             if task.exception():
-                logging.error("%s returned an exception: %s", task, task.exception())
+                logging.error("%s returned an exception: %s", p.name, task.exception())
+                if metrics:
+                    metrics.error(p.name)
             else:
-                res = task.result()
+                res, timing = task.result()
                 nlpdata[res.name] = res.result
+                finished.add(p.name)
+                if versions:
+                    cache.put(hexdigest, p.name, versions[p.name], res.result)  # type: ignore
+                if metrics and timing:
+                    metrics.record(p.name, timing)
+                    if metrics.attach_timings:
+                        nlpdata["_timings"][p.name] = timing
 
-        pipeline = []
-        for candidate in staged[:]:
-            if all(dep in nlpdata for dep in candidate.dependencies):
-                pipeline.append(candidate)
-                staged.remove(candidate)
+        start_ready_plugins()
 
-    for candidate in staged:
+    for candidate in pending:
         logging.warning("Candidate %s did not run due to unmet dependency %s",
                         candidate.name,
                         candidate.dependencies)
@@ -168,75 +315,278 @@ async def async_main() -> None:
 
     act.scio.logsetup.setup_logging(args.loglevel, args.logfile, "scio-analyze")
 
-    plugins = plugin.load_default_plugins()
+    configdir = os.path.join(args.config_dir, "etc/plugins")
 
-    if args.plugins:
-        try:
-            logging.info("loading plugins from %s", args.plugins)
-            plugins += plugin.load_external_plugins(args.plugins)
-        except FileNotFoundError:
-            logging.warning("Unable to load plugins from %s", args.plugins)
+    plugins = plugin.resolve_dependencies(plugin.load_plugins(args.plugins, configdir))
+
+    pool: Optional[PluginPool] = None
 
-    # Inject config directory into each plugin
-    for p in plugins:
-        p.configdir = os.path.join(args.config_dir, "etc/plugins")
+    if args.processes:
+        # Start the pool before we connect to beanstalk and elasticsearch, so the
+        # worker processes do not inherit the connections. The plugins are only
+        # setup in the workers, the main process only needs the plugin metadata
+        pool = PluginPool(args.processes, args.plugins, configdir, [p.name for p in plugins],
+                          trace_memory=args.trace_memory)
+        ready = pool.warmup()
+        plugins = plugin.resolve_dependencies([p for p in plugins if p.name in ready])
+    else:
+        plugins = plugin.resolve_dependencies(plugin.setup_plugins(plugins))
+
+    metrics: Optional[act.scio.metrics.Metrics] = None
+
+    if args.metrics_port or args.metrics_file or args.timings:
+        metrics = act.scio.metrics.Metrics(attach_timings=args.timings)
+
+    if metrics and args.metrics_port:
+        metrics.serve(args.metrics_host, args.metrics_port)
+
+    if metrics and args.trace_memory and not pool:
+        act.scio.metrics.start_memory_tracing()
+
+    try:
+        await analyze_loop(args, plugins, pool, metrics)
+    finally:
+        if metrics and args.metrics_file:
+            metrics.write(args.metrics_file)
+        if pool:
+            pool.shutdown()
+        else:
+            plugin.teardown_plugins(plugins)
+            act.scio.metrics.stop_memory_tracing()
+
+
+async def analyze_loop(args: argparse.Namespace,
+                       plugins: List[plugin.BasePlugin],
+                       pool: Optional[PluginPool] = None,
+                       metrics: Optional[act.scio.metrics.Metrics] = None) -> None:
+    """Read documents from beanstalk (or stdin) and analyze them until stopped.
+
+    The work is split in three stages connected by bounded queues: a reader
+    reserving jobs from beanstalk, args.concurrency analyzers running the plugins
+    and a writer storing the results. This keeps up to args.concurrency documents
+    in flight.
+
+    Jobs are deleted from beanstalk when they are reserved, so on SIGTERM the
+    reader stops reserving jobs, and the documents in flight are analyzed and
+    stored before we return. If a stage fails, the results already buffered
+    by the indexer are flushed before the exception is raised."""
 
     beanstalk_client = act.scio.config.beanstalk_client(args, watch="scio_analyze")
     elasticsearch_client = act.scio.config.elasticsearch_client(args)
 
+    indexer: Optional[act.scio.es.BulkIndexer] = None
+
+    if elasticsearch_client:
+        indexer = act.scio.es.BulkIndexer(
+            elasticsearch_client,
+            max_docs=args.es_bulk_size,
+            max_bytes=args.es_bulk_bytes,
+            flush_interval=args.es_flush_interval)
+
+        if args.indicator_index:
+            act.scio.es.create_indicator_index(elasticsearch_client, args.indicator_index)
+
     loop = asyncio.get_event_loop()
 
+    documents: asyncio.Queue = asyncio.Queue(maxsize=args.concurrency)
+    results: asyncio.Queue = asyncio.Queue(maxsize=args.concurrency)
+
+    cache: Optional[ResultCache] = None
+
+    if args.result_cache:
+        cache = ResultCache(os.path.expanduser(args.result_cache),
+                            max_bytes=args.result_cache_size * 1024 * 1024)
+
+    blob_store = BlobStore(args.blob_store) if args.blob_store else None
+
+    stop = asyncio.Event()
+
+    loop.add_signal_handler(signal.SIGTERM, stop.set)
+
+    tasks = [loop.create_task(read_documents(beanstalk_client, documents, args.concurrency,
+                                             blob_store, stop))]
+    tasks += [loop.create_task(analyze_documents(plugins, documents, results,
+                                                 pool, metrics, cache))
+              for _ in range(args.concurrency)]
+    tasks.append(loop.create_task(write_results(args, indexer, results, args.concurrency)))
+
+    metrics_writer: Optional[asyncio.Task] = None
+
+    if metrics and args.metrics_file:
+        metrics_writer = loop.create_task(write_metrics(metrics, args.metrics_file))
+
+    try:
+        done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+    finally:
+        loop.remove_signal_handler(signal.SIGTERM)
+
+        for task in tasks:
+            task.cancel()
+
+        # Wait for the cancelled tasks, so the writer flushes the buffered results
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    if metrics_writer:
+        metrics_writer.cancel()
+
+    if cache:
+        cache.close()
+
+    for task in done:
+        if task.exception():
+            raise task.exception()  # type: ignore
+
+
+async def read_documents(beanstalk_client: Optional[greenstalk.Client],
+                         documents: asyncio.Queue,
+                         analyzers: int,
+                         blob_store: Optional[BlobStore] = None,
+                         stop: Optional[asyncio.Event] = None) -> None:
+    """Read documents from beanstalk and put them on the documents queue,
+    until stop is set.
+
+    If we are not listening on a beanstalk work queue, behave like a command line
+    utility and only read one document from stdin. The analyzers are then
+    signalled to stop."""
+
+    loop = asyncio.get_event_loop()
+
+    # The beanstalk client is not thread safe, so all access
+    # to it is done from one dedicated thread
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+        while not (stop and stop.is_set()):
+            try:
+                # Reserve with timeout, so the thread does not block forever on shutdown
+                nlpdata = await loop.run_in_executor(
+                    executor, get_input, beanstalk_client, RESERVE_TIMEOUT, blob_store)
+            except greenstalk.TimedOutError:
+                continue
+
+            await documents.put(nlpdata)
+
+            if not beanstalk_client:
+                break
+
+    for _ in range(analyzers):
+        await documents.put(None)
+
+
+async def analyze_documents(plugins: List[plugin.BasePlugin],
+                            documents: asyncio.Queue,
+                            results: asyncio.Queue,
+                            pool: Optional[PluginPool] = None,
+                            metrics: Optional[act.scio.metrics.Metrics] = None,
+                            cache: Optional[ResultCache] = None) -> None:
+    """Analyze documents from the documents queue and put the result on the results
+    queue, until the reader signals that there are no more documents"""
+
     while True:
-        task = loop.create_task(analyze(plugins, beanstalk_client))
+        nlpdata = await documents.get()
+
+        if nlpdata is None:
+            await results.put(None)
+            break
+
         try:
-            await task
+            result = await analyze_document(plugins, nlpdata, pool, metrics, cache)
         except LookupError:
             logging.error("Got LookupError. If nltk data is missing, "
                           "run scio-nltk-download, which should download "
                           "all nltk data to ~/nltk_data.")
             raise
 
-        result = task.result()
-        if not result:
-            continue
-        result_json = json.dumps(result, indent="  ")
+        if result:
+            if metrics:
+                metrics.document()
+            await results.put(result)
 
-        if args.webdump:
-            proxies = {
-                'http': args.proxy_string,
-                'https': args.proxy_string
-            } if args.proxy_string else None
 
-            r = requests.post(args.webdump, data=result_json, proxies=proxies)
-            if r.status_code != 200:
-                logging.error("Unable to post result data to webdump: %s", r.text)
+async def write_metrics(metrics: act.scio.metrics.Metrics, filename: Text) -> None:
+    """Write metrics to file every METRICS_WRITE_INTERVAL seconds"""
 
-        if elasticsearch_client:
-            hexdigest = result.get("hexdigest")
+    loop = asyncio.get_event_loop()
 
-            if not hexdigest:
-                logging.error("Missing hexdigest, skipping elasticsearch storage")
-            else:
-                result["metadata"] = remove_non_iso_dates(
-                        result["metadata"],
-                        args.metadata_date_fields)
+    while True:
+        await asyncio.sleep(METRICS_WRITE_INTERVAL)
+        await loop.run_in_executor(None, metrics.write, filename)
+
+
+async def write_results(args: argparse.Namespace,
+                        indexer: Optional[act.scio.es.BulkIndexer],
+                        results: asyncio.Queue,
+                        analyzers: int) -> None:
+    """Store results from the results queue, until all analyzers are done.
 
+    The buffered results are flushed when we are done, also if we are cancelled
+    or fail, since the jobs of the results are already deleted from beanstalk."""
+
+    loop = asyncio.get_event_loop()
+
+    # Storing the result is blocking, so it is run in a thread to not block the
+    # event loop. A single thread is used, so a store cancelled while running
+    # is completed before the final flush
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+        try:
+            while analyzers:
                 try:
-                    elasticsearch_client.index(index="scio2", id=hexdigest, body=result)
-                except Exception as e:
-                    logging.error("Error storing %s to elasticsearch: %s", hexdigest, e)
-                    raise
+                    result = await asyncio.wait_for(results.get(),
+                                                    timeout=FLUSH_CHECK_INTERVAL)
+                except asyncio.TimeoutError:
+                    if indexer and indexer.due():
+                        await loop.run_in_executor(executor, indexer.flush)
+                    continue
+
+                if result is None:
+                    analyzers -= 1
+                    continue
+
+                await loop.run_in_executor(executor, store_result, args, indexer, result)
+        finally:
+            if indexer:
+                await loop.run_in_executor(executor, indexer.flush)
 
-                logging.info("Stored %s to elasticsearch", hexdigest)
 
-        if not (args.webdump or elasticsearch_client):
-            # Print to stdout if we do not send to webdump or elasticsearch
-            print(result_json)
+def store_result(args: argparse.Namespace,
+                 indexer: Optional[act.scio.es.BulkIndexer],
+                 result: addict.Dict) -> None:
+    """Send result to webdump and/or elasticsearch, or print to stdout if
+    none of them are configured. Documents sent to elasticsearch are buffered
+    by the indexer and stored in bulk."""
 
-        # If we are not listening on a beanstalk work queue, behave like a command line
-        # utility and exit after one document.
-        if not beanstalk_client:
-            break
+    result_json = json.dumps(result, indent="  ")
+
+    if args.webdump:
+        proxies = {
+            'http': args.proxy_string,
+            'https': args.proxy_string
+        } if args.proxy_string else None
+
+        r = requests.post(args.webdump, data=result_json, proxies=proxies)
+        if r.status_code != 200:
+            logging.error("Unable to post result data to webdump: %s", r.text)
+
+    if indexer:
+        hexdigest = result.get("hexdigest")
+
+        if not hexdigest:
+            logging.error("Missing hexdigest, skipping elasticsearch storage")
+        else:
+            result["metadata"] = remove_non_iso_dates(
+                    result["metadata"],
+                    args.metadata_date_fields)
+
+            indexer.index(index="scio2", doc_id=hexdigest, body=result)
+
+            if args.indicator_index and result.get("indicators"):
+                indexer.index_indicators(
+                    args.indicator_index,
+                    result["indicators"],
+                    result["Analyzed-Date"],
+                    hexdigest)
+
+    if not (args.webdump or indexer):
+        # Print to stdout if we do not send to webdump or elasticsearch
+        print(result_json)
 
 
 def main() -> None:
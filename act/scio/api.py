@@ -19,47 +19,48 @@ SCIO API
 """
 
 import argparse
+import asyncio
 import base64
 import hashlib
+import json
 import logging
 import os
 import re
+import tempfile
 from functools import lru_cache
-from typing import Dict, List, Optional, Text, Union
+from typing import Any, AsyncIterator, Dict, Iterable, Iterator, Optional, Text, Tuple, Union
 
 import act.scio.config
 import act.scio.es
+from act.scio.producer import BeanstalkProducer, ProducerTimeout
+from act.scio.queue_stats import QueueStats
+from act.scio.response_cache import ResponseCache, etag, etag_matches
+import aiofiles
 import caep
 import elasticsearch
 import greenstalk  # type: ignore
 import uvicorn
-from fastapi import Depends, FastAPI, HTTPException, Response
-from fastapi.responses import FileResponse, PlainTextResponse
+from fastapi import Depends, FastAPI, HTTPException, Request, Response
+from fastapi.responses import FileResponse, PlainTextResponse, StreamingResponse
 from pydantic import BaseModel, StrictInt, StrictStr
 from pydantic.types import constr
+from starlette.concurrency import run_in_threadpool
 
 XDG_CACHE = os.path.expanduser(os.environ.get("XDG_CACHE_HOME", "~/.cache"))
 
-app = FastAPI()
-
-# pylint: disable=too-few-public-methods
+# Read size when streaming documents. Must be a multiple of 3,
+# so the base64 encoded chunks can be concatenated
+CHUNK_SIZE = 3 * 256 * 1024
 
+# Number of indicators sent in each chunk of the indicator export
+INDICATOR_BATCH = 1000
 
-def max_current_jobs_ready(client: greenstalk.Client, tubes: List[Text]) -> int:
-    """ Get max current-jobs-ready from tubes specified """
-    max_jobs = 0
-    for tube in tubes:
-        # We need to check for the existense of a beanstalk tube
-        # to avoid "NOT_FOUND" exceptions in the case where the tubes
-        # are empty before first init
-        if tube not in client.tubes():
-            continue
-        stats = client.stats_tube(tube)
+app = FastAPI()
 
-        if stats:
-            max_jobs = max(max_jobs, stats.get("current-jobs-ready", 0))
+# Tubes included in backpressure check
+QUEUE_TUBES = ["scio_doc", "scio_analyze"]
 
-    return max_jobs
+# pylint: disable=too-few-public-methods
 
 
 class Document(BaseModel):
@@ -96,12 +97,41 @@ def parse_args() -> argparse.Namespace:
     arg_parser.add_argument('--max-jobs', type=int, default=10,
                             help="Max jobs in queue before submit responds " +
                             "with backpressure (429)")
+    arg_parser.add_argument('--queue-poll-interval', type=float, default=1.0,
+                            help="Interval in seconds between polling of queue stats " +
+                            "(default=1.0)")
     arg_parser.add_argument('--reload', action="store_true",
                             help="Reload web server on file change (dev mode)")
     arg_parser.add_argument('--document-path', default=caep.get_cache_dir("scio/documents"),
                             help=f"Storage path for documents = {XDG_CACHE}/scio/documents")
     arg_parser.add_argument('--host', dest='host', default='127.0.0.1',
                             help="Host interface (default=127.0.0.1)")
+    arg_parser.add_argument('--max-size', type=int, default=500,
+                            help="Max size of submitted documents in MB (default=500)")
+    arg_parser.add_argument('--indicator-index', default=act.scio.es.INDICATOR_INDEX,
+                            help="Elasticsearch index with indicators maintained by " +
+                            "scio-analyze. Run scio-config indicators once to add " +
+                            "documents analyzed before the index was created. " +
+                            "Set to an empty value to aggregate " +
+                            "indicators from the documents instead. " +
+                            "Default " + act.scio.es.INDICATOR_INDEX)
+    arg_parser.add_argument('--indicator-cache-ttl', type=float, default=300,
+                            help="Seconds indicator exports are cached. " +
+                            "Set to 0 to disable (default=300)")
+    arg_parser.add_argument('--es-index', default="scio2",
+                            help="Index (or index pattern) of documents used to " +
+                            "aggregate indicators (default=scio2)")
+    arg_parser.add_argument('--es-page-size', type=int, default=1000,
+                            help="Indicators/buckets per elasticsearch request " +
+                            "(default=1000)")
+    arg_parser.add_argument('--es-timeout', type=float, default=180,
+                            help="Timeout of elasticsearch requests in seconds (default=180)")
+    arg_parser.add_argument('--es-slices', type=int, default=1,
+                            help="Split the time range of indicator aggregations in " +
+                            "slices, aggregated in parallel (default=1)")
+    arg_parser.add_argument('--beanstalk-connections', type=int, default=4,
+                            help="Max beanstalk connections used to submit " +
+                            "documents (default=4)")
 
     args = caep.config.handle_args(arg_parser, "scio/etc", "scio.ini", "api")
 
@@ -109,9 +139,20 @@ def parse_args() -> argparse.Namespace:
         os.makedirs(args.document_path)
         logging.info("Created directory: %s", args.document_path)
 
-    args.beanstalk_client = act.scio.config.beanstalk_client(args, use="scio_doc")
+    args.producer = BeanstalkProducer(
+        lambda: act.scio.config.beanstalk_client(args, use="scio_doc"),
+        args.beanstalk_connections)
     args.elasticsearch_client = act.scio.config.elasticsearch_client(args)
 
+    args.indicator_cache = ResponseCache(args.indicator_cache_ttl)
+
+    # Queue stats are polled on a separate connection, since the
+    # poller runs in a thread in parallel with the API endpoints
+    args.queue_stats = QueueStats(
+        act.scio.config.beanstalk_client(args),
+        QUEUE_TUBES,
+        args.queue_poll_interval)
+
     return args
 
 
@@ -135,38 +176,169 @@ def document_lookup(document_id: Text,
     )
 
 
-@app.post("/submit")
-async def submit(doc: Document, args: argparse.Namespace = Depends(parse_args)) -> SubmitResponse:
-    # Depends on parse_args which are used for settings. The result
-    # is cached the first time it is executed
-    """ Submit document """
+@app.on_event("startup")
+async def start_queue_stats() -> None:
+    """ Start polling of queue stats in the background """
+    app.state.queue_stats = asyncio.create_task(parse_args().queue_stats.run())
+
+
+@app.on_event("shutdown")
+async def stop_queue_stats() -> None:
+    """ Stop polling of queue stats """
+    app.state.queue_stats.cancel()
+
+
+async def check_backpressure(args: argparse.Namespace) -> None:
+    """ Raise HTTPException (429) if there are too many jobs in queue """
 
-    max_jobs = max_current_jobs_ready(args.beanstalk_client, ["scio_doc", "scio_analyze"])
+    # Stats are polled from beanstalk if the snapshot is stale
+    max_jobs = await run_in_threadpool(args.queue_stats.max_jobs_ready)
 
     if max_jobs >= args.max_jobs:
         logging.warning("%s jobs in queue", max_jobs)
         raise HTTPException(status_code=429, detail="To many jobs in queue, try again later")
 
-    filename = os.path.join(args.document_path, os.path.basename(doc.filename))
-    content: bytes = base64.b64decode(doc.content)
-    with open(filename, "bw") as f:
-        f.write(content)
+
+def too_large(args: argparse.Namespace) -> HTTPException:
+    """ Exception for documents larger than --max-size """
+
+    return HTTPException(status_code=413,
+                         detail="Document larger than {} MB".format(args.max_size))
+
+
+def decode_document(content: Text) -> Tuple[bytes, Text]:
+    """ Decode base64 encoded document. Returns the document and its sha256 """
+
+    data = base64.b64decode(content)
+
+    return data, hashlib.sha256(data).hexdigest()
+
+
+async def queue_document(args: argparse.Namespace,
+                         filename: Text,
+                         hexdigest: Text,
+                         count: int,
+                         uri: Optional[Text]) -> SubmitResponse:
+    """ Send stored document to tika for extraction """
 
     response = SubmitResponse(
         filename=filename,
-        hexdigest=hashlib.sha256(content).hexdigest(),
-        count=len(content),
+        hexdigest=hexdigest,
+        count=count,
         error=None,
-        uri=doc.uri)
+        uri=uri)
+
+    try:
+        await args.producer.put(response.json().encode("utf8"))
+    except (ProducerTimeout, greenstalk.Error, OSError) as err:
+        logging.error("Unable to queue %s: %s", filename, err)
+        raise HTTPException(status_code=503, detail="Beanstalk is unavailable, try again later")
 
-    args.beanstalk_client.put(response.json().encode("utf8"))
     return response
 
 
+@app.post("/submit")
+async def submit(doc: Document, args: argparse.Namespace = Depends(parse_args)) -> SubmitResponse:
+    # Depends on parse_args which are used for settings. The result
+    # is cached the first time it is executed
+    """ Submit document """
+
+    await check_backpressure(args)
+
+    filename = os.path.join(args.document_path, os.path.basename(doc.filename))
+
+    # Decoding and hashing large documents is CPU bound, so run it in a thread
+    # to not block the event loop
+    content, hexdigest = await run_in_threadpool(decode_document, doc.content)
+
+    if len(content) > args.max_size * 1024 * 1024:
+        raise too_large(args)
+
+    async with aiofiles.open(filename, "bw") as f:
+        await f.write(content)
+
+    return await queue_document(args, filename, hexdigest, len(content), doc.uri)
+
+
+@app.post("/submit_raw")
+async def submit_raw(request: Request,
+                     filename: StrictStr,
+                     uri: Optional[StrictStr] = None,
+                     args: argparse.Namespace = Depends(parse_args)) -> SubmitResponse:
+    """ Submit document as the raw request body, e.g.
+
+    curl --data-binary @report.pdf "http://localhost:3000/submit_raw?filename=report.pdf"
+
+    The document is written to disk as it is received, so large documents
+    are never held in memory. """
+
+    await check_backpressure(args)
+
+    max_bytes = args.max_size * 1024 * 1024
+
+    if int(request.headers.get("content-length") or 0) > max_bytes:
+        raise too_large(args)
+
+    filename = os.path.join(args.document_path, os.path.basename(filename))
+
+    sha256 = hashlib.sha256()
+    count = 0
+
+    # Write to a temporary file, so an incomplete upload never replaces a document
+    fd, tmp_filename = tempfile.mkstemp(dir=args.document_path, suffix=".part")
+    os.close(fd)
+
+    try:
+        async with aiofiles.open(tmp_filename, "wb") as f:
+            async for chunk in request.stream():
+                count += len(chunk)
+                if count > max_bytes:
+                    raise too_large(args)
+                sha256.update(chunk)
+                await f.write(chunk)
+
+        os.replace(tmp_filename, filename)
+    finally:
+        if os.path.exists(tmp_filename):
+            os.remove(tmp_filename)
+
+    return await queue_document(args, filename, sha256.hexdigest(), count, uri)
+
+
+@app.get("/queue")
+def queue(args: argparse.Namespace = Depends(parse_args)) -> Dict[Text, Any]:
+    """ Queue stats
+
+    Returns the stats of the beanstalk tubes, as last polled, and
+    the age of the stats in seconds. Submit responds with backpressure
+    (429) when current-jobs-ready of any tube reaches max_jobs. """
+
+    return {**args.queue_stats.snapshot(), "max_jobs": args.max_jobs}
+
+
+def indicator_lines(values: Iterable[Text]) -> Iterator[bytes]:
+    """ Newline separated values, in chunks of INDICATOR_BATCH values """
+
+    batch = []
+    separator = b""
+
+    for value in values:
+        batch.append(value)
+
+        if len(batch) >= INDICATOR_BATCH:
+            yield separator + "\n".join(batch).encode("utf8")
+            batch = []
+            separator = b"\n"
+
+    if batch:
+        yield separator + "\n".join(batch).encode("utf8")
+
+
 @ app.get("/indicators/{indicator_type}", response_class=PlainTextResponse)
-def indicators(indicator_type: constr(regex=r"^(ipv4|ipv6|uri|email|fqdn|md5|sha1|sha256)$"),
-             last: constr(regex=r'^\d+[yMwdhms]?$') = "90d",
-             args: argparse.Namespace = Depends(parse_args)) -> PlainTextResponse:
+def indicators(request: Request,
+               indicator_type: constr(regex=r"^(ipv4|ipv6|uri|email|fqdn|md5|sha1|sha256)$"),
+               last: constr(regex=r'^\d+[yMwdhms]?$') = "90d",
+               args: argparse.Namespace = Depends(parse_args)) -> Response:
     """ Download indicators
 
     Allowed indicator types:
@@ -179,6 +351,9 @@ def indicators(indicator_type: constr(regex=r"^(ipv4|ipv6|uri|email|fqdn|md5|sha
     * sha1
     * sha256
 
+    Indicators are read from the indicator index maintained by scio-analyze,
+    sorted by value.
+
     You can also specify the maximum age of the document you want to
     get indicators from with the `last` argument (default=90d). The
     format should be either be <NUM><TIME UNIT>, where TIME UNIT can be one of:
@@ -193,29 +368,84 @@ def indicators(indicator_type: constr(regex=r"^(ipv4|ipv6|uri|email|fqdn|md5|sha
 
     OR <EPOC> (only digits) where the EPOC is a unix timestamp in milliseconds
 
+    Exports have an ETag, derived from the number of matching indicators
+    (or documents) and when they were last seen, and requests with a
+    matching If-None-Match header get 304 (Not Modified). Exports are
+    cached for --indicator-cache-ttl seconds.
     """
 
     if not args.elasticsearch_client:
         raise HTTPException(status_code=412, detail="Elasticsearch is not configured")
 
+    key = (indicator_type, last)
+    cached = args.indicator_cache.get(key) if args.indicator_cache_ttl else None
+
+    if cached:
+        headers = {"ETag": cached.etag}
+
+        if etag_matches(request.headers.get("if-none-match"), cached.etag):
+            return Response(status_code=304, headers=headers)
+
+        return Response(cached.body, media_type="text/plain", headers=headers)
+
     if re.search(r"^\d+$", last):
         # Only digits - assume unix timestamp
         start = last
     else:
         start = f"now-{last}"
 
-    term = f"indicators.{indicator_type}.keyword"
+    if args.indicator_index:
+        state = act.scio.es.index_state(
+            args.elasticsearch_client,
+            args.indicator_index,
+            act.scio.es.indicator_filters(indicator_type, start),
+            "last_seen",
+            timeout=args.es_timeout)
+    else:
+        term = f"indicators.{indicator_type}.keyword"
+
+        state = act.scio.es.index_state(
+            args.elasticsearch_client,
+            args.es_index,
+            [{"range": {"Analyzed-Date": {"gte": start, "lte": "now"}}},
+             {"exists": {"field": term}}],
+            "Analyzed-Date",
+            timeout=args.es_timeout)
+
+    # The ETag is derived from the state of the index, so it is known
+    # before the export is produced, and can be sent with the streamed export
+    headers = {"ETag": etag("{}:{}:{}".format(indicator_type, last, state).encode("utf8"))}
+
+    if etag_matches(request.headers.get("if-none-match"), headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+
+    if args.indicator_index:
+        values = act.scio.es.indicator_values(
+            args.elasticsearch_client,
+            indicator_type,
+            start=start,
+            index=args.indicator_index,
+            size=args.es_page_size,
+            timeout=args.es_timeout)
+    else:
+        values = (row[0].get(term) for row in act.scio.es.aggregation(
+            args.elasticsearch_client,
+            terms=[term],
+            start=start,
+            end="now",
+            index=args.es_index,
+            size=args.es_page_size,
+            timeout=args.es_timeout,
+            slices=args.es_slices,
+        ))
+
+    chunks = indicator_lines(values)
 
-    res = act.scio.es.aggregation(
-        args.elasticsearch_client,
-        terms=[term],
-        start=start,
-        end="now",
-    )
+    if args.indicator_cache_ttl:
+        chunks = args.indicator_cache.record(key, chunks, headers["ETag"])
 
-    return PlainTextResponse(
-            "\n".join(row[0].get(term) for row in res)
-    )
+    # The generators are blocking, and are iterated in the threadpool
+    return StreamingResponse(chunks, media_type="text/plain", headers=headers)
 
 
 @ app.get("/download")
@@ -233,11 +463,11 @@ def download(id: constr(regex=r"^[0-9A-Fa-f]{64}$"),
         media_type=res.content_type)
 
 
-@ app.get("/download_json")
-def download_json(id: constr(regex=r"^[0-9A-Fa-f]{64}$"),
-                  args: argparse.Namespace = Depends(parse_args)) -> Union[Response, Dict]:
+@ app.get("/download_json", response_model=None)
+async def download_json(id: constr(regex=r"^[0-9A-Fa-f]{64}$"),
+                        args: argparse.Namespace = Depends(parse_args)) -> Union[Response, Dict]:
     """ Download document base64 decoded in json struct """
-    res = document_lookup(id, args.elasticsearch_client)
+    res = await run_in_threadpool(document_lookup, id, args.elasticsearch_client)
 
     if not os.path.isfile(res.filename):
         return {
@@ -245,14 +475,26 @@ def download_json(id: constr(regex=r"^[0-9A-Fa-f]{64}$"),
             "bytes": 0,
         }
 
-    content = open(res.filename, "rb").read()
+    return StreamingResponse(
+        stream_json(res.filename),
+        media_type="application/json")
+
+
+async def stream_json(filename: Text) -> AsyncIterator[bytes]:
+    """ Stream document base64 encoded in json struct, one chunk at a time """
+
+    header = {"error": None, "bytes": os.path.getsize(filename)}
+
+    yield json.dumps(header)[:-1].encode("utf8") + b', "content": "'
+
+    async with aiofiles.open(filename, "rb") as f:
+        while True:
+            chunk = await f.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            yield base64.b64encode(chunk)
 
-    return {
-        "error": None,
-        "bytes": len(content),
-        "content": base64.b64encode(content),
-        "encoding": "base64"
-    }
+    yield b'", "encoding": "base64"}'
 
 
 def main() -> None:
@@ -0,0 +1,87 @@
+"""Store for extracted documents.
+
+Extracted documents can be larger than the max job size of beanstalk. When a
+blob store is configured, scio-tika-server writes the extracted document to the
+store, and the job sent to scio-analyze only holds a pointer to it:
+
+    {"blob": "<sha256 of the blob>-<unique id>", "size": <size of the blob>}
+
+Blobs are stored in files named by the sha256 of their content and a unique id,
+sharded in two levels of directories (e.g. ab/cd/abcd...), so the store is
+shared by all workers without any coordination. Each job has its own blob, even
+if the same document is extracted twice, so scio-analyze can delete the blob
+after reading it."""
+
+from typing import Optional, Text
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import uuid
+
+# Magic bytes of gzip data, used to tell inline documents from blob pointers
+GZIP_MAGIC = b"\x1f\x8b"
+
+
+class BlobStore:
+    """Local blob store, sharded by sha256"""
+
+    def __init__(self, root: Text) -> None:
+        self.root = os.path.expanduser(root)
+        os.makedirs(self.root, exist_ok=True)
+
+    def path(self, name: Text) -> Text:
+        """Path of blob with name"""
+
+        return os.path.join(self.root, name[0:2], name[2:4], name)
+
+    def put(self, data: bytes) -> Text:
+        """Store data and return the name of the blob (the sha256 digest of data
+        and a unique id). Writes are atomic, so readers never see a partial blob"""
+
+        name = "{}-{}".format(hashlib.sha256(data).hexdigest(), uuid.uuid4().hex)
+        filename = self.path(name)
+
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+
+        with tempfile.NamedTemporaryFile(dir=os.path.dirname(filename), delete=False) as f:
+            f.write(data)
+
+        os.replace(f.name, filename)
+
+        return name
+
+    def get(self, name: Text) -> bytes:
+        """Return blob with name. Raises FileNotFoundError if the
+        blob does not exist"""
+
+        with open(self.path(name), "rb") as f:
+            return f.read()
+
+    def delete(self, name: Text) -> None:
+        """Delete blob with name, if it exists"""
+
+        try:
+            os.remove(self.path(name))
+        except FileNotFoundError:
+            pass
+
+    def pointer(self, data: bytes) -> Text:
+        """Store data and return the job body pointing to the blob"""
+
+        return json.dumps({"blob": self.put(data), "size": len(data)})
+
+
+def blob_name(body: bytes) -> Optional[Text]:
+    """Return name of the blob if body is a blob pointer, and
+    None if the document is inline (gzip compressed) in body"""
+
+    if body[:2] == GZIP_MAGIC:
+        return None
+
+    try:
+        return json.loads(body)["blob"]  # type: ignore
+    except (ValueError, KeyError, TypeError) as err:
+        logging.warning("Unable to decode blob pointer %s [%s ...]", err, body[:25])
+        return None
@@ -0,0 +1,158 @@
+"""Cache of uploaded documents, shared by scio-feeds and scio-upload.
+
+The cache is a sqlite database with one row per uploaded document, with a
+unique index on the sha256 of the document. The database is opened in WAL
+mode, so readers are not blocked by a writer, and inserts in a batch() are
+committed in a single transaction.
+
+Databases created by earlier versions have no index on sha256. They are
+migrated when opened: duplicate digests are removed (keeping the first
+upload) and the index is created. The schema version is tracked with
+PRAGMA user_version."""
+
+from contextlib import contextmanager
+from typing import Dict, Iterable, Iterator, List, Set, Text
+import logging
+import sqlite3
+
+# Max digests in each query of contains_many(), below the
+# default max number of variables of older sqlite versions (999)
+QUERY_BATCH = 500
+
+# Inserts in a batch() are committed for each COMMIT_BATCH inserts
+COMMIT_BATCH = 1000
+
+SCHEMA_VERSION = 1
+
+
+class Cache:
+    """Cache handles the caching database logic"""
+
+    def __init__(self, filename: Text = "upload.sqlite") -> None:
+        """Initiate database, creating connection to file"""
+
+        logging.info("Connecting to %s", filename)
+
+        self.conn = sqlite3.connect(filename)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+
+        self.conn.execute("""
+        CREATE TABLE IF NOT EXISTS upload (
+            id integer PRIMARY KEY,
+            filename text NOT NULL,
+            sha256 text NOT NULL,
+            description text)
+        """)
+
+        self.migrate()
+
+        self.in_batch = False
+        self.pending = 0
+
+    def migrate(self) -> None:
+        """Migrate database to the current schema version"""
+
+        version = self.conn.execute("PRAGMA user_version").fetchone()[0]
+
+        if version >= SCHEMA_VERSION:
+            return
+
+        logging.info("Migrating cache from version %s to %s", version, SCHEMA_VERSION)
+
+        with self.conn:
+            deleted = self.conn.execute("""
+            DELETE FROM upload WHERE id NOT IN (
+                SELECT MIN(id) FROM upload GROUP BY sha256)
+            """).rowcount
+
+            if deleted:
+                logging.info("Removed %s duplicate digests from cache", deleted)
+
+            self.conn.execute(
+                "CREATE UNIQUE INDEX IF NOT EXISTS upload_sha256 ON upload(sha256)")
+            self.conn.execute("PRAGMA user_version = {}".format(SCHEMA_VERSION))
+
+    def contains(self, sha256: Text) -> bool:
+        """Check if a particular digest is allready uploaded. Returns
+        True/False"""
+
+        cur = self.conn.execute("SELECT 1 FROM upload WHERE sha256 = ?", (sha256,))
+
+        if cur.fetchone():
+            logging.debug("Query for %s returns True", sha256)
+            return True
+
+        logging.debug("Query for %s returns False", sha256)
+        return False
+
+    def contains_many(self, digests: Iterable[Text]) -> Set[Text]:
+        """Return the digests that are allready uploaded"""
+
+        digests = list(set(digests))
+        found: Set[Text] = set()
+
+        for i in range(0, len(digests), QUERY_BATCH):
+            batch = digests[i:i + QUERY_BATCH]
+
+            sql = "SELECT sha256 FROM upload WHERE sha256 IN ({})".format(
+                ",".join("?" * len(batch)))
+
+            found.update(row[0] for row in self.conn.execute(sql, batch))
+
+        return found
+
+    def insert(self, filename: Text, sha256: Text, description: Text = "") -> None:
+        """insert a new file in the metadata cache. Digests that are
+        allready in the cache are ignored"""
+
+        logging.debug("Inserting %s, %s, %s into database",
+                      filename, sha256, description)
+
+        self.conn.execute(
+            "INSERT OR IGNORE INTO upload(filename, sha256, description) VALUES(?,?,?)",
+            (filename, sha256, description))
+
+        if not self.in_batch:
+            self.conn.commit()
+            return
+
+        self.pending += 1
+
+        if self.pending >= COMMIT_BATCH:
+            self.commit()
+
+    def commit(self) -> None:
+        """Commit pending inserts"""
+
+        self.conn.commit()
+        self.pending = 0
+
+    @contextmanager
+    def batch(self) -> Iterator["Cache"]:
+        """Context where inserts are committed in batches, and when
+        the context exits"""
+
+        self.in_batch = True
+
+        try:
+            yield self
+        finally:
+            self.in_batch = False
+            self.commit()
+
+    def info(self, sha256: Text) -> List[Dict]:
+        """Get stored info about a digest. Returns a list of Dictionaries"""
+
+        sql = "SELECT filename, sha256, description FROM upload WHERE sha256 = ?"
+
+        results = self.conn.execute(sql, (sha256,)).fetchall()
+        logging.debug("Found %d results for %s", len(results), sha256)
+
+        return [dict(zip(["filename", "sha256", "description"], result))
+                for result in results]
+
+    def close(self) -> None:
+        """Commit pending inserts and close the database"""
+
+        self.commit()
+        self.conn.close()
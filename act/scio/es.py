@@ -18,10 +18,19 @@ PERFORMANCE OF THIS SOFTWARE.
 Elasticsearch utilities for scio
 """
 
-from logging import debug
-from typing import Dict, Generator, List, Optional, Text, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from logging import debug, error, info, warning
+from typing import Any, Dict, Generator, List, Optional, Text, Tuple
+import hashlib
+import heapq
+import itertools
+import json
+import queue
+import threading
+import time
 
 import elasticsearch
+import elasticsearch.helpers
 import elasticsearch_dsl
 from elasticsearch import Elasticsearch
 from elasticsearch_dsl import A, Search
@@ -56,12 +65,17 @@ def query(client: elasticsearch.client.Elasticsearch,
           start: Text,
           end: Text,
           index: Text = "scio2",
-          size: int = 100) -> Search:
-    """ Return elasticsearch query """
+          size: int = 100,
+          timeout: Optional[float] = None) -> Search:
+    """ Return elasticsearch query. Index can be an index pattern,
+    and timeout is the request timeout in seconds """
 
     search = Search(using=client, index=index) \
         .extra(size=size)
 
+    if timeout:
+        search = search.params(request_timeout=timeout)
+
     # pylint: disable=no-member
     search = search.query("range", **{
         "Analyzed-Date": {
@@ -114,12 +128,26 @@ def aggregation(
         terms: List[Text],
         start: Text,
         end: Text,
-        missing:
-        bool = False) -> Generator[Tuple, None, None]:
-    """ Aggregation """
-    search = query(client, start, end, size=0)
+        missing: bool = False,
+        index: Text = "scio2",
+        size: int = 100,
+        timeout: Optional[float] = None,
+        slices: int = 1) -> Generator[Tuple, None, None]:
+    """ Aggregation over documents analyzed between start and end, paging
+    with size buckets per request.
+
+    If slices > 1, the time range is split in slices, aggregated in
+    parallel, and the sorted results are merged, adding the doc counts of
+    buckets found in more than one slice """
+
+    if slices > 1:
+        yield from parallel_aggregation(client, terms, start, end, missing, index, size,
+                                        timeout, slices)
+        return
+
+    search = query(client, start, end, index=index, size=0, timeout=timeout)
 
-    res = composite_aggs(search, terms, missing=missing)
+    res = composite_aggs(search, terms, size=size, missing=missing)
 
     for hit in res:
         path = hit.key.to_dict()
@@ -127,3 +155,468 @@ def aggregation(
         path["path"] = "/".join(path.values())
 
         yield (path, hit.doc_count)
+
+
+def time_slices(
+        client: elasticsearch.client.Elasticsearch,
+        start: Text,
+        end: Text,
+        slices: int,
+        index: Text = "scio2",
+        timeout: Optional[float] = None) -> List[Tuple[int, int]]:
+    """ Split the time range between the first and last document analyzed
+    between start and end in (at most) slices ranges of epoch milliseconds """
+
+    search = query(client, start, end, index=index, size=0, timeout=timeout)
+    search.aggs.metric("first", "min", field="Analyzed-Date")
+    search.aggs.metric("last", "max", field="Analyzed-Date")
+
+    res = search.execute()
+
+    if res.aggregations.first.value is None:
+        return []
+
+    first = int(res.aggregations.first.value)
+    last = int(res.aggregations.last.value)
+
+    step = -(-(last - first + 1) // slices)  # Rounded up
+
+    return [(slice_start, min(slice_start + step - 1, last))
+            for slice_start in range(first, last + 1, step)]
+
+
+# Pages of buckets buffered per slice in parallel aggregations
+SLICE_BUFFER = 4
+
+
+def parallel_aggregation(
+        client: elasticsearch.client.Elasticsearch,
+        terms: List[Text],
+        start: Text,
+        end: Text,
+        missing: bool = False,
+        index: Text = "scio2",
+        size: int = 100,
+        timeout: Optional[float] = None,
+        slices: int = 4) -> Generator[Tuple, None, None]:
+    """ Aggregation with the time range split in slices, paged in parallel.
+
+    Each slice is paged by a thread, putting pages of buckets on a bounded
+    queue, and the sorted slices are merged as the pages are read, so at
+    most SLICE_BUFFER pages per slice are held in memory """
+
+    ranges = time_slices(client, start, end, slices, index, timeout)
+
+    if not ranges:
+        return
+
+    # Set when the merge is done (or closed), to stop the threads
+    stop = threading.Event()
+
+    def put(pages: queue.Queue, item: Any) -> bool:
+        """Put item on pages, unless the merge is stopped while waiting for room"""
+
+        while not stop.is_set():
+            try:
+                pages.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+
+        return False
+
+    def aggregate_slice(time_range: Tuple[int, int], pages: queue.Queue) -> None:
+        """Put the buckets of time_range on pages, followed by None when done,
+        or the exception if the aggregation fails"""
+
+        page: List[Tuple] = []
+
+        try:
+            for row in aggregation(client, terms, str(time_range[0]), str(time_range[1]),
+                                   missing, index, size, timeout):
+                page.append(row)
+
+                if len(page) >= size:
+                    if not put(pages, page):
+                        return
+                    page = []
+
+            if put(pages, page):
+                put(pages, None)
+        except Exception as err:  # pylint: disable=broad-except
+            put(pages, err)
+
+    def slice_rows(pages: queue.Queue) -> Generator[Tuple, None, None]:
+        """Buckets of a slice, as they are read from pages"""
+
+        while True:
+            page = pages.get()
+
+            if page is None:
+                return
+
+            if isinstance(page, Exception):
+                raise page
+
+            yield from page
+
+    def sort_key(row: Tuple) -> Tuple:
+        # Composite aggregations are sorted by the terms, with missing values first
+        return tuple((row[0][term] is not None, row[0][term] or "") for term in terms)
+
+    queues: List[queue.Queue] = [queue.Queue(maxsize=SLICE_BUFFER) for _ in ranges]
+
+    with ThreadPoolExecutor(len(ranges)) as executor:
+        for time_range, pages in zip(ranges, queues):
+            executor.submit(aggregate_slice, time_range, pages)
+
+        try:
+            merged = heapq.merge(*[slice_rows(pages) for pages in queues], key=sort_key)
+
+            for _, group in itertools.groupby(merged, key=sort_key):
+                rows = list(group)
+
+                yield (rows[0][0], sum(doc_count for _, doc_count in rows))
+        finally:
+            stop.set()
+
+
+# Index with one document per indicator (type and value), maintained by scio-analyze
+INDICATOR_INDEX = "scio2-indicators"
+
+INDICATOR_MAPPING = {
+    "mappings": {
+        "properties": {
+            "type": {"type": "keyword"},
+            "value": {"type": "keyword"},
+            "first_seen": {"type": "date"},
+            "last_seen": {"type": "date"},
+            "count": {"type": "long"},
+            "documents": {"type": "keyword", "index": False, "doc_values": False},
+        }
+    }
+}
+
+# Number of documents (hexdigests) last counted, kept on each indicator
+INDICATOR_DOCUMENTS = 16
+
+# Update first_seen, last_seen and count of existing indicators. Bulk requests
+# failing with a connection error are retried, even if some of the updates
+# may have been applied. The documents last counted are kept on the indicator,
+# and a document already counted is not counted again, so a retried update
+# is not counted twice. first_seen and last_seen are always updated, and
+# updates not changing the indicator are noops.
+INDICATOR_SCRIPT = {
+    "lang": "painless",
+    "source": """
+        if (ctx._source.documents == null) {
+            ctx._source.documents = [];
+        }
+        boolean changed = false;
+        if (!ctx._source.documents.contains(params.document)) {
+            ctx._source.documents.add(params.document);
+            if (ctx._source.documents.size() > params.max_documents) {
+                ctx._source.documents.remove(0);
+            }
+            ctx._source.count += 1;
+            changed = true;
+        }
+        if (ctx._source.first_seen.compareTo(params.seen) > 0) {
+            ctx._source.first_seen = params.seen;
+            changed = true;
+        }
+        if (ctx._source.last_seen.compareTo(params.seen) < 0) {
+            ctx._source.last_seen = params.seen;
+            changed = true;
+        }
+        if (!changed) {
+            ctx.op = 'noop';
+        }
+    """,
+}
+
+
+def create_indicator_index(client: elasticsearch.client.Elasticsearch,
+                           index: Text = INDICATOR_INDEX) -> None:
+    """ Create indicator index with mapping, if it does not exist """
+
+    if not client.indices.exists(index=index):
+        info("Creating indicator index %s", index)
+        client.indices.create(index=index, body=INDICATOR_MAPPING, ignore=400)
+
+
+def indicator_id(indicator_type: Text, value: Text) -> Text:
+    """ Document id of indicator """
+
+    return hashlib.sha256("{}:{}".format(indicator_type, value).encode("utf8")).hexdigest()
+
+
+def backfill_indicators(client: elasticsearch.client.Elasticsearch,
+                        indexer: "BulkIndexer",
+                        source: Text = "scio2",
+                        index: Text = INDICATOR_INDEX,
+                        end: Optional[Text] = None) -> int:
+    """ Add the indicators of documents in source analyzed before end to the
+    indicator index. If end is not specified, documents analyzed before the
+    indicator index was created are added, since scio-analyze adds the
+    indicators of later documents. Returns the number of documents added """
+
+    create_indicator_index(client, index)
+
+    if end:
+        analyzed: Dict[Text, Any] = {"lt": end}
+    else:
+        settings = client.indices.get_settings(index=index, name="index.creation_date")
+        analyzed = {
+            "lt": next(iter(settings.values()))["settings"]["index"]["creation_date"],
+            "format": "epoch_millis",
+        }
+
+    body = {
+        "_source": ["hexdigest", "Analyzed-Date", "indicators"],
+        "query": {"range": {"Analyzed-Date": analyzed}},
+    }
+
+    debug("ES-query: {}".format(body))
+
+    documents = 0
+
+    for hit in elasticsearch.helpers.scan(client, index=source, query=body):
+        doc = hit["_source"]
+
+        if doc.get("indicators"):
+            indexer.index_indicators(index, doc["indicators"], doc["Analyzed-Date"],
+                                     doc.get("hexdigest") or hit["_id"])
+
+        documents += 1
+
+        if documents % 10000 == 0:
+            info("Added indicators of %s documents", documents)
+
+    indexer.flush()
+
+    return documents
+
+
+def index_state(client: elasticsearch.client.Elasticsearch,
+                index: Text,
+                filters: List[Dict],
+                date_field: Text,
+                timeout: Optional[float] = None) -> Text:
+    """ State of the documents in index matching filters: the number of documents
+    and the max of date_field. The state changes when documents are added or
+    updated (with a later date), or are no longer matching (e.g. expire from a
+    time range), and is used to derive ETags without reading all documents """
+
+    params = {"request_timeout": timeout} if timeout else {}
+
+    body = {
+        "size": 0,
+        "track_total_hits": True,
+        "query": {"bool": {"filter": filters}},
+        "aggs": {"max_date": {"max": {"field": date_field}}},
+    }
+
+    debug("ES-query: {}".format(body))
+
+    res = client.search(index=index, body=body, **params)
+
+    return "{}:{}".format(res["hits"]["total"]["value"], res["aggregations"]["max_date"]["value"])
+
+
+def indicator_filters(indicator_type: Text, start: Text, end: Text = "now") -> List[Dict]:
+    """ Filters of indicators of indicator_type last seen between start and end """
+
+    return [
+        {"term": {"type": indicator_type}},
+        {"range": {"last_seen": {"gte": start, "lte": end}}},
+    ]
+
+
+def indicator_values(client: elasticsearch.client.Elasticsearch,
+                     indicator_type: Text,
+                     start: Text,
+                     end: Text = "now",
+                     index: Text = INDICATOR_INDEX,
+                     size: int = 1000,
+                     timeout: Optional[float] = None) -> Generator[Text, None, None]:
+    """ Values of indicators of indicator_type last seen between start and end,
+    sorted by value. Pages through the results using search_after, with
+    size indicators per request """
+
+    params = {"request_timeout": timeout} if timeout else {}
+
+    body: Dict[Text, Any] = {
+        "size": size,
+        "_source": ["value"],
+        "query": {"bool": {"filter": indicator_filters(indicator_type, start, end)}},
+        "sort": [{"value": "asc"}],
+    }
+
+    while True:
+        debug("ES-query: {}".format(body))
+
+        hits = client.search(index=index, body=body, **params)["hits"]["hits"]
+
+        for hit in hits:
+            yield hit["_source"]["value"]
+
+        if len(hits) < size:
+            return
+
+        body["search_after"] = hits[-1]["sort"]
+
+
+# Status codes returned from elasticsearch that should be retried. 429 is returned
+# when elasticsearch rejects requests because its queues are full.
+RETRY_STATUS = {429, 502, 503, 504}
+
+
+class BulkError(Exception):
+    """Documents could not be stored to elasticsearch, even after retries"""
+
+
+class BulkIndexer:
+    """
+    Buffered bulk writer. Documents are buffered and sent to elasticsearch using the
+    bulk API when the buffer holds max_docs documents, max_bytes bytes, or when
+    flush_interval seconds has passed since the first document was buffered.
+
+    Items that elasticsearch rejects (e.g. with status 429) are retried with
+    exponential backoff. The retries block the caller, which gives backpressure
+    to the producer of the documents when elasticsearch is overloaded.
+    """
+
+    def __init__(self,
+                 client: elasticsearch.client.Elasticsearch,
+                 max_docs: int = 100,
+                 max_bytes: int = 10 * 1024 * 1024,
+                 flush_interval: float = 5.0,
+                 max_retries: int = 5,
+                 backoff: float = 1.0) -> None:
+
+        self.client = client
+        self.max_docs = max_docs
+        self.max_bytes = max_bytes
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.backoff = backoff
+
+        # List of (document id, action and source serialized as ndjson)
+        self.buffer: List[Tuple[Text, Text]] = []
+        self.buffer_bytes = 0
+        self.first_buffered: Optional[float] = None
+
+    def index(self, index: Text, doc_id: Text, body: Dict) -> None:
+        """Add document to the buffer, flushing the buffer if full"""
+
+        self.add(doc_id, {"index": {"_index": index, "_id": doc_id}}, body)
+
+    def upsert(self, index: Text, doc_id: Text, script: Dict, upsert: Dict) -> None:
+        """Add scripted update to the buffer. upsert is stored if the
+        document does not exist, otherwise the script is run"""
+
+        self.add(doc_id,
+                 {"update": {"_index": index, "_id": doc_id, "retry_on_conflict": 3}},
+                 {"script": script, "upsert": upsert})
+
+    def index_indicators(self, index: Text, indicators: Dict[Text, List[Text]],
+                         seen: Text, document: Text) -> None:
+        """Upsert the indicators of a document (hexdigest) to the indicator index,
+        with seen as the first/last seen timestamp of new indicators"""
+
+        params = {"seen": seen, "document": document, "max_documents": INDICATOR_DOCUMENTS}
+
+        for indicator_type, values in indicators.items():
+            for value in sorted(set(values)):
+                self.upsert(
+                    index,
+                    indicator_id(indicator_type, value),
+                    dict(INDICATOR_SCRIPT, params=params),
+                    {
+                        "type": indicator_type,
+                        "value": value,
+                        "first_seen": seen,
+                        "last_seen": seen,
+                        "count": 1,
+                        "documents": [document],
+                    })
+
+    def add(self, doc_id: Text, action: Dict, source: Optional[Dict] = None) -> None:
+        """Add bulk action (with optional source) to the buffer, flushing the buffer if full"""
+
+        lines = json.dumps(action) + "\n"
+        if source is not None:
+            lines += json.dumps(source) + "\n"
+
+        if not self.buffer:
+            self.first_buffered = time.monotonic()
+
+        self.buffer.append((doc_id, lines))
+        self.buffer_bytes += len(lines.encode("utf8"))
+
+        if len(self.buffer) >= self.max_docs \
+                or self.buffer_bytes >= self.max_bytes \
+                or self.due():
+            self.flush()
+
+    def due(self) -> bool:
+        """Return True if there are buffered documents older than flush_interval"""
+
+        if not self.buffer or self.first_buffered is None:
+            return False
+
+        return time.monotonic() - self.first_buffered >= self.flush_interval
+
+    def flush(self) -> None:
+        """Send all buffered documents to elasticsearch, retrying rejected items.
+        Raises BulkError if documents could not be stored after max_retries retries"""
+
+        pending = self.buffer
+        self.buffer = []
+        self.buffer_bytes = 0
+        self.first_buffered = None
+
+        for attempt in range(self.max_retries + 1):
+            if not pending:
+                return
+
+            if attempt:
+                delay = self.backoff * 2 ** (attempt - 1)
+                warning("Retrying %s documents in %s seconds", len(pending), delay)
+                time.sleep(delay)
+
+            pending = self._bulk(pending)
+
+        if pending:
+            raise BulkError("Unable to store {} documents to elasticsearch: {}".format(
+                len(pending), ", ".join(doc_id for doc_id, _ in pending)))
+
+    def _bulk(self, pending: List[Tuple[Text, Text]]) -> List[Tuple[Text, Text]]:
+        """Send documents using the bulk API. Return the documents that should be retried"""
+
+        try:
+            response = self.client.bulk(body="".join(lines for _, lines in pending))
+        except elasticsearch.exceptions.ConnectionError as err:
+            warning("Bulk request failed: %s", err)
+            return pending
+        except elasticsearch.exceptions.TransportError as err:
+            if err.status_code in RETRY_STATUS:
+                warning("Bulk request rejected: %s", err)
+                return pending
+            raise
+
+        retry = []
+
+        for item, entry in zip(response["items"], pending):
+            result: Dict[Text, Any] = next(iter(item.values()))
+            status = result.get("status", 0)
+
+            if status in RETRY_STATUS:
+                retry.append(entry)
+            elif status >= 300:
+                error("Error storing %s to elasticsearch: %s", entry[0], result.get("error"))
+            else:
+                info("Stored %s to elasticsearch", entry[0])
+
+        return retry
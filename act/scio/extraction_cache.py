@@ -0,0 +1,131 @@
+"""Persistent cache of Tika extractions.
+
+The same document is often submitted several times (e.g. downloaded by several
+feeds). The extracted text and metadata are stored in a local sqlite database,
+keyed by the sha256 hexdigest of the raw document, so scio-tika-server only
+sends each unique document to Tika once.
+
+When the total size of the cached extractions exceeds max_bytes, the least
+recently used extractions are evicted. Hits and misses are counted, and can be
+retrieved with stats()."""
+
+from typing import Any, Dict, Optional, Text
+import json
+import logging
+import sqlite3
+import threading
+import time
+import zlib
+
+
+class ExtractionCache:
+    """Content addressed cache of Tika extractions, shared by the worker threads"""
+
+    def __init__(self, filename: Text, max_bytes: int = 1024 * 1024 * 1024) -> None:
+
+        logging.info("Using extraction cache %s", filename)
+
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+        self.conn = sqlite3.connect(filename, check_same_thread=False)
+
+        self.conn.execute("""
+        CREATE TABLE IF NOT EXISTS extraction (
+            hexdigest text PRIMARY KEY,
+            data blob NOT NULL,
+            size integer NOT NULL,
+            last_access real NOT NULL)
+        """)
+        self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS extraction_last_access ON extraction(last_access)")
+        self.conn.commit()
+
+        self.size = self.conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM extraction").fetchone()[0]
+
+    def get(self, hexdigest: Text) -> Optional[Dict[Text, Any]]:
+        """Return cached extraction, or None if the document is not in the cache"""
+
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT data FROM extraction WHERE hexdigest = ?", (hexdigest,)).fetchone()
+
+            if not row:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+
+            self.conn.execute(
+                "UPDATE extraction SET last_access = ? WHERE hexdigest = ?",
+                (time.time(), hexdigest))
+            self.conn.commit()
+
+        return json.loads(zlib.decompress(row[0]))  # type: ignore
+
+    def put(self, hexdigest: Text, data: Dict[Text, Any]) -> None:
+        """Store extraction in the cache, evicting the least recently used
+        extractions if the cache is full"""
+
+        compressed = zlib.compress(json.dumps(data).encode("utf8"))
+
+        with self.lock:
+            old = self.conn.execute(
+                "SELECT size FROM extraction WHERE hexdigest = ?", (hexdigest,)).fetchone()
+
+            self.conn.execute(
+                "INSERT OR REPLACE INTO extraction VALUES (?, ?, ?, ?)",
+                (hexdigest, compressed, len(compressed), time.time()))
+            self.conn.commit()
+
+            self.size += len(compressed) - (old[0] if old else 0)
+
+            if self.size > self.max_bytes:
+                self.evict()
+
+    def evict(self) -> None:
+        """Remove the least recently used extractions, until the cache
+        is below 90% of max_bytes. Must be called with the lock held"""
+
+        target = self.max_bytes * 0.9
+        evicted = 0
+
+        while self.size > target:
+            rows = self.conn.execute(
+                "SELECT hexdigest, size FROM extraction ORDER BY last_access LIMIT 100").fetchall()
+
+            if not rows:
+                break
+
+            for hexdigest, size in rows:
+                if self.size <= target:
+                    break
+                self.conn.execute("DELETE FROM extraction WHERE hexdigest = ?", (hexdigest,))
+                self.size -= size
+                evicted += 1
+
+        self.conn.commit()
+
+        logging.info("Evicted %s extractions from extraction cache", evicted)
+
+    def stats(self) -> Dict[Text, float]:
+        """Return hits, misses, hit rate and size of the cache"""
+
+        with self.lock:
+            lookups = self.hits + self.misses
+
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "bytes": self.size,
+            }
+
+    def close(self) -> None:
+        """Close the database connection"""
+
+        with self.lock:
+            self.conn.close()
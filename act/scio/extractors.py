@@ -0,0 +1,197 @@
+"""In-process text extraction for text based formats.
+
+Plain text, HTML, XML, JSON and CSV do not need the Tika JVM, and most documents
+from scio-feeds are HTML. The extractors return the same shape as
+tika.parser.from_buffer ({"status": ..., "content": ..., "metadata": ...}), so
+scio-tika-server only sends binary formats (PDF, office documents etc.) to Tika."""
+
+from html.parser import HTMLParser
+from typing import Any, Callable, Dict, List, Optional, Text, Tuple
+import mimetypes
+import re
+
+# Elements where the text is not part of the document content
+SKIP_ELEMENTS = {"script", "style", "noscript", "template"}
+
+# Elements starting a new line in the content
+BLOCK_ELEMENTS = {
+    "address", "article", "aside", "blockquote", "br", "dd", "div", "dl", "dt",
+    "fieldset", "figcaption", "figure", "footer", "form", "h1", "h2", "h3", "h4", "h5",
+    "h6", "header", "hr", "li", "main", "nav", "ol", "p", "pre", "section", "table",
+    "td", "th", "title", "tr", "ul",
+}
+
+# Elements without end tag
+VOID_ELEMENTS = {
+    "area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta",
+    "param", "source", "track", "wbr",
+}
+
+PARSED_BY = "act.scio.extractors"
+
+
+class TextExtractor(HTMLParser):  # pylint: disable=abstract-method
+    """Collect text and metadata from HTML or XML.
+
+    If xml is True, every element starts a new line, otherwise only block elements do."""
+
+    def __init__(self, xml: bool = False) -> None:
+        super().__init__(convert_charrefs=True)
+        self.xml = xml
+        self.parts: List[Text] = []
+        self.skip: List[Text] = []  # Open elements with skipped text
+        self.in_title = False
+        self.title: List[Text] = []
+        self.meta: Dict[Text, Text] = {}
+
+    def handle_starttag(self, tag: Text, attrs: List[Tuple[Text, Optional[Text]]]) -> None:
+        if tag == "meta":
+            attributes = dict(attrs)
+            name = attributes.get("name") or attributes.get("property")
+            if name and attributes.get("content") is not None:
+                self.meta[name] = attributes["content"]  # type: ignore
+            return
+
+        if tag == "title":
+            self.in_title = True
+
+        if not self.xml and tag in SKIP_ELEMENTS and tag not in VOID_ELEMENTS:
+            self.skip.append(tag)
+
+        if self.xml or tag in BLOCK_ELEMENTS:
+            self.parts.append("\n")
+
+    def handle_endtag(self, tag: Text) -> None:
+        if tag == "title":
+            self.in_title = False
+
+        if self.skip and self.skip[-1] == tag:
+            self.skip.pop()
+
+        if self.xml or tag in BLOCK_ELEMENTS:
+            self.parts.append("\n")
+
+    def handle_data(self, data: Text) -> None:
+        if self.in_title:
+            self.title.append(data)
+
+        if not self.skip:
+            self.parts.append(data)
+
+    def text(self) -> Text:
+        """Extracted text, with whitespace normalized within lines"""
+
+        lines = [re.sub(r"[ \t\r\f\v]+", " ", line).strip()
+                 for line in "".join(self.parts).split("\n")]
+
+        return "\n".join(line for line in lines if line)
+
+
+def decode(content: bytes, charset: Optional[Text] = None) -> Tuple[Text, Text]:
+    """Decode content, trying charset (if specified) and utf-8 before
+    falling back to windows-1252. Returns text and the encoding used"""
+
+    for encoding in [charset, "utf-8"]:
+        if not encoding:
+            continue
+        try:
+            return content.decode(encoding).lstrip("\ufeff"), encoding.upper()
+        except (UnicodeDecodeError, LookupError):
+            continue
+
+    return content.decode("windows-1252", errors="replace"), "WINDOWS-1252"
+
+
+def html_charset(content: bytes) -> Optional[Text]:
+    """Charset declared in a meta element within the first 1024 bytes"""
+
+    match = re.search(rb"""<meta[^>]+charset=["']?([-\w]+)""", content[:1024], re.I)
+
+    return match.group(1).decode("ascii") if match else None
+
+
+def result(text: Text,
+           mime: Text,
+           encoding: Text,
+           metadata: Optional[Dict[Text, Any]] = None) -> Dict[Text, Any]:
+    """Return extraction in the same shape as tika.parser.from_buffer"""
+
+    metadata = dict(metadata or {})
+    metadata.update({
+        "Content-Type": "{}; charset={}".format(mime, encoding),
+        "Content-Encoding": encoding,
+        "X-Parsed-By": PARSED_BY,
+    })
+
+    return {"status": 200, "content": text, "metadata": metadata}
+
+
+def extract_text(content: bytes, mime: Text) -> Dict[Text, Any]:
+    """Extract plain text, JSON and CSV, where the content is the text itself"""
+
+    text, encoding = decode(content)
+
+    return result(text, mime, encoding)
+
+
+def extract_html(content: bytes, mime: Text) -> Dict[Text, Any]:
+    """Extract text, title and meta elements from HTML"""
+
+    text, encoding = decode(content, html_charset(content))
+
+    parser = TextExtractor()
+    parser.feed(text)
+    parser.close()
+
+    metadata = dict(parser.meta)
+    title = " ".join("".join(parser.title).split())
+
+    if title:
+        metadata["title"] = title
+        metadata["dc:title"] = title
+
+    return result(parser.text(), mime, encoding, metadata)
+
+
+def extract_xml(content: bytes, mime: Text) -> Dict[Text, Any]:
+    """Extract text from XML"""
+
+    text, encoding = decode(content)
+
+    parser = TextExtractor(xml=True)
+    parser.feed(text)
+    parser.close()
+
+    return result(parser.text(), mime, encoding)
+
+
+EXTRACTORS: Dict[Text, Callable[[bytes, Text], Dict[Text, Any]]] = {
+    "text/plain": extract_text,
+    "text/csv": extract_text,
+    "application/csv": extract_text,
+    "application/json": extract_text,
+    "text/html": extract_html,
+    "application/xhtml+xml": extract_html,
+    "text/xml": extract_xml,
+    "application/xml": extract_xml,
+}
+
+
+def extract(content: bytes, mime: Text, filename: Text = "") -> Optional[Dict[Text, Any]]:
+    """Extract content with the in-process extractor for mime. Returns None if
+    there is no extractor for mime, and the content should be sent to Tika.
+
+    libmagic reports text/plain for any text it does not recognize (e.g. HTML
+    fragments), so text/plain is only trusted if the type from the filename
+    agrees, otherwise the extractor for the type of the filename is used.
+    Documents of unknown type are sent to Tika."""
+
+    if mime == "text/plain":
+        mime = mimetypes.guess_type(filename)[0] or ""
+
+    extractor = EXTRACTORS.get(mime)
+
+    if not extractor:
+        return None
+
+    return extractor(content, mime)
@@ -16,86 +16,10 @@ TORTIOUS ACTION, ARISING OUT OF OR IN CONNECTION WITH THE USE OR
 PERFORMANCE OF THIS SOFTWARE.
 
 ---
-Program to check the feed output directory of feed_downloader.py
-Any downloaded content not found in the cache is handled.
-The .meta files associated with the .html files from the feed download is
-kept to preserve information about source and original titles as well as
-feed time and date stamps.
-This files builds a document understood by SCIOs 'doc' work queue.
-This utility is not meant to handle the files downloaded from links _in_ the
-feed as these document does not share any of the meta-data associated with
-the feed entries. These files need to be handled separately (using SCIOs own
-submit utility.
+Cache of uploaded feed documents. The cache is shared with scio-upload,
+and implemented in act.scio.cache.
 """
 
-import logging
-import sqlite3
+from act.scio.cache import Cache
 
-from typing import (
-    Dict,
-    List,
-    Text,
-)
-
-
-class Cache:
-    """Cache handles the caching database logic"""
-
-    def __init__(self, filename: Text = "upload.sqlite"):
-        """Initiate database, creating connection to file"""
-
-        logging.info("Connecting to %s", filename)
-        self.conn = sqlite3.connect(filename)
-        try:
-            # create table if it does not exsit
-            self.conn.execute("""CREATE TABLE upload (
-                                              id integer PRIMARY KEY,
-                                              filename text NOT NULL,
-                                              sha256 text NOT NULL,
-                                              description text);
-                              """)
-        except sqlite3.OperationalError:
-            pass
-
-    def contains(self, sha256: Text) -> bool:
-        """Check if a particular digest is allready uploaded. Returns
-        True/False"""
-
-        sql = "SELECT * FROM upload WHERE sha256 = ?"
-
-        cur = self.conn.execute(sql, (sha256,))
-
-        if cur.fetchall():
-            logging.debug("Query for %s returns True", sha256)
-            return True
-
-        logging.debug("Query for %s returns False", sha256)
-        return False
-
-    def insert(self, filename: Text, sha256: Text, description: Text = "") -> None:
-        """insert a new file in the metadata cache"""
-
-        sql = "INSERT INTO upload(filename, sha256, description) VALUES(?,?,?)"
-        logging.debug("Inserting %s, %s, %s into database",
-                      filename, sha256, description)
-        self.conn.execute(sql, (filename, sha256, description))
-        self.conn.commit()
-
-    def info(self, sha256: Text) -> List[Dict]:
-        """Get stored info about a digest. Returns a list of Dictionaries"""
-
-        sql = "SELECT filename, sha256, description FROM upload WHERE sha256 = ?" # NOQA
-
-        cur = self.conn.execute(sql, (sha256,))
-
-        results = cur.fetchall()
-        logging.debug("Found %d resultsults for %s", len(results), sha256)
-
-        result_dictionaries = []
-
-        for result in results:
-            key_value_pairs = list(zip(["filename", "sha256", "description"],
-                                       result))
-            result_dictionaries.append(dict(key_value_pairs))
-
-        return result_dictionaries
+__all__ = ["Cache"]
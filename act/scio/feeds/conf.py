@@ -29,6 +29,27 @@ def get_args() -> argparse.Namespace:
                         type=str, help=f"feed urls (one pr. line). Default: {XDG_CONFIG}/scio/etc/feeds.txt")
     parser.add_argument("--cache", default=caep.get_cache_dir("scio-feeds/cache.db"),
                         help=f"sqlite db containing cached hashes. Default = {XDG_CACHE}/scio-feeds/cache.db")
+    parser.add_argument("--feed-state", default=caep.get_cache_dir("scio-feeds/state.db"),
+                        help="sqlite db with the state of the feeds, used to skip " +
+                        "unmodified feeds. Set to empty value to always download " +
+                        f"the feeds. Default = {XDG_CACHE}/scio-feeds/state.db")
+    parser.add_argument("--seen-retention", type=float, default=30,
+                        help="Days feed entries are remembered after they were last " +
+                        "in the feed. Default = 30")
+    parser.add_argument("--engine", choices=["threads", "async"], default="threads",
+                        help="Download feeds in a pool of threads, one feed per thread, " +
+                        "or with the asyncio crawler, downloading entries and links of " +
+                        "all feeds concurrently. Default = threads")
+    parser.add_argument("--max-connections", type=int, default=32,
+                        help="Max concurrent downloads. Default = 32")
+    parser.add_argument("--host-connections", type=int, default=2,
+                        help="Max concurrent downloads from each host. Default = 2")
+    parser.add_argument("--host-rate", type=float, default=0,
+                        help="Max requests per second to each host (0 is unlimited). " +
+                        "Default = 0")
+    parser.add_argument("--retries", type=int, default=3,
+                        help="Retries of failed downloads, honouring Retry-After. " +
+                        "Default = 3")
     parser.add_argument("--scio", help="Upload to scio engine API url. " +
                         "Set to empty value to not upload files.",
                         default="http://localhost:3000/submit")
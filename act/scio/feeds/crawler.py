@@ -0,0 +1,152 @@
+"""asyncio based crawler engine for scio-feeds (--engine async).
+
+The thread based engine handles each feed in one thread, downloading the
+articles and linked documents of the feed one at a time. The crawler runs
+every feed fetch, entry (article) fetch and link download as a separate task,
+so a feed with many links does not hold up the other feeds.
+
+The downloads use the same functions (and the same scheduler) as the thread
+based engine, run in a thread pool bounded by --max-connections, and the
+result is the same list of {"filename": ..., "uri": ...} file maps.
+
+Requests wait for a slot of their host (--host-connections) in the event loop,
+before they are sent to the thread pool, so requests queued for a busy host
+(waiting for the rate limit or retry backoff) never hold the threads needed by
+requests to other hosts."""
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Text
+import argparse
+import asyncio
+import collections
+import logging
+import urllib.parse
+
+from act.scio.feeds import download
+from act.scio.feeds.state import entry_key
+
+
+class Crawler:
+    """Crawl feeds, running blocking calls in a bounded thread pool"""
+
+    def __init__(self, args: argparse.Namespace) -> None:
+        self.args = args
+        self.executor = ThreadPoolExecutor(max_workers=args.max_connections)
+        self.hosts: Dict[Text, asyncio.Semaphore] = collections.defaultdict(
+            lambda: asyncio.Semaphore(args.host_connections))
+
+    async def run(self, func: Callable, *args: Any) -> Any:
+        """Run func(*args) in the thread pool"""
+
+        loop = asyncio.get_running_loop()
+
+        return await loop.run_in_executor(self.executor, func, *args)
+
+    async def fetch(self, url: Optional[Text], func: Callable, *args: Any) -> Any:
+        """Run func(*args), requesting url, in the thread pool when there is
+        a free slot for the host of url"""
+
+        if not url:
+            return await self.run(func, *args)
+
+        async with self.hosts[urllib.parse.urlparse(url).netloc.lower()]:
+            return await self.run(func, *args)
+
+    async def crawl_entry(self, feed_url: Text, entry: Dict, partial: bool) -> List[Dict]:
+        """Handle entry and download the linked documents concurrently"""
+
+        # Partial entries are completed by downloading the linked page
+        entry_file, links = await self.fetch(
+            entry.get("link") if partial else None,
+            download.handle_entry, self.args, feed_url, entry, partial)
+
+        if not entry_file:
+            return []
+
+        link_files = await asyncio.gather(
+            *[self.fetch(link.geturl(), download.download_link, self.args, feed_url, link)
+              for link in links])
+
+        return [entry_file] + [link_file for link_file in link_files if link_file]
+
+    async def crawl_feed(self, feed_url: Text, partial: bool) -> List[Dict]:
+        """Download feed and handle all unseen entries concurrently"""
+
+        status, req, feed = await self.fetch(feed_url, download.open_feed, self.args, feed_url)
+
+        if status != "OK" or req is None:
+            logging.info("Feed (%s) returned %s", feed_url, status)
+            return []
+
+        entries, seen = await self.run(download.unseen_entries, self.args, feed_url, feed)
+
+        results = await asyncio.gather(
+            *[self.crawl_entry(feed_url, entry, partial) for entry in entries],
+            return_exceptions=True)
+
+        files: List[Dict] = []
+        complete = True
+
+        for entry, result in zip(entries, results):
+            if isinstance(result, Exception):
+                logging.error("%s: entry %s generated an exception: %s",
+                              feed_url, entry.get("title", "NA"), result)
+                complete = False
+                continue
+
+            if not result:
+                complete = False
+                continue
+
+            key = entry_key(entry)
+            if key:
+                seen.append(key)
+
+            files += result
+
+        # Failed entries are not marked as seen, and the validators of the feed are
+        # not kept, so the feed is not skipped as not modified and they are retried
+        await self.run(download.finish_feed, self.args, feed_url, req, seen, files, complete)
+
+        logging.info("Feed (%s) returned %s with %s files", feed_url, status, len(files))
+
+        return files
+
+    async def crawl(self, full_feeds: List[Text], partial_feeds: List[Text]) -> List[Dict]:
+        """Crawl all feeds. Returns the downloaded files"""
+
+        feeds = [(url, False) for url in full_feeds] + [(url, True) for url in partial_feeds]
+
+        results = await asyncio.gather(
+            *[self.crawl_feed(url, partial) for url, partial in feeds],
+            return_exceptions=True)
+
+        files: List[Dict] = []
+
+        for (url, _), result in zip(feeds, results):
+            if isinstance(result, Exception):
+                logging.error("%r generated an exception: %s", url, result,
+                              exc_info=(type(result), result, result.__traceback__))
+                continue
+
+            files += result
+
+        return files
+
+    def close(self) -> None:
+        """Shut down the thread pool"""
+
+        self.executor.shutdown()
+
+
+def crawl(args: argparse.Namespace,
+          full_feeds: List[Text],
+          partial_feeds: List[Text]) -> List[Dict]:
+    """Crawl full and partial feeds with the async engine"""
+
+    crawler = Crawler(args)
+
+    try:
+        return asyncio.run(crawler.crawl(full_feeds, partial_feeds))
+    finally:
+        crawler.close()
@@ -1,6 +1,6 @@
 """Helper functions related to downloading feeds and files"""
 
-from typing import Text, Optional, Any, Dict, cast, List, Tuple
+from typing import Text, Optional, Any, Callable, Dict, cast, List, Tuple, TypeVar
 import argparse
 import concurrent.futures
 import logging
@@ -12,6 +12,34 @@ import urllib.parse
 import feedparser  # type: ignore
 
 from act.scio.feeds import analyze, extract
+from act.scio.feeds.scheduler import Scheduler
+from act.scio.feeds.state import FeedUpdate, Validator, entry_key
+
+T = TypeVar("T")
+
+
+def http_get(scheduler: Optional[Scheduler], url: Text, **kwargs: Any) -> requests.Response:
+    """GET url using the scheduler, or a plain request if scheduler is None"""
+
+    if scheduler:
+        return scheduler.get(url, **kwargs)
+
+    return requests.get(url, **kwargs)
+
+
+def http_fetch(scheduler: Optional[Scheduler],
+               url: Text,
+               handle: Callable[[requests.Response], T],
+               **kwargs: Any) -> T:
+    """GET url with a streamed response, and return handle(response). The body
+    must be read by handle, which with a scheduler is called while the request
+    holds its slots and session"""
+
+    if scheduler:
+        return scheduler.fetch(url, handle, stream=True, **kwargs)
+
+    with requests.get(url, stream=True, **kwargs) as response:
+        return handle(response)
 
 
 def download_and_store(
@@ -19,7 +47,8 @@ def download_and_store(
         ignore_file: Optional[Text],
         storage_path: Text,
         proxy_string: Optional[Text],
-        link: urllib.parse.ParseResult) -> Dict:
+        link: urllib.parse.ParseResult,
+        scheduler: Optional[Scheduler] = None) -> Dict:
     """Download and store a link. Storage defined in args"""
 
     # check if the actual url is in the ignore file. If so, no download will take place.
@@ -38,13 +67,40 @@ def download_and_store(
         logging.info("possible relative path %s, trying to append host: %s",
                      link.path, parsed_feed_url.netloc)
 
+    def store(req: requests.Response) -> Dict:
+        """Write the streamed body of req to the download directory"""
+
+        if req.status_code >= 400:
+            logging.info("Status %s - %s", req.status_code, link)
+            return {}
+
+        basename = extract.safe_filename(os.path.basename(link.path))
+        fname = os.path.join(storage_path,
+                             "download",
+                             basename)
+
+        # check if the filename on disk is in the ignore file. If so, do not return filename
+        # for upload. This differ from URL in the ignore file as the file is in fact downloaded
+        # by the feed worker, but not uploaded to Scio.
+        if analyze.in_ignore_file(basename, ignore_file):
+            logging.info("Ignoring %s based on %s", fname, ignore_file)
+            return {}
+
+        with open(fname, "wb") as download_file:
+            logging.info("Writing %s", fname)
+            req.raw.decode_content = True
+            shutil.copyfileobj(req.raw, download_file)
+
+        return {'filename': fname, 'uri': link.geturl()}
+
     try:
-        req = requests.get(link.geturl(),
-                           proxies=proxies(proxy_string),
-                           headers=default_headers(),
-                           verify=False,
-                           stream=True,
-                           timeout=60)
+        return http_fetch(scheduler,
+                          link.geturl(),
+                          store,
+                          proxies=proxies(proxy_string),
+                          headers=default_headers(),
+                          verify=False,
+                          timeout=60)
     except requests.exceptions.ReadTimeout:
         logging.info("%s timed out", link.geturl())
         return {}
@@ -55,42 +111,29 @@ def download_and_store(
         logging.info("%s missing schema", link.geturl())
         return {}
 
-    if req.status_code >= 400:
-        logging.info("Status %s - %s", req.status_code, link)
-        return {}
-
-    basename = extract.safe_filename(os.path.basename(link.path))
-    fname = os.path.join(storage_path,
-                         "download",
-                         basename)
-
-    # check if the filename on disk is in the ignore file. If so, do not return filename
-    # for upload. This differ from URL in the ignore file as the file is in fact downloaded by
-    # the feed worker, but not uploaded to Scio.
-    if analyze.in_ignore_file(basename, ignore_file):
-        logging.info("Ignoring %s based on %s", fname, ignore_file)
-        return {}
-
-    with open(fname, "wb") as download_file:
-        logging.info("Writing %s", fname)
-        req.raw.decode_content = True
-        shutil.copyfileobj(req.raw, download_file)
-
-    return {'filename': fname, 'uri': link.geturl()}
-
 
-def get_feed(feed_url: Text, proxy_string: Optional[Text] = None) -> Any:
-    """Download and parse a feed"""
+def fetch_feed(feed_url: Text,
+               proxy_string: Optional[Text] = None,
+               validator: Optional[Validator] = None,
+               scheduler: Optional[Scheduler] = None) -> Optional[requests.Response]:
+    """Download a feed. If validator is specified, the request is conditional
+    on the feed being modified since the validator was stored"""
 
     feed_url = feed_url.strip()
 
     logging.info("Opening feed : %s", feed_url)
 
+    headers = default_headers()
+
+    if validator:
+        headers.update(validator.headers())
+
     try:
-        req = requests.get(
+        req = http_get(
+            scheduler,
             feed_url,
             proxies=proxies(proxy_string),
-            headers=default_headers(),
+            headers=headers,
             verify=False,
             timeout=60)
     except requests.exceptions.ReadTimeout:
@@ -103,6 +146,17 @@ def get_feed(feed_url: Text, proxy_string: Optional[Text] = None) -> Any:
         logging.error("%s missing schema", feed_url)
         return None
 
+    return req
+
+
+def get_feed(feed_url: Text, proxy_string: Optional[Text] = None) -> Any:
+    """Download and parse a feed"""
+
+    req = fetch_feed(feed_url, proxy_string)
+
+    if req is None:
+        return None
+
     return feedparser.parse(req.text)
 
 
@@ -128,6 +182,118 @@ def default_headers() -> Dict:
     return cast(Dict, headers)
 
 
+def open_feed(args: argparse.Namespace,
+              feed_url: Text) -> Tuple[Text, Optional[requests.Response], Any]:
+    """Download and parse a feed. Returns the status ("OK", "NOT FEED" or
+    "NOT MODIFIED"), the response and the parsed feed"""
+
+    validator = args.feed_state.validator(feed_url) if args.feed_state else None
+
+    req = fetch_feed(feed_url, args.proxy_string, validator, args.scheduler)
+
+    if req is None:
+        return "NOT FEED", None, None
+
+    if validator and validator.not_modified(req):
+        logging.info("%s not modified", feed_url)
+        # The entries are still in the feed, so they should not expire
+        args.feed_state.defer(FeedUpdate(feed_url, None, [], [], refresh=True))
+        return "NOT MODIFIED", req, None
+
+    feed = feedparser.parse(req.text)
+
+    logging.info("%s contains %s entries",
+                 feed_url,
+                 len(feed["entries"]))
+
+    return "OK", req, feed
+
+
+def unseen_entries(args: argparse.Namespace,
+                   feed_url: Text,
+                   feed: Any) -> Tuple[List[Dict], List[Text]]:
+    """Split the entries of the feed in entries to handle, and the
+    keys of entries seen in earlier runs"""
+
+    entries: List[Dict] = []
+    seen: List[Text] = []
+
+    for entry in feed["entries"]:
+        key = entry_key(entry)
+
+        if args.feed_state and key and args.feed_state.seen(feed_url, key):
+            logging.debug("Skipping seen entry %s", key)
+            seen.append(key)
+        else:
+            entries.append(entry)
+
+    return entries, seen
+
+
+def handle_entry(args: argparse.Namespace,
+                 feed_url: Text,
+                 entry: Dict,
+                 partial: bool) -> Tuple[Dict, List[urllib.parse.ParseResult]]:
+    """Write the entry content to disk, downloading the full original web
+    page if partial. Returns the file (empty if the entry returned no
+    filename) and the links to documents that should be downloaded"""
+
+    filename, html_data = (extract.partial_entry_text_to_file(args, entry) if partial else
+                           extract.entry_text_to_file(args, entry))
+
+    if not filename:
+        logging.info('entry "%s" [partial=%s] returned no filename',
+                     entry.get('title', 'NA'), partial)
+        return {}, []
+
+    entry_file = {'filename': filename, 'uri': feed_url}
+    logging.debug('Added entry %s to list of files', entry_file)
+
+    if not html_data:
+        return entry_file, []
+
+    links = extract.get_links(entry, html_data)
+
+    # Download all urls that looks like they have the correct file extension
+    return entry_file, list(analyze.filter_links(args.file_format, links))
+
+
+def download_link(args: argparse.Namespace,
+                  feed_url: Text,
+                  link: urllib.parse.ParseResult) -> Dict:
+    """Download and store a document linked from a feed entry"""
+
+    return download_and_store(feed_url,
+                              args.ignore,
+                              args.store_path,
+                              args.proxy_string,
+                              link,
+                              args.scheduler)
+
+
+def finish_feed(args: argparse.Namespace,
+                feed_url: Text,
+                req: requests.Response,
+                seen: List[Text],
+                files: List[Dict],
+                complete: bool = True) -> None:
+    """Keep the validators of the feed, the seen entries and the downloaded files
+    as a pending update of the feed state. Only call this when all entries are
+    handled. The update is stored when the files are uploaded, so the feed is
+    handled again on the next run if this run or the upload fails.
+
+    If not complete (some entries failed), the validators are not kept, so the
+    feed is not skipped as not modified, and the failed entries are retried
+    on the next run"""
+
+    if args.feed_state and req.status_code == 200:
+        args.feed_state.defer(FeedUpdate(
+            feed_url,
+            Validator.from_response(req) if complete else None,
+            seen,
+            [file_map["filename"] for file_map in files if file_map]))
+
+
 def handle_feed(args: argparse.Namespace,
                 feed_url: Text,
                 partial: bool) -> Tuple[Text, Text, List[Dict]]:
@@ -136,47 +302,41 @@ def handle_feed(args: argparse.Namespace,
     if specified in the arguments and write the feed entry content
     to disk together with a meta data json file"""
 
-    feed = get_feed(feed_url, args.proxy_string)
+    status, req, feed = open_feed(args, feed_url)
 
-    if not feed:
-        return "NOT FEED", feed_url, []
+    if status != "OK" or req is None:
+        return status, feed_url, []
 
     files: List[Dict] = []
+    complete = True
 
-    logging.info("%s contains %s entries",
-                 feed_url,
-                 len(feed["entries"]))
+    # Entries handled in this run, or in earlier runs
+    entries, seen = unseen_entries(args, feed_url, feed)
 
-    for entry_n, entry in enumerate(feed["entries"]):
+    for entry_n, entry in enumerate(entries):
         logging.info("Handling : %s of %s : %s",
-                     entry_n, len(feed["entries"]), entry.get('title', f"No title : {feed_url}"))
-
-        filename, html_data = (extract.partial_entry_text_to_file(args, entry) if partial else
-                               extract.entry_text_to_file(args, entry))
-        if filename:
-            entry = {'filename': filename, 'uri': feed_url}
-            files.append(entry)
-            logging.debug('Added entry %s to list of files', entry)
-        else:
-            logging.info('entry "%s" [partial=%s] returned no filename',
-                         entry.get('title', 'NA'), partial)
+                     entry_n, len(entries), entry.get('title', f"No title : {feed_url}"))
 
-        if not (filename and html_data):
+        entry_file, links = handle_entry(args, feed_url, entry, partial)
+
+        if not entry_file:
+            complete = False
             continue
 
-        links = extract.get_links(entry, html_data)
+        key = entry_key(entry)
+        if key:
+            seen.append(key)
+
+        files.append(entry_file)
+
+        # Add the filenames of the downloaded files to the list of candidates to upload.
+        files.extend(download_link(args, feed_url, link) for link in links)
+
+    files = list(filter(None, files))
 
-        # Download all urls that looks like they have the correct file extension
-        # and add the filenames of the downloaded files to the list of candidates
-        # to upload.
-        files.extend(download_and_store(feed_url,
-                                        args.ignore,
-                                        args.store_path,
-                                        args.proxy_string,
-                                        link)
-                     for link in analyze.filter_links(args.file_format, links))
+    finish_feed(args, feed_url, req, seen, files, complete)
 
-    return "OK", feed_url, list(filter(None, files))
+    return "OK", feed_url, files
 
 
 def download_feed_list(
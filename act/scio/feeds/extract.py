@@ -9,7 +9,6 @@ import urllib.parse
 from bs4 import BeautifulSoup
 import html
 import justext
-import requests
 import uuid
 
 from act.scio.feeds import download, analyze
@@ -96,7 +95,8 @@ def partial_entry_text_to_file(
 
     url = entry["link"]
 
-    req = requests.get(
+    req = download.http_get(
+        args.scheduler,
         url,
         proxies=download.proxies(args.proxy_string),
         headers=download.default_headers(),
@@ -20,8 +20,9 @@ Download feeds from the feeds.txt file, store feed content in .html and feed
 metadata in .meta files. Also attempts to download links to certain document
 types"""
 
-from typing import List, Text, Dict
+from typing import List, Text, Dict, Tuple
 
+import argparse
 import datetime
 import hashlib
 import logging
@@ -29,7 +30,9 @@ import os
 import urllib3
 
 from act.scio.config import get_cache_dir
-from act.scio.feeds import conf, download, cache, upload
+from act.scio.feeds import conf, crawler, download, cache, upload
+from act.scio.feeds.scheduler import Scheduler
+from act.scio.feeds.state import FeedState
 from act.scio.logsetup import setup_logging
 
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
@@ -43,30 +46,46 @@ def sha256_of_file(filename: Text) -> Text:
         return hashlib.sha256(data).hexdigest()
 
 
-def upload_uncached_files(cache_file: Text, files: List[Dict], scio_url: Text) -> int:
+def upload_uncached_files(cache_file: Text,
+                          files: List[Dict],
+                          scio_url: Text) -> Tuple[int, List[Text]]:
     """Check each downloaded file hexdigest against a cache of previously uploaded
-    files. Only upload "new" files."""
+    files. Only upload "new" files. Returns the number of uploaded files and
+    the files that failed to upload"""
 
     mycache = cache.Cache(cache_file)
 
     nup = 0
+    failed: List[Text] = []
 
-    for filemap in files:
+    digests = [sha256_of_file(filemap['filename']) for filemap in files]
 
-        filename: Text = filemap['filename']
-        sha256 = sha256_of_file(filename)
+    # Digests are looked up in bulk, and digests added to
+    # uploaded to skip duplicates within this run
+    uploaded = mycache.contains_many(digests)
+
+    with mycache.batch():
+        for filemap, sha256 in zip(files, digests):
+
+            filename: Text = filemap['filename']
+
+            if sha256 in uploaded:
+                continue
 
-        if not mycache.contains(sha256):
             try:
                 if scio_url != "dummy.url":
                     upload.upload(scio_url, filemap)
                 mycache.insert(filename, sha256, str(datetime.datetime.now()))
+                uploaded.add(sha256)
                 logging.info("Uploaded %s to scio", filename)
                 nup += 1
             except upload.UploadError as err:
                 logging.error(err)
+                failed.append(filename)
 
-    return nup
+    mycache.close()
+
+    return nup, failed
 
 
 def main() -> None:
@@ -83,26 +102,56 @@ def main() -> None:
 
     setup_logging(args.loglevel, args.logfile, "scio-feed-download")
 
+    args.feed_state = FeedState(str(args.feed_state)) if args.feed_state else None
+    args.scheduler = Scheduler(
+        max_connections=args.max_connections,
+        host_connections=args.host_connections,
+        host_rate=args.host_rate,
+        retries=args.retries)
+
+    try:
+        download_and_upload(args)
+    finally:
+        if args.feed_state:
+            args.feed_state.expire_seen(args.seen_retention * 24 * 60 * 60)
+            args.feed_state.close()
+
+
+def download_and_upload(args: argparse.Namespace) -> None:
+    """Download the feeds and upload the new files. The feed state is only
+    stored for feeds where all files are uploaded (or uploaded before). Without
+    a Scio API, the files are only downloaded, and the state of all feeds is stored"""
+
     files: List[Dict] = []
 
     try:
         full_feeds, partial_feeds = conf.parse_feed_file(args.feeds)
-        files += download.download_feed_list(args, full_feeds, partial=False)
-        files += download.download_feed_list(args, partial_feeds, partial=True)
+        if args.engine == "async":
+            files += crawler.crawl(args, full_feeds, partial_feeds)
+        else:
+            files += download.download_feed_list(args, full_feeds, partial=False)
+            files += download.download_feed_list(args, partial_feeds, partial=True)
     except IOError as err:
         logging.error(str(err))
         raise err
+    finally:
+        args.scheduler.close()
 
     if not args.scio:
         logging.info("No Scio API Url provided. Exit after download[%s]", len(files))
+        if args.feed_state:
+            args.feed_state.store_pending()
         return
 
     logging.info("Checking upload status of %s files", len(files))
 
-    nup = upload_uncached_files(args.cache, files, args.scio)
+    nup, failed = upload_uncached_files(args.cache, files, args.scio)
 
     logging.info("Uploaded %s files", nup)
 
+    if args.feed_state:
+        args.feed_state.store_pending(failed)
+
 
 if __name__ == "__main__":
     main()
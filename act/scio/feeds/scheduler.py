@@ -0,0 +1,176 @@
+"""Download scheduler shared by the feed and link downloads of scio-feeds.
+
+Many feeds and the documents they link to are on the same few hosts. The
+scheduler keeps a pool of sessions per host, so connections are reused
+(keep-alive) instead of doing a new TLS handshake for every request, and
+limits the number of concurrent requests per host and in total, as well as
+the request rate per host.
+
+Responses with status 429, 502, 503 or 504 (and connection errors) are retried
+with exponential backoff, honouring the Retry-After header of the response.
+
+Streamed responses (stream=True) are read by a handler called by fetch(), so
+the body is read while the request holds its slots and the session."""
+
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+from typing import Any, Callable, Dict, Iterator, List, Optional, Text, TypeVar
+import collections
+import datetime
+import logging
+import threading
+import time
+import urllib.parse
+
+import requests
+
+# Status codes that are retried
+RETRY_STATUS = {429, 502, 503, 504}
+
+T = TypeVar("T")
+
+
+def retry_after(response: requests.Response) -> Optional[float]:
+    """Seconds to wait from the Retry-After header (seconds or HTTP date)"""
+
+    value = response.headers.get("Retry-After")
+
+    if not value:
+        return None
+
+    if value.strip().isdigit():
+        return float(value)
+
+    try:
+        date = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        logging.warning("Invalid Retry-After: %s", value)
+        return None
+
+    return max(0.0, (date - datetime.datetime.now(datetime.timezone.utc)).total_seconds())
+
+
+class Host:
+    """Sessions, concurrency limit and rate limit of a host"""
+
+    def __init__(self, connections: int) -> None:
+        self.semaphore = threading.BoundedSemaphore(connections)
+        self.sessions: List[requests.Session] = []
+        self.next_request = 0.0
+
+
+class Scheduler:
+    """Rate limited HTTP client, with a pool of sessions per host.
+
+    max_connections is the max concurrent requests in total, host_connections
+    the max concurrent requests per host and host_rate the max requests per
+    second per host (0 is unlimited)."""
+
+    def __init__(self,
+                 max_connections: int = 32,
+                 host_connections: int = 2,
+                 host_rate: float = 0,
+                 retries: int = 3,
+                 backoff: float = 1.0,
+                 max_wait: float = 300) -> None:
+
+        self.semaphore = threading.BoundedSemaphore(max_connections)
+        self.host_connections = host_connections
+        self.host_rate = host_rate
+        self.retries = retries
+        self.backoff = backoff
+        self.max_wait = max_wait
+        self.lock = threading.Lock()
+        self.hosts: Dict[Text, Host] = collections.defaultdict(
+            lambda: Host(self.host_connections))
+
+    def wait_for_rate(self, host: Host) -> None:
+        """Sleep until the next request to host is allowed by host_rate"""
+
+        if not self.host_rate:
+            return
+
+        with self.lock:
+            now = time.monotonic()
+            delay = max(0.0, host.next_request - now)
+            host.next_request = max(now, host.next_request) + 1 / self.host_rate
+
+        if delay:
+            time.sleep(delay)
+
+    @contextmanager
+    def slot(self, host: Host) -> Iterator[requests.Session]:
+        """Wait for a slot for a request to host, and yield an idle session of host.
+
+        The host slot is taken (and the rate limit waited for) before the global
+        slot, so requests queued for a busy host do not hold global slots
+        needed by requests to other hosts"""
+
+        with host.semaphore:
+            self.wait_for_rate(host)
+
+            with self.semaphore:
+                with self.lock:
+                    session = host.sessions.pop() if host.sessions else requests.Session()
+
+                try:
+                    yield session
+                finally:
+                    with self.lock:
+                        host.sessions.append(session)
+
+    def fetch(self, url: Text, handle: Callable[[requests.Response], T], **kwargs: Any) -> T:
+        """GET url, retrying with backoff, and return handle(response). Raises the
+        exceptions of requests if the request fails after all retries.
+
+        handle is called while the request holds its slots and the session,
+        so streamed responses (stream=True) must be read by handle, and are
+        closed when handle returns"""
+
+        with self.lock:
+            host = self.hosts[urllib.parse.urlparse(url).netloc.lower()]
+
+        attempt = 0
+
+        while True:
+            delay = self.backoff * 2 ** attempt
+
+            with self.slot(host) as session:
+                try:
+                    response = session.request("GET", url, **kwargs)
+                except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as err:
+                    if attempt >= self.retries:
+                        raise
+                    logging.info("%s failed (%s), retrying in %s seconds", url, err, delay)
+                else:
+                    if response.status_code not in RETRY_STATUS or attempt >= self.retries:
+                        try:
+                            return handle(response)
+                        finally:
+                            if kwargs.get("stream"):
+                                response.close()
+
+                    wait = retry_after(response)
+                    delay = min(delay if wait is None else wait, self.max_wait)
+
+                    logging.info("%s returned %s, retrying in %s seconds",
+                                 url, response.status_code, delay)
+                    response.close()
+
+            time.sleep(delay)
+            attempt += 1
+
+    def get(self, url: Text, **kwargs: Any) -> requests.Response:
+        """GET url, retrying with backoff. Raises the exceptions of requests
+        if the request fails after all retries. Use fetch() for streamed responses"""
+
+        return self.fetch(url, lambda response: response, **kwargs)
+
+    def close(self) -> None:
+        """Close all sessions"""
+
+        with self.lock:
+            for host in self.hosts.values():
+                for session in host.sessions:
+                    session.close()
+            self.hosts.clear()
@@ -0,0 +1,212 @@
+"""Persistent state of the feeds between runs of scio-feeds.
+
+For each feed, the validators of the last successfully handled response are
+stored (ETag, Last-Modified and the sha256 of the body), so the next run can
+send a conditional request (If-None-Match/If-Modified-Since), and skip
+parsing the feed if the server responds 304 or the body is unchanged.
+
+The entries handled are also stored per feed (keyed by the id, guid or link
+of the entry), so entries are only downloaded the first time they are seen.
+Entries are forgotten when they have not been in the feed for the retention
+period.
+
+The state of a feed handled in a run is not stored right away, but kept as a
+pending FeedUpdate until the files of the feed are uploaded (store_pending()),
+so feeds where the upload fails are handled again on the next run.
+
+The state is a sqlite database in WAL mode. Feeds are handled in a pool of
+threads, so the connection is shared, and guarded by a lock."""
+
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Text
+import hashlib
+import logging
+import sqlite3
+import threading
+import time
+
+import requests
+
+
+class Validator(NamedTuple):
+    """Validators of a feed response"""
+
+    etag: Optional[Text]
+    last_modified: Optional[Text]
+    content_hash: Text
+
+    @classmethod
+    def from_response(cls, response: requests.Response) -> "Validator":
+        """Validators of response"""
+
+        return cls(
+            response.headers.get("ETag"),
+            response.headers.get("Last-Modified"),
+            hashlib.sha256(response.content).hexdigest())
+
+    def headers(self) -> Dict[Text, Text]:
+        """Headers of a conditional request"""
+
+        headers = {}
+
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+
+        return headers
+
+    def not_modified(self, response: requests.Response) -> bool:
+        """Return True if response is 304 Not Modified, or has the same body"""
+
+        if response.status_code == 304:
+            return True
+
+        return response.status_code == 200 and \
+            hashlib.sha256(response.content).hexdigest() == self.content_hash
+
+
+class FeedUpdate(NamedTuple):
+    """State of a feed handled in this run: the validators of the response
+    (None if some entries failed, so the feed is not skipped as not modified
+    on the next run), the keys of the handled entries and the files
+    downloaded from the feed. If refresh is True, the feed is not modified,
+    so all entries seen before are still in the feed"""
+
+    url: Text
+    validator: Optional[Validator]
+    seen: List[Text]
+    files: List[Text]
+    refresh: bool = False
+
+
+def entry_key(entry: Dict[Text, Any]) -> Optional[Text]:
+    """Key of a feed entry. feedparser stores the guid of RSS entries as id"""
+
+    return entry.get("id") or entry.get("guid") or entry.get("link")
+
+
+class FeedState:
+    """Feed state database"""
+
+    def __init__(self, filename: Text) -> None:
+
+        logging.info("Using feed state %s", filename)
+
+        self.lock = threading.Lock()
+        self.pending: List[FeedUpdate] = []
+        self.conn = sqlite3.connect(filename, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+
+        self.conn.execute("""
+        CREATE TABLE IF NOT EXISTS feed_validator (
+            url text PRIMARY KEY,
+            etag text,
+            last_modified text,
+            content_hash text NOT NULL,
+            updated real NOT NULL)
+        """)
+        self.conn.execute("""
+        CREATE TABLE IF NOT EXISTS seen_entry (
+            url text NOT NULL,
+            entry text NOT NULL,
+            last_seen real NOT NULL,
+            PRIMARY KEY (url, entry))
+        """)
+        self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS seen_entry_last_seen ON seen_entry(last_seen)")
+        self.conn.commit()
+
+    def validator(self, url: Text) -> Optional[Validator]:
+        """Validators of the last response handled for url"""
+
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT etag, last_modified, content_hash FROM feed_validator WHERE url = ?",
+                (url,)).fetchone()
+
+        return Validator(*row) if row else None
+
+    def update_validator(self, url: Text, validator: Validator) -> None:
+        """Store validators of the last response handled for url"""
+
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO feed_validator VALUES (?, ?, ?, ?, ?)",
+                (url, validator.etag, validator.last_modified, validator.content_hash,
+                 time.time()))
+            self.conn.commit()
+
+    def seen(self, url: Text, entry: Text) -> bool:
+        """Return True if entry of the feed at url is handled before"""
+
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT 1 FROM seen_entry WHERE url = ? AND entry = ?", (url, entry)).fetchone()
+
+        return row is not None
+
+    def mark_seen(self, url: Text, entries: Iterable[Text]) -> None:
+        """Mark entries of the feed at url as seen now"""
+
+        now = time.time()
+
+        with self.lock:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO seen_entry VALUES (?, ?, ?)",
+                [(url, entry, now) for entry in entries])
+            self.conn.commit()
+
+    def refresh_seen(self, url: Text) -> None:
+        """Mark all entries seen before of the feed at url as seen now"""
+
+        with self.lock:
+            self.conn.execute(
+                "UPDATE seen_entry SET last_seen = ? WHERE url = ?", (time.time(), url))
+            self.conn.commit()
+
+    def defer(self, update: FeedUpdate) -> None:
+        """Keep update, to be stored by store_pending()"""
+
+        with self.lock:
+            self.pending.append(update)
+
+    def store_pending(self, failed: Iterable[Text] = ()) -> None:
+        """Store the pending feed updates, except for feeds with files in failed
+        (e.g. files that could not be uploaded), which are handled again on the
+        next run"""
+
+        failed = set(failed)
+
+        with self.lock:
+            pending, self.pending = self.pending, []
+
+        for update in pending:
+            if failed.intersection(update.files):
+                logging.warning("Files of %s failed, feed is handled again on next run",
+                                update.url)
+                continue
+
+            if update.refresh:
+                self.refresh_seen(update.url)
+
+            self.mark_seen(update.url, update.seen)
+
+            if update.validator:
+                self.update_validator(update.url, update.validator)
+
+    def expire_seen(self, retention: float) -> None:
+        """Forget entries not seen in the last retention seconds"""
+
+        with self.lock:
+            expired = self.conn.execute(
+                "DELETE FROM seen_entry WHERE last_seen < ?",
+                (time.time() - retention,)).rowcount
+            self.conn.commit()
+
+        logging.info("Expired %s seen feed entries", expired)
+
+    def close(self) -> None:
+        """Close the database connection"""
+
+        with self.lock:
+            self.conn.close()
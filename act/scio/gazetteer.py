@@ -0,0 +1,159 @@
+"""Gazetteer of cities and countries used by the locations plugin.
+
+Cities (in the geonames format, e.g. cities15000.txt or allCountries.txt) and
+countries (ISO-3166-countries-with-regional-codes.json) are compiled once into an
+indexed sqlite database, using "scio-config gazetteer". The locations plugin opens
+the database (memory mapped) and looks up each noun, so the geonames data is not
+parsed and kept in memory by every worker."""
+
+from typing import Dict, Iterator, Optional, Text, Tuple
+import csv
+import json
+import logging
+import os
+import sqlite3
+
+import addict
+
+# Size of memory map used when reading the database
+MMAP_SIZE = 1024 * 1024 * 1024
+
+# Feature class for cities, villages etc. in the geonames data
+POPULATED_PLACE = "P"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS city (
+    name text PRIMARY KEY,
+    population integer NOT NULL,
+    country_code text NOT NULL,
+    area text NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS country (
+    name text NOT NULL,
+    alpha2 text NOT NULL,
+    data text NOT NULL
+);
+CREATE INDEX IF NOT EXISTS country_name ON country(name);
+CREATE INDEX IF NOT EXISTS country_alpha2 ON country(alpha2);
+"""
+
+
+def read_cities(filename: Text) -> Iterator[Tuple[Text, int, Text, Text]]:
+    """Read populated places from a geonames file. Returns tuples of
+    (name, population, country code, area)"""
+
+    with open(filename, newline="", encoding="utf8") as f:
+        reader = csv.reader(f, dialect="excel-tab", quoting=csv.QUOTE_NONE)
+
+        for row in reader:
+            if len(row) < 18:
+                continue
+
+            if row[6] and row[6] != POPULATED_PLACE:
+                continue
+
+            yield row[1].split(",")[0], int(row[14] or 0), row[8], row[17]
+
+
+def build(cities: Text, countries: Text, filename: Text) -> sqlite3.Connection:
+    """Build gazetteer database in filename (which may be ":memory:") from
+    geonames cities and ISO-3166 countries. Returns the database connection."""
+
+    conn = sqlite3.connect(filename)
+    conn.executescript("DROP TABLE IF EXISTS city; DROP TABLE IF EXISTS country;")
+    conn.executescript(SCHEMA)
+
+    # For cities with the same name, keep the one with the largest population
+    conn.executemany("""
+        INSERT INTO city VALUES (?, ?, ?, ?)
+        ON CONFLICT(name) DO UPDATE SET
+            population = excluded.population,
+            country_code = excluded.country_code,
+            area = excluded.area
+        WHERE excluded.population > city.population""", read_cities(cities))
+
+    with open(countries, encoding="utf8") as f:
+        conn.executemany(
+            "INSERT INTO country VALUES (?, ?, ?)",
+            ((country["name"], country["alpha-2"], json.dumps(country))
+             for country in json.load(f)))
+
+    conn.commit()
+
+    return conn
+
+
+class Gazetteer:
+    """Lookup of cities and countries in a gazetteer database"""
+
+    def __init__(self, conn: sqlite3.Connection) -> None:
+        self.conn = conn
+        self.conn.execute("PRAGMA mmap_size = {}".format(MMAP_SIZE))
+
+    @classmethod
+    def open(cls, filename: Text) -> "Gazetteer":
+        """Open existing gazetteer database read only"""
+
+        logging.info("Using gazetteer %s", filename)
+
+        return cls(sqlite3.connect("file:{}?mode=ro".format(filename), uri=True))
+
+    @classmethod
+    def load(cls, filename: Text, cities: Text, countries: Text) -> "Gazetteer":
+        """Open the gazetteer database if it exists, otherwise build
+        the gazetteer in memory"""
+
+        if os.path.isfile(filename):
+            return cls.open(filename)
+
+        logging.warning("Gazetteer %s not found, building gazetteer in memory. "
+                        "Run scio-config gazetteer to build it once.", filename)
+
+        return cls(build(cities, countries, ":memory:"))
+
+    def city(self, name: Text) -> Optional[addict.Dict]:
+        """Return city with name, or None if it does not exist"""
+
+        row = self.conn.execute(
+            "SELECT name, population, country_code, area FROM city WHERE name = ?",
+            (name,)).fetchone()
+
+        if not row:
+            return None
+
+        return addict.Dict({
+            'name': row[0],
+            'population': row[1],
+            'country code': row[2],
+            'area': row[3],
+        })
+
+    def _country(self, column: Text, value: Text) -> Optional[addict.Dict]:
+        row = self.conn.execute(
+            "SELECT data FROM country WHERE {} = ? ORDER BY rowid DESC LIMIT 1".format(column),
+            (value,)).fetchone()
+
+        return addict.Dict(json.loads(row[0])) if row else None
+
+    def country(self, name: Text) -> Optional[addict.Dict]:
+        """Return country with name, or None if it does not exist"""
+
+        return self._country("name", name)
+
+    def country_by_code(self, alpha2: Text) -> Optional[addict.Dict]:
+        """Return country with ISO-3166 alpha-2 code, or None if it does not exist"""
+
+        return self._country("alpha2", alpha2)
+
+    def stats(self) -> Dict[Text, int]:
+        """Number of cities and countries in the gazetteer"""
+
+        return {
+            "cities": self.conn.execute("SELECT COUNT(*) FROM city").fetchone()[0],
+            "countries": self.conn.execute("SELECT COUNT(*) FROM country").fetchone()[0],
+        }
+
+    def close(self) -> None:
+        """Close the database connection"""
+
+        self.conn.close()
@@ -0,0 +1,199 @@
+"""Per plugin timing and resource instrumentation.
+
+Each plugin invocation can be measured for wall time, CPU time, peak memory
+allocated and the size of the result. The measurements are collected by
+Metrics, which can export them in the Prometheus text format, either through a
+/metrics HTTP endpoint or to a local text file.
+
+Memory is only measured while tracemalloc is tracing, which is started with
+start_memory_tracing() (--trace-memory in scio-analyze). Only memory allocated
+by Python is traced, and tracing slows down allocations, so the wall and cpu
+times are somewhat higher with memory tracing."""
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional, Text, Tuple
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+import tracemalloc
+
+import addict
+
+from act.scio.plugin import BasePlugin, Result
+
+PLUGIN_METRICS = [
+    ("invocations_total", "counter", "Number of plugin invocations"),
+    ("errors_total", "counter", "Number of plugin invocations returning an exception"),
+    ("wall_seconds_total", "counter", "Wall time spent in plugin"),
+    ("cpu_seconds_total", "counter", "CPU time spent in plugin"),
+    ("peak_memory_bytes_total", "counter", "Peak memory allocated by plugin"),
+    ("output_bytes_total", "counter", "Size of plugin results serialized as json"),
+]
+
+
+def start_memory_tracing() -> None:
+    """Start tracing memory allocations, so measure() includes peak memory"""
+
+    if not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+
+def stop_memory_tracing() -> None:
+    """Stop tracing memory allocations and free the traces"""
+
+    if tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+
+def reset_peak() -> None:
+    """Reset the peak of the traced memory. tracemalloc.reset_peak() is new
+    in python 3.9, before that clearing the traces also resets the peak"""
+
+    if hasattr(tracemalloc, "reset_peak"):
+        tracemalloc.reset_peak()
+    else:
+        tracemalloc.clear_traces()
+
+
+async def measure(p: BasePlugin, nlpdata: addict.Dict) -> Tuple[Result, Dict[Text, float]]:
+    """Run plugin and measure wall time, cpu time, peak memory and output size.
+    Peak memory is only measured if memory is traced.
+
+    The plugins do CPU bound work without awaiting, so the thread time of the
+    current thread is the CPU time of the plugin, and the peak of the memory
+    traced during the call is the peak memory allocated by the plugin."""
+
+    tracing = tracemalloc.is_tracing()
+
+    if tracing:
+        reset_peak()
+
+    memory, _ = tracemalloc.get_traced_memory()
+    wall = time.perf_counter()
+    cpu = time.thread_time()
+
+    res = await p.analyze(nlpdata)
+
+    wall = time.perf_counter() - wall
+    cpu = time.thread_time() - cpu
+    _, peak = tracemalloc.get_traced_memory()
+
+    timing = {
+        "wall": wall,
+        "cpu": cpu,
+        "output_bytes": len(json.dumps(res.result)),
+    }
+
+    if tracing:
+        timing["peak_memory"] = max(0, peak - memory)
+
+    return res, timing
+
+
+class Metrics:
+    """Collect plugin measurements and export them in the Prometheus text format"""
+
+    def __init__(self, attach_timings: bool = False) -> None:
+        self.attach_timings = attach_timings
+        self.lock = threading.Lock()
+        self.documents = 0
+        self.plugins: Dict[Text, Dict[Text, float]] = {}
+
+    def _plugin(self, name: Text) -> Dict[Text, float]:
+        if name not in self.plugins:
+            self.plugins[name] = {metric: 0 for metric, _, _ in PLUGIN_METRICS}
+        return self.plugins[name]
+
+    def record(self, name: Text, timing: Dict[Text, float]) -> None:
+        """Record a successful plugin invocation"""
+
+        with self.lock:
+            plugin = self._plugin(name)
+            plugin["invocations_total"] += 1
+            plugin["wall_seconds_total"] += timing["wall"]
+            plugin["cpu_seconds_total"] += timing["cpu"]
+            plugin["peak_memory_bytes_total"] += timing.get("peak_memory", 0)
+            plugin["output_bytes_total"] += timing["output_bytes"]
+
+    def error(self, name: Text) -> None:
+        """Record a plugin invocation returning an exception"""
+
+        with self.lock:
+            plugin = self._plugin(name)
+            plugin["invocations_total"] += 1
+            plugin["errors_total"] += 1
+
+    def document(self) -> None:
+        """Record an analyzed document"""
+
+        with self.lock:
+            self.documents += 1
+
+    def render(self) -> Text:
+        """Return metrics in the Prometheus text format"""
+
+        with self.lock:
+            lines = [
+                "# HELP scio_documents_analyzed_total Number of analyzed documents",
+                "# TYPE scio_documents_analyzed_total counter",
+                "scio_documents_analyzed_total {}".format(self.documents),
+            ]
+
+            for metric, metric_type, description in PLUGIN_METRICS:
+                lines.append("# HELP scio_plugin_{} {}".format(metric, description))
+                lines.append("# TYPE scio_plugin_{} {}".format(metric, metric_type))
+                for name, plugin in sorted(self.plugins.items()):
+                    lines.append('scio_plugin_{}{{plugin="{}"}} {}'.format(
+                        metric, name, plugin[metric]))
+
+        return "\n".join(lines) + "\n"
+
+    def write(self, filename: Text) -> None:
+        """Write metrics to file. The file is replaced atomically, so readers
+        never see a partially written file"""
+
+        directory = os.path.dirname(os.path.abspath(filename))
+
+        with tempfile.NamedTemporaryFile("w", dir=directory, delete=False) as f:
+            f.write(self.render())
+
+        # NamedTemporaryFile is only readable by the owner
+        os.chmod(f.name, 0o644)
+        os.replace(f.name, filename)
+
+    def serve(self, host: Text, port: int) -> ThreadingHTTPServer:
+        """Serve metrics on http://host:port/metrics from a background thread"""
+
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            """Serve /metrics"""
+
+            def do_GET(self) -> None:  # pylint: disable=invalid-name
+                if self.path != "/metrics":
+                    self.send_error(404)
+                    return
+
+                body = metrics.render().encode("utf8")
+
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format: Text, *args: Optional[Text]) -> None:
+                # pylint: disable=redefined-builtin
+                logging.debug(format, *args)
+
+        server = ThreadingHTTPServer((host, port), Handler)
+
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+
+        logging.info("Serving metrics on http://%s:%s/metrics", host, port)
+
+        return server
@@ -9,7 +9,7 @@ from importlib import import_module
 from importlib.machinery import ModuleSpec
 from importlib.util import module_from_spec, spec_from_file_location
 from pydantic import BaseModel, StrictStr
-from typing import Text, List, Optional
+from typing import Text, List, Optional, Set
 import logging
 import os
 import pkgutil
@@ -39,12 +39,50 @@ class BasePlugin:
     dependencies: List[Text] = []
     configdir = ""
     debug = False
+    setup_done = False
+
+    def setup(self) -> None:
+        """Called once when the plugin is loaded, after configdir is injected.
+        Plugins should read configuration files, build vocabularies and
+        compile regular expressions here, so that the state can be reused
+        for all documents analyzed by the process.
+
+        Plugins with setup should call self.ensure_setup() first in analyze,
+        so the plugin also works if setup was not called by the caller."""
+
+    def teardown(self) -> None:
+        """Called once before the process exits. Release any resources
+        acquired in setup."""
+
+    def ensure_setup(self) -> None:
+        """Run setup, unless it has already been run"""
+
+        setup_plugin(self)
 
     async def analyze(self, nlpdata: addict.Dict) -> Result:
         """Main analyzis method"""
         return Result(name=self.name, version=self.version, result=addict.Dict({"test": nlpdata.content}))
 
 
+def load_plugins(plugin_dir: Optional[Text], configdir: Text) -> List[BasePlugin]:
+    """Load default plugins and external plugins from plugin_dir (if specified)
+    and inject the config directory into each plugin"""
+
+    myplugins = load_default_plugins()
+
+    if plugin_dir:
+        try:
+            logging.info("loading plugins from %s", plugin_dir)
+            myplugins += load_external_plugins(plugin_dir)
+        except FileNotFoundError:
+            logging.warning("Unable to load plugins from %s", plugin_dir)
+
+    for p in myplugins:
+        p.configdir = configdir
+
+    return myplugins
+
+
 def load_default_plugins() -> List[BasePlugin]:
     """load_default_plugins scans the package for internal plugins, loading
     them dynamically and checking for the presence of the attributes defined in
@@ -84,6 +122,99 @@ def load_external_plugins(directory: Text) -> List[BasePlugin]:
     return myplugins
 
 
+def setup_plugin(p: BasePlugin) -> None:
+    """Run setup of the plugin once. setup is optional, plugins without
+    setup are ready when loaded"""
+
+    if getattr(p, "setup_done", False):
+        return
+
+    setup = getattr(p, "setup", None)
+
+    if setup:
+        setup()
+
+    p.setup_done = True
+
+
+def setup_plugins(plugins: List[BasePlugin]) -> List[BasePlugin]:
+    """Run setup on all plugins, returning the plugins that are ready for analyzis.
+    Plugins that fail to setup are logged and skipped."""
+
+    ready: List[BasePlugin] = []
+
+    for p in plugins:
+        try:
+            setup_plugin(p)
+        except Exception as err:  # pylint: disable=W0703
+            logging.error("Unable to setup plugin %s: %s", p.name, err)
+            continue
+        ready.append(p)
+
+    return ready
+
+
+def resolve_dependencies(plugins: List[BasePlugin]) -> List[BasePlugin]:
+    """Resolve the dependency graph of the plugins and return the plugins in
+    topological order (every plugin after the plugins it depends on).
+
+    Plugins with missing dependencies (directly or through other plugins) and
+    plugins with circular dependencies can never run. They are logged and removed."""
+
+    by_name = {p.name: p for p in plugins}
+
+    # Remove plugins with missing dependencies, until no more plugins are removed
+    # (a plugin depending on a removed plugin must also be removed)
+    removed = True
+    while removed:
+        removed = False
+        for p in list(by_name.values()):
+            missing = [dep for dep in p.dependencies if dep not in by_name]
+            if missing:
+                logging.warning("Plugin %s will not run due to missing dependencies %s",
+                                p.name, missing)
+                del by_name[p.name]
+                removed = True
+
+    ordered: List[BasePlugin] = []
+    resolved: Set[Text] = set()
+    unresolved = list(by_name.values())
+
+    # Kahn's algorithm. Resolve plugins where all dependencies are resolved,
+    # until no more plugins can be resolved
+    while unresolved:
+        ready = [p for p in unresolved if all(dep in resolved for dep in p.dependencies)]
+        if not ready:
+            break
+        for p in ready:
+            ordered.append(p)
+            resolved.add(p.name)
+            unresolved.remove(p)
+
+    for p in unresolved:
+        logging.warning("Plugin %s will not run due to circular dependencies %s",
+                        p.name, p.dependencies)
+
+    return ordered
+
+
+def teardown_plugins(plugins: List[BasePlugin]) -> None:
+    """Run teardown on all plugins that are setup, logging (but otherwise
+    ignoring) errors. teardown is optional"""
+
+    for p in plugins:
+        teardown = getattr(p, "teardown", None)
+
+        if not (teardown and getattr(p, "setup_done", False)):
+            continue
+
+        try:
+            teardown()
+            p.setup_done = False
+        except Exception as err:  # pylint: disable=W0703
+            logging.error("Unable to teardown plugin %s: %s", p.name, err)
+
+
 def load_plugin(module_name: Text) -> Optional[BasePlugin]:
     if module_name.endswith(".py"):
         spec: ModuleSpec = spec_from_file_location("plugin_mod", module_name)
@@ -0,0 +1,135 @@
+"""Process pool used to run the analyzis plugins in parallel.
+
+The plugins are synchronous, CPU bound code wrapped in coroutines, so running them
+on the event loop of scio-analyze means they run one after another on a single
+core. The PluginPool starts a number of worker processes, where each worker loads
+and sets up all plugins once, and then runs plugins on request from the main process."""
+
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.synchronize import Barrier
+from multiprocessing.util import Finalize
+from typing import Dict, List, Optional, Set, Text, Tuple
+import asyncio
+import logging
+import multiprocessing
+
+import addict
+
+from act.scio import plugin
+from act.scio.metrics import measure, start_memory_tracing, stop_memory_tracing
+
+# Plugins loaded by the worker process, indexed by plugin name
+_worker_plugins: Dict[Text, plugin.BasePlugin] = {}
+
+# Event loop used to run the plugin coroutines in the worker process
+_worker_loop: Optional[asyncio.AbstractEventLoop] = None
+
+# Barrier shared by all workers, used by warmup to make every worker report once
+_worker_barrier: Optional[Barrier] = None
+
+
+def _initialize(plugin_dir: Optional[Text],
+                configdir: Text,
+                names: List[Text],
+                barrier: Barrier,
+                trace_memory: bool) -> None:
+    """Load and setup plugins in the worker process. If trace_memory is True,
+    memory allocations are traced to measure the peak memory of the plugins"""
+
+    global _worker_loop, _worker_barrier  # pylint: disable=global-statement
+
+    _worker_barrier = barrier
+
+    plugins = [p for p in plugin.load_plugins(plugin_dir, configdir) if p.name in names]
+    plugins = plugin.setup_plugins(plugins)
+
+    _worker_plugins.update({p.name: p for p in plugins})
+    _worker_loop = asyncio.new_event_loop()
+
+    # Process pool workers do not run atexit handlers, so register
+    # teardown as a multiprocessing finalizer
+    Finalize(None, plugin.teardown_plugins, args=(plugins,), exitpriority=10)
+
+    if trace_memory:
+        start_memory_tracing()
+        Finalize(None, stop_memory_tracing, exitpriority=0)
+
+
+def _ready() -> List[Text]:
+    """Return the plugins loaded by the worker process, after waiting for all
+    other workers. A worker can not return before every worker holds one of the
+    warmup tasks, so each worker runs exactly one of them"""
+
+    _worker_barrier.wait()  # type: ignore
+
+    return list(_worker_plugins)
+
+
+def _analyze(name: Text,
+             nlpdata: addict.Dict,
+             timed: bool) -> Tuple[plugin.Result, Optional[Dict[Text, float]]]:
+    """Run plugin on nlpdata in the worker process. If timed is True,
+    the plugin execution is measured"""
+
+    p = _worker_plugins[name]
+
+    if timed:
+        return _worker_loop.run_until_complete(measure(p, nlpdata))  # type: ignore
+
+    return _worker_loop.run_until_complete(p.analyze(nlpdata)), None  # type: ignore
+
+
+class PluginPool:
+    """Pool of worker processes, each holding a loaded copy of the plugins"""
+
+    def __init__(self,
+                 processes: int,
+                 plugin_dir: Optional[Text],
+                 configdir: Text,
+                 names: List[Text],
+                 trace_memory: bool = False) -> None:
+
+        context = multiprocessing.get_context()
+
+        self.processes = processes
+        self.executor = ProcessPoolExecutor(
+            max_workers=processes,
+            mp_context=context,
+            initializer=_initialize,
+            initargs=(plugin_dir, configdir, names, context.Barrier(processes), trace_memory))
+
+    def warmup(self) -> Set[Text]:
+        """Make sure all workers are started and have loaded their plugins
+        before the first document is analyzed. Returns the names of the
+        plugins that are setup in all workers"""
+
+        logging.info("Starting %s plugin worker processes", self.processes)
+
+        futures = [self.executor.submit(_ready) for _ in range(self.processes)]
+
+        ready: Optional[Set[Text]] = None
+
+        for future in futures:
+            names = future.result()
+            logging.info("Plugin worker ready with plugins %s", names)
+            ready = set(names) if ready is None else ready & set(names)
+
+        return ready or set()
+
+    async def analyze(self,
+                      p: plugin.BasePlugin,
+                      nlpdata: addict.Dict,
+                      timed: bool = False) -> Tuple[plugin.Result, Optional[Dict[Text, float]]]:
+        """Run plugin in one of the worker processes. Returns the result of the plugin
+        and the measurements of the execution if timed is True (otherwise None)"""
+
+        loop = asyncio.get_event_loop()
+
+        # Pass a snapshot, so nlpdata is not modified while it is pickled
+        return await loop.run_in_executor(
+            self.executor, _analyze, p.name, addict.Dict(nlpdata), timed)
+
+    def shutdown(self) -> None:
+        """Stop all worker processes"""
+
+        self.executor.shutdown(wait=True)
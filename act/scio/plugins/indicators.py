@@ -1,7 +1,7 @@
 from act.scio.plugin import BasePlugin, Result
+from act.scio import scanner
 import addict
 from typing import Text, List, Dict, Set
-import ipaddress
 import re
 
 
@@ -11,20 +11,6 @@ class Plugin(BasePlugin):
     version = "0.1"
     dependencies: List[Text] = []
 
-    md5 = re.compile("\\b[0-9a-fA-F]{32}\\b")
-    sha1 = re.compile("\\b[.0-9a-fA-F]{40}\\b")
-    sha256 = re.compile("\\b[0-9a-fA-F]{64}\\b")
-    ipv4 = re.compile("\\b([0-2]?[0-9]?[0-9])\\.([0-2]?[0-9]?[0-9])\\.([0-2]?[0-9]?[0-9])" +
-                      "\\.([0-2]?[0-9]?[0-9])\\b")
-    email = re.compile("\\b[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\\.[a-zA-Z]{2,4}\\b")
-    fqdn = re.compile("\\b([a-zA-Z0-9\\.\\-]+\\.[a-zA-Z0-9\\.\\-]+)\\b")
-
-    uri = re.compile(r"(?:[a-zA-Z][a-zA-Z\d+-.]*):\/\/(?:(?:(?:[a-zA-Z\d\-._~\!$&'()*+,;=%]*)(?::(?:[a-zA-Z\d\-._~\!$&'()*+,;=:%]*))?)@)?(?:(?:\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3})|(?:\[(?:[a-fA-F\d.:]+)\])|(?:[a-zA-Z\d\-.%]+))?(?::(?:\d{1,5}))?(?:(?:\/(?:[a-zA-Z\d\-._~\!$&'()*+,;=:@%]*\/)*(?:[a-zA-Z\d\-._~\!$&'()*+,;=:@%]*))?)(?:\?(?:[a-zA-Z\d\-._~\!$&'()*+,;=:@%\/?]*))?(?:\#(?:[a-zA-Z\d\-._~\!$&'()*+,;=:@%\/?]*))?")
-
-    ipv4net = re.compile(r"\b[0-2]?[0-9]?[0-9]\.[0-2]?[0-9]?[0-9]\.[0-2]?[0-9]?[0-9]\.[0-2]?[0-9]?[0-9]\/\d{1,2}\b")
-
-    allposipv6 = re.compile("\\b[a-f0-9:.]+:[a-f0-9:.]+:[a-f0-9:.]+\\b")
-
     async def analyze(self, nlpdata: addict.Dict) -> Result:
 
         # refang to allo match on e.g. 127[.]0[.]0[.]1
@@ -37,29 +23,10 @@ class Plugin(BasePlugin):
         # Replace to make sure URLencoded URLs are supported
         text = re.sub("%2[fF]", "/", text)
 
-        res = addict.Dict()
-
-        res.md5 = self.md5.findall(text)
-        res.sha1 = self.sha1.findall(text)
-        res.sha256 = self.sha256.findall(text)
-        res.email = self.email.findall(text)
-        res.fqdn = [dn for dn in self.fqdn.findall(text)
-                    if dn.split(".")[-1] in TLDS]
-        res.ipv4 = ['.'.join(ip) for ip in self.ipv4.findall(text)]
-
-        res.uri = [re.sub("^hxxp", "http", uri, 0, re.I) for uri in self.uri.findall(text)]
-        res.ipv4net = self.ipv4net.findall(text)
-
-        pos_ipv6 = []
-        for candidate in self.allposipv6.findall(text):
-            try:
-                addr = ipaddress.ip_address(candidate)
-                if addr.version == 6:
-                    pos_ipv6.append(candidate)
-            except ValueError:
-                pass
+        res = addict.Dict({indicator_type: [] for indicator_type in scanner.INDICATOR_TYPES})
 
-        res.ipv6 = pos_ipv6
+        for match in scanner.scan(text, TLDS):
+            res[match.type].append(match.value)
 
         return Result(name=self.name, version=self.version, result=res)
 
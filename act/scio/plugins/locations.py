@@ -1,10 +1,9 @@
 import addict
+from act.scio.gazetteer import Gazetteer
 from act.scio.plugin import BasePlugin, Result
 from act.scio.vocabulary import Vocabulary
-from typing import Text, List, Tuple, Dict, Set
+from typing import Text, List, Tuple, Set
 import configparser
-import csv
-import json
 import os
 
 
@@ -14,6 +13,9 @@ class Plugin(BasePlugin):
     version = "0.1"
     dependencies: List[Text] = ["pos_tag"]
 
+    vocab: Vocabulary
+    gazetteer: Gazetteer
+
     def nouns(self, tok: List[Tuple[Text, Text]]) -> List[Text]:
         """Rebuild a list of nouns from the tokenized values. e.g.
         [('The', 'DT'), ('Arabic', 'NNP'), ('Emirates', 'NNP')] will return
@@ -50,36 +52,7 @@ class Plugin(BasePlugin):
 
         return list(res)
 
-    def cities_from_file(self, filename: Text) -> Dict[Text, Dict]:
-        reader = csv.reader(open(filename), dialect="excel-tab")
-        ret: Dict[Text, Dict] = {}
-        for _, city, _, _, _, _, _, _, cc, _, _, _, _, _, pop, _, _, area, _ in reader:
-            city = city.split(",")[0]
-            if (city in ret and ret[city]['population'] < int(pop)) or city not in ret:
-                ret[city] = addict.Dict({
-                    'name': city,
-                    'population': int(pop),
-                    'country code': cc,
-                    'area': area,
-                })
-        return ret
-
-    def countries_from_file(self, filename: Text) -> Tuple[Dict, Dict]:
-
-        names: Dict = {}
-        alpha2: Dict = {}
-
-        countries = json.load(open(filename))
-
-        for country in countries:
-            names[country['name']] = addict.Dict(country)
-            alpha2[country['alpha-2']] = addict.Dict(country)
-
-        return names, alpha2
-
-    async def analyze(self, nlpdata: addict.Dict) -> Result:
-
-        res = addict.Dict()
+    def setup(self) -> None:
 
         ini = configparser.ConfigParser()
         ini.read([os.path.join(self.configdir, "locations.ini")])
@@ -89,13 +62,29 @@ class Plugin(BasePlugin):
         ini['locations']['countries'] = os.path.join(self.configdir,
                                                      "../../vendor",
                                                      ini['locations']['countries'])
+        ini['locations']['gazetteer'] = os.path.join(self.configdir,
+                                                     "../../vendor",
+                                                     ini['locations'].get('gazetteer',
+                                                                          'gazetteer.db'))
         ini['vocabulary']['alias'] = os.path.join(self.configdir, ini['vocabulary']['alias'])
 
-        cities = self.cities_from_file(ini['locations']['cities'])
-        country_names, country_cc = self.countries_from_file(ini['locations']['countries'])
+        self.gazetteer = Gazetteer.load(ini['locations']['gazetteer'],
+                                        ini['locations']['cities'],
+                                        ini['locations']['countries'])
+
+        self.vocab = Vocabulary(ini['vocabulary'])
+
+    def teardown(self) -> None:
+
+        self.gazetteer.close()
+
+    async def analyze(self, nlpdata: addict.Dict) -> Result:
+
+        self.ensure_setup()
+
+        res = addict.Dict()
 
         nouns = self.nouns(nlpdata.pos_tag.tokens)
-        vocab = Vocabulary(ini['vocabulary'])
 
         res.cities = []
         res.countries = []
@@ -103,13 +92,15 @@ class Plugin(BasePlugin):
         res.countries_mentioned = []
 
         for noun in nouns:
-            if noun in cities:
-                city = cities[noun]
+            city = self.gazetteer.city(noun)
+            if city:
                 res.cities.append(city)
-                res.countries_inferred.append(country_cc.get(city['country code'], "UNK"))
-            if noun in country_names:
-                res.countries.append(country_names[noun])
-            if vocab.get(noun):
+                res.countries_inferred.append(
+                    self.gazetteer.country_by_code(city['country code']) or "UNK")
+            country = self.gazetteer.country(noun)
+            if country:
+                res.countries.append(country)
+            if self.vocab.get(noun):
                 res.countries_mentioned.append(noun)
 
         return Result(name=self.name, version=self.version, result=res)
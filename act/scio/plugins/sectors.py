@@ -14,47 +14,53 @@ class Plugin(BasePlugin):
     version = "0.1"
     dependencies: List[Text] = ["pos_tag"]
 
-    async def analyze(self, nlpdata: addict.Dict) -> Result:
+    sector_stem_postfix = {
+        'compani',  # company, companies, [...],
+        'industri',  # industry, industries, [...],
+        'sector',   # sector, sectors, [...],
+        'servic',   # service, services, [...],
+        'organ',   # organization, organizations, [...],
+        'provid',  # provider, providers, [...],
+    }
 
-        res = addict.Dict()
+    posible_tag_types = {"NNP", "NNPS", "NN", "NNS"}
+    lookbefore_tags = {",", ":", "CC"} | posible_tag_types
+
+    vocab: Vocabulary
+    ps: nltk.stem.PorterStemmer
+
+    def setup(self) -> None:
 
-        sector_stem_postfix = {
-            'compani',  # company, companies, [...],
-            'industri',  # industry, industries, [...],
-            'sector',   # sector, sectors, [...],
-            'servic',   # service, services, [...],
-            'organ',   # organization, organizations, [...],
-            'provid',  # provider, providers, [...],
-        }
+        ini = configparser.ConfigParser()
+        ini.read([os.path.join(self.configdir, "sectors.ini")])
+        ini['sectors']['alias'] = os.path.join(self.configdir, ini['sectors']['alias'])
 
-        posible_tag_types = {"NNP", "NNPS", "NN", "NNS"}
-        lookbefore_tags = {",", ":", "CC"}
-        lookbefore_tags.update(posible_tag_types)
+        self.vocab = Vocabulary(ini['sectors'])
+        self.ps = nltk.stem.PorterStemmer()
 
-        ps = nltk.stem.PorterStemmer()
+    async def analyze(self, nlpdata: addict.Dict) -> Result:
+
+        self.ensure_setup()
+
+        res = addict.Dict()
 
         pos_sectors: List[Text] = []
         # Look through all tokens. If any token relating to a sector is found,
         # look-before and collect all nouns while the tokens are nouns or part
         # of a listing.
         for i, (token, tag) in enumerate(nlpdata.pos_tag.tokens):
-            if tag in posible_tag_types and ps.stem(token) in sector_stem_postfix:
+            if tag in self.posible_tag_types and self.ps.stem(token) in self.sector_stem_postfix:
                 n = i - 1
-                while nlpdata.pos_tag.tokens[n][1] in lookbefore_tags:
+                while nlpdata.pos_tag.tokens[n][1] in self.lookbefore_tags:
                     n -= 1
                 pos_sectors += [token for (token, pos_tag)
                                 in nlpdata.pos_tag.tokens[n:i]
-                                if pos_tag in posible_tag_types]
-
-        ini = configparser.ConfigParser()
-        ini.read([os.path.join(self.configdir, "sectors.ini")])
-        ini['sectors']['alias'] = os.path.join(self.configdir, ini['sectors']['alias'])
+                                if pos_tag in self.posible_tag_types]
 
-        vocab = Vocabulary(ini['sectors'])
         sectors = []
         unknown_sectors = []
         for pos_sector in pos_sectors:
-            primary = vocab.get(pos_sector, primary=True)
+            primary = self.vocab.get(pos_sector, primary=True)
             if primary:
                 sectors.append(primary)
             else:
@@ -36,21 +36,28 @@ class Plugin(BasePlugin):
     version = "0.2"
     dependencies: List[Text] = []
 
-    async def analyze(self, nlpdata: addict.Dict) -> Result:
+    vocab: Vocabulary
+    uppercase_abbr: List[Text] = []
+
+    def setup(self) -> None:
 
         ini = configparser.ConfigParser()
         ini.read([os.path.join(self.configdir, "threatactor_pattern.ini")])
         ini['threat_actor']['alias'] = os.path.join(self.configdir, ini['threat_actor']['alias'])
 
-        uppercase_abbr = abbreviation_list(ini['threat_actor'].get('uppercase_abbr', ""))
+        self.uppercase_abbr = abbreviation_list(ini['threat_actor'].get('uppercase_abbr', ""))
+
+        self.vocab = Vocabulary(ini['threat_actor'])
+
+    async def analyze(self, nlpdata: addict.Dict) -> Result:
 
-        vocab = Vocabulary(ini['threat_actor'])
+        self.ensure_setup()
 
         res = addict.Dict()
 
-        res.ThreatActors = vocab.regex_search(
+        res.ThreatActors = self.vocab.regex_search(
             nlpdata.content,
-            normalize_result=(lambda x: normalize_ta(x, uppercase_abbr)),
+            normalize_result=(lambda x: normalize_ta(x, self.uppercase_abbr)),
             debug=self.debug)
 
         return Result(name=self.name, version=self.version, result=res)
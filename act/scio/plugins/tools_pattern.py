@@ -12,16 +12,22 @@ class Plugin(BasePlugin):
     version = "0.2"
     dependencies: List[Text] = []
 
-    async def analyze(self, nlpdata: addict.Dict) -> Result:
+    vocab: Vocabulary
+
+    def setup(self) -> None:
 
         ini = configparser.ConfigParser()
         ini.read([os.path.join(self.configdir, "tools_pattern.ini")])
         ini['tools']['alias'] = os.path.join(self.configdir, ini['tools']['alias'])
 
-        vocab = Vocabulary(ini['tools'])
+        self.vocab = Vocabulary(ini['tools'])
+
+    async def analyze(self, nlpdata: addict.Dict) -> Result:
+
+        self.ensure_setup()
 
         res = addict.Dict()
 
-        res.Tools = vocab.regex_search(nlpdata.content, debug=self.debug)
+        res.Tools = self.vocab.regex_search(nlpdata.content, debug=self.debug)
 
         return Result(name=self.name, version=self.version, result=res)
@@ -0,0 +1,93 @@
+"""Pooled beanstalk producer for the API.
+
+greenstalk clients are blocking and not thread safe. BeanstalkProducer keeps a
+pool of connections, and puts jobs from the threadpool of the event loop, so a
+slow beanstalk server does not stall other requests, and concurrent requests
+never share a connection. Connections failing are closed, and replaced by a new
+connection on the next request."""
+
+from typing import Callable, List, Optional
+import queue
+import threading
+
+from starlette.concurrency import run_in_threadpool
+import greenstalk  # type: ignore
+
+
+class ProducerTimeout(Exception):
+    """No beanstalk connection available within the timeout"""
+
+    pass
+
+
+class BeanstalkProducer:
+    """Pool of at most size beanstalk connections, created on demand"""
+
+    def __init__(self,
+                 connect: Callable[[], Optional[greenstalk.Client]],
+                 size: int = 4,
+                 timeout: float = 30) -> None:
+        self.connect = connect
+        self.size = size
+        self.timeout = timeout
+        self.pool: queue.Queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.slots = threading.BoundedSemaphore(size)  # Connections not in use
+        self.clients: List[greenstalk.Client] = []
+
+    def acquire(self) -> greenstalk.Client:
+        """Get an idle connection, or a new connection if there is no idle connection.
+        Raises ProducerTimeout if all connections are in use for timeout seconds"""
+
+        if not self.slots.acquire(timeout=self.timeout):
+            raise ProducerTimeout("No beanstalk connection available")
+
+        try:
+            return self.pool.get_nowait()
+        except queue.Empty:
+            pass
+
+        try:
+            client = self.connect()
+            if not client:
+                raise greenstalk.Error("Beanstalk is not configured")
+        except Exception:
+            self.slots.release()
+            raise
+
+        with self.lock:
+            self.clients.append(client)
+
+        return client
+
+    def put_sync(self, body: bytes) -> None:
+        """Put job, blocking until it is stored by beanstalk"""
+
+        client = self.acquire()
+
+        try:
+            client.put(body)
+        except (greenstalk.Error, OSError):
+            # Do not return a connection in an unknown state to the pool, the
+            # slot is released so the next request makes a new connection
+            with self.lock:
+                self.clients.remove(client)
+            client.close()
+            self.slots.release()
+            raise
+
+        self.pool.put(client)
+        self.slots.release()
+
+    async def put(self, body: bytes) -> None:
+        """Put job from the threadpool"""
+
+        await run_in_threadpool(self.put_sync, body)
+
+    def close(self) -> None:
+        """Close all connections"""
+
+        with self.lock:
+            for client in self.clients:
+                client.close()
+            self.clients = []
@@ -0,0 +1,84 @@
+"""Cached beanstalk tube statistics.
+
+Checking the queue depth for every request to the API costs several beanstalk
+round trips on the request path. QueueStats polls the tube statistics in the
+background, on its own beanstalk connection, and keeps the last snapshot in
+memory, so the backpressure check is a lookup in a dictionary.
+
+If the snapshot is missing or older than max_age (e.g. the poller is not
+running), the statistics are polled on demand."""
+
+from typing import Any, Dict, List, Optional, Text
+import asyncio
+import logging
+import threading
+import time
+
+import greenstalk  # type: ignore
+
+
+class QueueStats:
+    """Snapshot of beanstalk tube statistics, refreshed every interval seconds"""
+
+    def __init__(self,
+                 client: Optional[greenstalk.Client],
+                 tubes: List[Text],
+                 interval: float = 1.0) -> None:
+        self.client = client
+        self.tubes = tubes
+        self.interval = interval
+        self.max_age = interval * 3
+        self.lock = threading.Lock()
+        self.tube_stats: Dict[Text, Dict[Text, Any]] = {}
+        self.updated = 0.0
+
+    def poll(self) -> None:
+        """Fetch statistics of all tubes and replace the snapshot"""
+
+        tube_stats: Dict[Text, Dict[Text, Any]] = {}
+
+        with self.lock:
+            if self.client:
+                # Only stat existing tubes, to avoid "NOT_FOUND" exceptions
+                # in the case where the tubes are empty before first init
+                existing = self.client.tubes()
+
+                for tube in self.tubes:
+                    if tube in existing:
+                        tube_stats[tube] = self.client.stats_tube(tube) or {}
+
+            self.tube_stats = tube_stats
+            self.updated = time.time()
+
+    def snapshot(self) -> Dict[Text, Any]:
+        """Return the tube statistics and the age of the snapshot in seconds"""
+
+        if time.time() - self.updated > self.max_age:
+            self.poll()
+
+        return {
+            "tubes": self.tube_stats,
+            "age": time.time() - self.updated,
+        }
+
+    def max_jobs_ready(self) -> int:
+        """Max current-jobs-ready of the tubes"""
+
+        tube_stats = self.snapshot()["tubes"]
+
+        return max(
+            [stats.get("current-jobs-ready", 0) for stats in tube_stats.values()],
+            default=0)
+
+    async def run(self) -> None:
+        """Poll statistics every interval seconds, until cancelled"""
+
+        loop = asyncio.get_running_loop()
+
+        while True:
+            try:
+                await loop.run_in_executor(None, self.poll)
+            except (greenstalk.Error, OSError) as err:
+                logging.warning("Unable to poll beanstalk tube stats: %s", err)
+
+            await asyncio.sleep(self.interval)
@@ -0,0 +1,97 @@
+"""In-memory cache of API responses.
+
+Clients exporting indicators typically poll the same lists every few minutes.
+ResponseCache keeps the response bodies for ttl seconds, with an ETag, so
+repeated requests are served without querying elasticsearch, and clients
+sending If-None-Match get 304 Not Modified if the list is unchanged. The ETag
+is the sha256 of the body, unless the caller derives it before the body is
+produced (e.g. from the state of the index), so it can be sent with the
+streamed response.
+
+Responses are streamed to the client as they are produced, and only stored
+in the cache when the whole body has been produced (record())."""
+
+from typing import Dict, Hashable, Iterable, Iterator, NamedTuple, Optional, Text
+import collections
+import hashlib
+import threading
+import time
+
+
+class CachedResponse(NamedTuple):
+    """Cached response body, with ETag and expiry time"""
+
+    body: bytes
+    etag: Text
+    expires: float
+
+
+def etag(body: bytes) -> Text:
+    """Strong ETag of body"""
+
+    return '"{}"'.format(hashlib.sha256(body).hexdigest())
+
+
+def etag_matches(if_none_match: Optional[Text], tag: Text) -> bool:
+    """Return True if tag is in the If-None-Match header"""
+
+    if not if_none_match:
+        return False
+
+    tags = [t.strip() for t in if_none_match.split(",")]
+
+    return "*" in tags or tag in tags or "W/" + tag in tags
+
+
+class ResponseCache:
+    """Least recently used cache of max_entries responses, expiring after ttl seconds"""
+
+    def __init__(self, ttl: float = 300, max_entries: int = 32) -> None:
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.entries: Dict[Hashable, CachedResponse] = collections.OrderedDict()
+
+    def get(self, key: Hashable) -> Optional[CachedResponse]:
+        """Return cached response for key, or None if missing or expired"""
+
+        with self.lock:
+            response = self.entries.get(key)
+
+            if not response:
+                return None
+
+            if response.expires < time.time():
+                del self.entries[key]
+                return None
+
+            self.entries.move_to_end(key)  # type: ignore
+
+            return response
+
+    def put(self, key: Hashable, body: bytes, tag: Optional[Text] = None) -> CachedResponse:
+        """Store body as response for key, with ETag tag (default the sha256 of body)"""
+
+        response = CachedResponse(body, tag or etag(body), time.time() + self.ttl)
+
+        with self.lock:
+            self.entries[key] = response
+            self.entries.move_to_end(key)  # type: ignore
+
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)  # type: ignore
+
+        return response
+
+    def record(self, key: Hashable, chunks: Iterable[bytes],
+               tag: Optional[Text] = None) -> Iterator[bytes]:
+        """Yield chunks, and store the concatenated chunks as response
+        for key (with ETag tag) when all chunks are produced"""
+
+        body = []
+
+        for chunk in chunks:
+            body.append(chunk)
+            yield chunk
+
+        self.put(key, b"".join(body), tag)
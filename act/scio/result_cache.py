@@ -0,0 +1,188 @@
+"""Persistent cache of plugin results.
+
+Results are stored in a local sqlite database, keyed by the hexdigest of the
+document, the plugin name and the plugin version. The version used in the key
+also includes the versions of the plugins it depends on (directly or
+indirectly), so a plugin result is recomputed if any plugin it depends on
+is changed.
+
+Changes to the plugin configuration (e.g. alias files) are not part of the key,
+so the cache should be removed when the configuration is changed.
+
+When the total size of the cached results exceeds max_bytes, the least recently
+used results are evicted.
+
+The cache is looked up from the event loop of scio-analyze, so it should not
+wait for the disk on every lookup. The database is opened in WAL mode, last
+access times are updated in batches, and writes are committed for each
+COMMIT_BATCH writes or COMMIT_INTERVAL seconds, and when the cache is closed.
+Writes not committed when the process is killed are lost, which only means
+the results are computed again."""
+
+from typing import Dict, List, Optional, Text, Tuple
+import json
+import logging
+import sqlite3
+import time
+import zlib
+
+import addict
+
+from act.scio.plugin import BasePlugin
+
+# Writes are committed for each COMMIT_BATCH writes or COMMIT_INTERVAL seconds
+COMMIT_BATCH = 100
+COMMIT_INTERVAL = 5
+
+
+def plugin_versions(plugins: List[BasePlugin]) -> Dict[Text, Text]:
+    """Return versions for all plugins, including the versions of the
+    plugins they depend on, e.g. {"sectors": "0.1;pos_tag=0.1"}"""
+
+    by_name = {p.name: p for p in plugins}
+
+    def dependency_versions(p: BasePlugin, seen: frozenset) -> List[Text]:
+        versions = []
+        for dep in sorted(p.dependencies):
+            if dep in by_name and dep not in seen:
+                versions.append("{}={}".format(dep, by_name[dep].version))
+                versions += dependency_versions(by_name[dep], seen | {dep})
+        return versions
+
+    versions = {}
+
+    for p in plugins:
+        dependencies = sorted(set(dependency_versions(p, frozenset([p.name]))))
+        versions[p.name] = ";".join([p.version] + dependencies)
+
+    return versions
+
+
+class ResultCache:
+    """Content addressed cache of plugin results"""
+
+    def __init__(self, filename: Text, max_bytes: int = 1024 * 1024 * 1024) -> None:
+
+        logging.info("Using result cache %s", filename)
+
+        self.max_bytes = max_bytes
+        self.conn = sqlite3.connect(filename)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+
+        self.conn.execute("""
+        CREATE TABLE IF NOT EXISTS result (
+            hexdigest text NOT NULL,
+            plugin text NOT NULL,
+            version text NOT NULL,
+            result blob NOT NULL,
+            size integer NOT NULL,
+            last_access real NOT NULL,
+            PRIMARY KEY (hexdigest, plugin, version))
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS result_last_access ON result(last_access)")
+        self.conn.commit()
+
+        self.size = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM result").fetchone()[0]
+
+        # Last access times not yet written, and number of uncommitted writes
+        self.accessed: Dict[Tuple[Text, Text, Text], float] = {}
+        self.pending = 0
+        self.last_commit = time.monotonic()
+
+    def get(self, hexdigest: Text, plugin: Text, version: Text) -> Optional[addict.Dict]:
+        """Return cached result, or None if the result is not in the cache"""
+
+        row = self.conn.execute(
+            "SELECT result FROM result WHERE hexdigest = ? AND plugin = ? AND version = ?",
+            (hexdigest, plugin, version)).fetchone()
+
+        if not row:
+            return None
+
+        self.accessed[(hexdigest, plugin, version)] = time.time()
+        self.written()
+
+        return addict.Dict(json.loads(zlib.decompress(row[0])))
+
+    def put(self, hexdigest: Text, plugin: Text, version: Text, result: addict.Dict) -> None:
+        """Store result in the cache, evicting the least recently used results
+        if the cache is full"""
+
+        data = zlib.compress(json.dumps(result).encode("utf8"))
+
+        old = self.conn.execute(
+            "SELECT size FROM result WHERE hexdigest = ? AND plugin = ? AND version = ?",
+            (hexdigest, plugin, version)).fetchone()
+
+        self.conn.execute(
+            "INSERT OR REPLACE INTO result VALUES (?, ?, ?, ?, ?, ?)",
+            (hexdigest, plugin, version, data, len(data), time.time()))
+        self.accessed.pop((hexdigest, plugin, version), None)
+        self.written()
+
+        self.size += len(data) - (old[0] if old else 0)
+
+        if self.size > self.max_bytes:
+            self.evict()
+
+    def evict(self) -> None:
+        """Remove the least recently used results, until the cache
+        is below 90% of max_bytes"""
+
+        # Write the last access times, so we do not evict recently used results
+        self.commit()
+
+        target = self.max_bytes * 0.9
+        evicted = 0
+
+        while self.size > target:
+            rows = self.conn.execute(
+                "SELECT hexdigest, plugin, version, size FROM result "
+                "ORDER BY last_access LIMIT 100").fetchall()
+
+            if not rows:
+                break
+
+            for hexdigest, plugin, version, size in rows:
+                if self.size <= target:
+                    break
+                self.conn.execute(
+                    "DELETE FROM result WHERE hexdigest = ? AND plugin = ? AND version = ?",
+                    (hexdigest, plugin, version))
+                self.size -= size
+                evicted += 1
+
+        self.commit()
+
+        logging.info("Evicted %s results from result cache", evicted)
+
+    def written(self) -> None:
+        """Count a write, and commit if COMMIT_BATCH writes are pending or
+        the last commit is more than COMMIT_INTERVAL seconds ago"""
+
+        self.pending += 1
+
+        if self.pending >= COMMIT_BATCH or \
+                time.monotonic() - self.last_commit >= COMMIT_INTERVAL:
+            self.commit()
+
+    def commit(self) -> None:
+        """Write the last access times and commit pending writes"""
+
+        if self.accessed:
+            self.conn.executemany(
+                "UPDATE result SET last_access = ? "
+                "WHERE hexdigest = ? AND plugin = ? AND version = ?",
+                [(accessed, *key) for key, accessed in self.accessed.items()])
+            self.accessed = {}
+
+        self.conn.commit()
+        self.pending = 0
+        self.last_commit = time.monotonic()
+
+    def close(self) -> None:
+        """Commit pending writes and close the database connection"""
+
+        self.commit()
+        self.conn.close()
@@ -0,0 +1,104 @@
+"""Scanner for atomic indicators (hashes, addresses, domains and uris) in text.
+
+None of the indicator patterns match whitespace, so an indicator is always
+contained in a single whitespace delimited token. The scanner first extracts,
+in a single pass over the text, the tokens that could contain an indicator
+(tokens where "." or ":" is followed by another character, or with a run of
+32 hex characters). Words ending a sentence are not candidates. The indicator
+patterns are then only run on these candidate tokens, which for regular
+reports is a small fraction of the text.
+
+Matches are returned with their type and offsets in the scanned text."""
+
+from bisect import bisect_right
+from typing import List, NamedTuple, Pattern, Set, Text, Tuple
+import ipaddress
+import re
+
+# Whitespace delimited tokens that may contain an indicator
+CANDIDATE = re.compile(r"(?<!\S)(?=\S*?(?:[.:]\S|[0-9a-fA-F]{32}))\S+")
+
+PATTERNS: List[Tuple[Text, Pattern]] = [
+    ("md5", re.compile("\\b[0-9a-fA-F]{32}\\b")),
+    ("sha1", re.compile("\\b[.0-9a-fA-F]{40}\\b")),
+    ("sha256", re.compile("\\b[0-9a-fA-F]{64}\\b")),
+    ("email", re.compile("\\b[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\\.[a-zA-Z]{2,4}\\b")),
+    ("fqdn", re.compile("\\b([a-zA-Z0-9\\.\\-]+\\.[a-zA-Z0-9\\.\\-]+)\\b")),
+    ("ipv4", re.compile("\\b([0-2]?[0-9]?[0-9])\\.([0-2]?[0-9]?[0-9])\\.([0-2]?[0-9]?[0-9])" +
+                        "\\.([0-2]?[0-9]?[0-9])\\b")),
+    ("uri", re.compile(r"(?:[a-zA-Z][a-zA-Z\d+-.]*):\/\/(?:(?:(?:[a-zA-Z\d\-._~\!$&'()*+,;=%]*)(?::(?:[a-zA-Z\d\-._~\!$&'()*+,;=:%]*))?)@)?(?:(?:\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3})|(?:\[(?:[a-fA-F\d.:]+)\])|(?:[a-zA-Z\d\-.%]+))?(?::(?:\d{1,5}))?(?:(?:\/(?:[a-zA-Z\d\-._~\!$&'()*+,;=:@%]*\/)*(?:[a-zA-Z\d\-._~\!$&'()*+,;=:@%]*))?)(?:\?(?:[a-zA-Z\d\-._~\!$&'()*+,;=:@%\/?]*))?(?:\#(?:[a-zA-Z\d\-._~\!$&'()*+,;=:@%\/?]*))?")),  # noqa: E501
+    ("ipv4net", re.compile(r"\b[0-2]?[0-9]?[0-9]\.[0-2]?[0-9]?[0-9]\.[0-2]?[0-9]?[0-9]\.[0-2]?[0-9]?[0-9]\/\d{1,2}\b")),  # noqa: E501
+    ("ipv6", re.compile("\\b[a-f0-9:.]+:[a-f0-9:.]+:[a-f0-9:.]+\\b")),
+]
+
+INDICATOR_TYPES = [name for name, _ in PATTERNS]
+
+
+class Match(NamedTuple):
+    """Indicator found by the scanner"""
+    type: Text
+    value: Text
+    start: int
+    end: int
+
+
+def candidates(text: Text) -> Tuple[Text, List[int], List[int]]:
+    """Return the candidate tokens of text joined by newlines, together with the
+    start of each token in the joined text and in the original text"""
+
+    tokens = []
+    joined_starts = []
+    text_starts = []
+    pos = 0
+
+    for m in CANDIDATE.finditer(text):
+        tokens.append(m.group(0))
+        joined_starts.append(pos)
+        text_starts.append(m.start())
+        pos += len(m.group(0)) + 1
+
+    return "\n".join(tokens), joined_starts, text_starts
+
+
+def valid(indicator_type: Text, value: Text, tlds: Set[Text]) -> bool:
+    """Validate match that can not be fully validated by the pattern"""
+
+    if indicator_type == "fqdn":
+        return value.split(".")[-1] in tlds
+
+    if indicator_type == "ipv6":
+        try:
+            return ipaddress.ip_address(value).version == 6
+        except ValueError:
+            return False
+
+    return True
+
+
+def scan(text: Text, tlds: Set[Text]) -> List[Match]:
+    """Return all indicators in text, ordered by offset. Domains must have a
+    top level domain in tlds. Uris starting with hxxp are normalized to http."""
+
+    joined, joined_starts, text_starts = candidates(text)
+
+    matches = []
+
+    for indicator_type, pattern in PATTERNS:
+        for m in pattern.finditer(joined):
+            value = m.group(0)
+
+            if not valid(indicator_type, value, tlds):
+                continue
+
+            if indicator_type == "uri":
+                value = re.sub("^hxxp", "http", value, 0, re.I)
+
+            # Translate offset in the joined candidates to offset in text
+            token = bisect_right(joined_starts, m.start()) - 1
+            start = text_starts[token] + m.start() - joined_starts[token]
+
+            matches.append(Match(indicator_type, value, start, start + len(m.group(0))))
+
+    matches.sort(key=lambda match: match.start)
+
+    return matches
@@ -5,6 +5,9 @@
 from pkg_resources import resource_exists, resource_isdir, Requirement
 from pkg_resources import resource_string, resource_listdir
 from typing import Text, List, Union, Tuple
+import act.scio.config
+import act.scio.es
+import act.scio.gazetteer
 import argparse
 import caep
 import os
@@ -29,10 +32,33 @@ def parseargs() -> argparse.Namespace:
     show - Print default config
     user - Copy default config to {0}/{1}
     system - Copy default config to /etc/{1}
+    gazetteer - Build gazetteer for the locations plugin in {0}/vendor
+    indicators - Add indicators of documents analyzed before the indicator index
+                 was created to the indicator index (run once, when enabling it)
 """.format(caep.get_config_dir(CONFIG_ID), CONFIG_NAME),
                                      formatter_class=argparse.RawDescriptionHelpFormatter)
 
-    parser.add_argument('action', nargs=1, choices=["show", "user", "system"])
+    parser.add_argument('action', nargs=1,
+                        choices=["show", "user", "system", "gazetteer", "indicators"])
+    parser.add_argument('--cities', default="cities15000.txt",
+                        help="Geonames file with cities (e.g. cities15000.txt or " +
+                        "allCountries.txt), relative to the vendor directory")
+    parser.add_argument('--countries', default="ISO-3166-countries-with-regional-codes.json",
+                        help="ISO-3166 countries, relative to the vendor directory")
+    parser.add_argument('--gazetteer', default="gazetteer.db",
+                        help="Gazetteer database, relative to the vendor directory")
+    parser.add_argument('--elasticsearch', default="localhost",
+                        help="Elasticsearch host (indicators), default localhost")
+    parser.add_argument('--elasticsearch-port', type=int, default=9200, help="Default 9200")
+    parser.add_argument('--elasticsearch-user', help="Elasticsearch user")
+    parser.add_argument('--elasticsearch-password', help="Elasticsearch password")
+    parser.add_argument('--es-index', default="scio2",
+                        help="Index (or index pattern) of analyzed documents, default scio2")
+    parser.add_argument('--indicator-index', default=act.scio.es.INDICATOR_INDEX,
+                        help="Indicator index, default " + act.scio.es.INDICATOR_INDEX)
+    parser.add_argument('--end',
+                        help="Add documents analyzed before end (e.g. 2021-01-01), " +
+                        "instead of before the indicator index was created")
 
     return parser.parse_args()
 
@@ -92,6 +118,44 @@ def save_config(configdir: Text) -> None:
             sys.exit(2)
 
 
+def build_gazetteer(vendordir: Text, cities: Text, countries: Text, gazetteer: Text) -> None:
+    """ Build gazetteer database from cities and countries """
+
+    cities = os.path.join(vendordir, cities)
+    countries = os.path.join(vendordir, countries)
+    gazetteer = os.path.join(vendordir, gazetteer)
+
+    print(f"Building gazetteer {gazetteer} from {cities} and {countries}")
+
+    # Build to a temporary file, so running workers never see a partial gazetteer
+    tmp_filename = gazetteer + ".tmp"
+
+    try:
+        act.scio.gazetteer.build(cities, countries, tmp_filename).close()
+    except FileNotFoundError as err:
+        sys.stderr.write(f"ERROR: {err}\n")
+        sys.exit(2)
+
+    os.replace(tmp_filename, gazetteer)
+
+    print("Gazetteer built: {}".format(act.scio.gazetteer.Gazetteer.open(gazetteer).stats()))
+
+
+def backfill_indicators(args: argparse.Namespace) -> None:
+    """ Add indicators of analyzed documents to the indicator index """
+
+    client = act.scio.config.elasticsearch_client(args)
+
+    print(f"Adding indicators from {args.es_index} to {args.indicator_index}")
+
+    indexer = act.scio.es.BulkIndexer(client, max_docs=1000)  # type: ignore
+
+    documents = act.scio.es.backfill_indicators(
+        client, indexer, args.es_index, args.indicator_index, args.end)  # type: ignore
+
+    print(f"Added indicators of {documents} documents")
+
+
 def main() -> None:
     "main function"
     args = parseargs()
@@ -108,6 +172,13 @@ def main() -> None:
     if "system" in args.action:
         save_config("/etc/")
 
+    if "gazetteer" in args.action:
+        build_gazetteer(os.path.join(caep.get_config_dir(CONFIG_ID), "vendor"),
+                        args.cities, args.countries, args.gazetteer)
+
+    if "indicators" in args.action:
+        backfill_indicators(args)
+
 
 if __name__ == '__main__':
     main()
@@ -1,67 +1,118 @@
 """Tika/Scio integration. This module contains the scio tike server and service code"""
 
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from tika import parser
-from typing import Text, Optional, Any
+from typing import Dict, Text, Optional
 import argparse
-import asyncio
 import greenstalk
+import hashlib
 import html
 import json
 import logging
+import magic  # type: ignore
 import os
+import threading
 import time
 import tika
 import gzip
 import caep
 import act.scio.logsetup
 import act.scio.config
+from act.scio import extractors
+from act.scio.blobstore import BlobStore
+from act.scio.extraction_cache import ExtractionCache
+
+# Seconds to wait for a job before checking if the server is stopped
+RESERVE_TIMEOUT = 5
+
+# Log extraction cache stats every STATS_INTERVAL lookups
+STATS_INTERVAL = 100
+
 
 def parse_args() -> argparse.Namespace:
     """Helper setting up the argsparse configuration"""
 
     arg_parser = act.scio.config.parse_args("Scio 2 Tika server")
-    return caep.config.handle_args(arg_parser, "scio/etc", "scio.ini", "tika")
+    arg_parser.add_argument('--workers', type=int, default=4,
+                            help="Number of documents extracted in parallel. Default 4")
+    arg_parser.add_argument('--blob-store',
+                            help="Store extracted documents in this directory, and only " +
+                            "send a pointer to the document to scio-analyze " +
+                            "(default: documents inline in jobs)")
+    arg_parser.add_argument('--extraction-cache',
+                            help="sqlite database used to cache extracted documents by " +
+                            "sha256 of the raw document (default: no cache)")
+    arg_parser.add_argument('--extraction-cache-size', type=int, default=1024,
+                            help="Max size of the extraction cache in MB. Default 1024")
+    arg_parser.add_argument('--tika-only', action="store_true",
+                            help="Send all documents to Tika. By default, plain text, HTML, " +
+                            "XML, JSON and CSV are extracted without Tika")
+
+    args = caep.config.handle_args(arg_parser, "scio/etc", "scio.ini", "tika")
+
+    if args.workers < 1:
+        arg_parser.error("--workers must be at least 1")
+
+    return args
+
 
 class Server:
     """The server class listening for new work on beanstalk and sending it to
-    Apache Tika for text extraction and den sending it to Scio for text analyzis."""
+    Apache Tika for text extraction and den sending it to Scio for text analyzis.
+    Text based formats are extracted in process (see act.scio.extractors).
+
+    Each worker runs in its own thread with its own beanstalk connection, so
+    the workers reserve jobs and have requests to Tika in flight in parallel."""
 
     def __init__(self,
                  beanstalk_host: Text = "127.0.0.1",
-                 beanstalk_port: int = 11300):
-
-        self.client: Optional[greenstalk.Client] = None
-        self.connect(beanstalk_host, beanstalk_port)
+                 beanstalk_port: int = 11300,
+                 blob_store: Optional[BlobStore] = None,
+                 extraction_cache: Optional[ExtractionCache] = None,
+                 tika_only: bool = False):
+
+        self.beanstalk_host = beanstalk_host
+        self.beanstalk_port = beanstalk_port
+        self.blob_store = blob_store
+        self.extraction_cache = extraction_cache
+        self.tika_only = tika_only
+        self.magic = magic.Magic(mime=True)
+        self.stopped = threading.Event()
+
+        # The first call to tika starts the tika server if it is not running, so
+        # the workers wait for the first extraction to finish before calling tika
+        self.tika_lock = threading.Lock()
+        self.tika_started = threading.Event()
 
         logging.info("initialize tika VM")
         tika.initVM()
 
-    def client_ready(self) -> bool:
+    def client_ready(self, client: Optional[greenstalk.Client]) -> bool:
         """client_ready is a utility function checking whether the
         beanstalk client has a connection that works."""
 
-        if not self.client:
+        if not client:
             return False
         try:
-            self.client.stats()
+            client.stats()
             return True
         except (OSError, BrokenPipeError, ConnectionError, ConnectionRefusedError):
             return False
 
-    def connect(self,
-                beanstalk_host: Text = "127.0.0.1",
-                beanstalk_port: int = 11300) -> None:
-        """Try to create a beanstalk connection"""
+    def connect(self, client: Optional[greenstalk.Client] = None) -> greenstalk.Client:
+        """Create a beanstalk connection, retrying until beanstalk is available.
+        If client is specified, the existing connection is closed first."""
 
-        if self.client:
+        if client:
             # close existing connection
-            self.client.close()
+            client.close()
+            client = None
 
-        while not self.client_ready():
+        while not self.client_ready(client):
             try:
                 logging.info("Trying to connect to beanstalkd on %s:%s",
-                             beanstalk_host, beanstalk_port)
-                self.client = greenstalk.Client((beanstalk_host, beanstalk_port))
+                             self.beanstalk_host, self.beanstalk_port)
+                client = greenstalk.Client((self.beanstalk_host, self.beanstalk_port))
             except ConnectionRefusedError as err:
                 logging.warning("Server.connect: %s", err)
                 logging.info("Server.connect: waiting 5 seconds")
@@ -69,83 +120,169 @@ class Server:
 
         # We only want to receive messages specifically to scio. The default
         # beanstalk tube is ignored.
-        self.client.watch('scio_doc')
-        self.client.ignore('default')
-        self.client.use('scio_analyze')
+        client.watch('scio_doc')  # type: ignore
+        client.ignore('default')  # type: ignore
+        client.use('scio_analyze')  # type: ignore
+
+        return client  # type: ignore
+
+    def from_buffer(self, content: bytes) -> Dict:
+        """Extract text and metadata from content using tika"""
+
+        if not self.tika_started.is_set():
+            with self.tika_lock:
+                data = parser.from_buffer(content)
+                self.tika_started.set()
+                return data  # type: ignore
+
+        return parser.from_buffer(content)  # type: ignore
 
-    async def reserve(self) -> Any:
-        """Async reserve"""
-        return self.client.reserve()  # type: ignore
+    def extract_content(self,
+                        meta_data: Dict,
+                        content: bytes,
+                        worker_id: int) -> Dict:
+        """Extract text and metadata from content. Text based formats (plain text, HTML,
+        XML, JSON and CSV) are extracted in process, other formats are sent to Tika.
+
+        Tika extractions are cached in the extraction cache if configured. The cache
+        is keyed by the sha256 hexdigest of the raw content"""
+
+        hexdigest = meta_data.get("hexdigest") or hashlib.sha256(content).hexdigest()
+
+        if meta_data['filename'].endswith(".html"):
+            content = html.unescape(content.decode("utf8")).encode("utf8")
+
+        if not self.tika_only:
+            mime = self.magic.from_buffer(content)
+            data = extractors.extract(content, mime, meta_data['filename'])
+
+            if data is not None:
+                logging.info("Worker [%s] extracted %s (%s) in process",
+                             worker_id, hexdigest, mime)
+                return data
+
+        if self.extraction_cache:
+            data = self.extraction_cache.get(hexdigest)
+
+            stats = self.extraction_cache.stats()
+            if (stats["hits"] + stats["misses"]) % STATS_INTERVAL == 0:
+                logging.info("Extraction cache stats: %s", stats)
+
+            if data is not None:
+                logging.info("Worker [%s] using cached extraction of %s", worker_id, hexdigest)
+                return data
+
+        data = self.from_buffer(content)
+
+        # Only successful extractions are cached
+        if self.extraction_cache and data.get("status") == 200:
+            self.extraction_cache.put(hexdigest, data)
+
+        return data
+
+    def extract(self, client: greenstalk.Client, job: greenstalk.Job, worker_id: int) -> None:
+        """Send the document referenced by job to the tika service and post the extracted
+        document to the queue for consumption by the analyzis module"""
+
+        try:
+            meta_data = json.loads(job.body)
+        except json.decoder.JSONDecodeError as err:
+            logging.warning("Unable to decode body %s [%s ...]", err, job.body[:25])
+            client.delete(job)
+            return
 
-    async def worker(self, worker_id: int) -> None:
-        """Main worker code. Listening to the beanstalk client for ready work, sending it to the
-        tika service and then posting the extracted document to the queue for consumption by
-        the analyzis module"""
+        if "filename" not in meta_data:
+            logging.warning("No 'filename' field in meta data : %s", meta_data)
+            client.delete(job)
+            return
 
-        while True:
+        if not os.path.isfile(meta_data['filename']):
+            logging.warning("Could not find file '%s'", meta_data['filename'])
+            client.delete(job)
+            return
+
+        with open(meta_data['filename'], 'rb') as fh:
+            content = fh.read()
+
+        data = self.extract_content(meta_data, content, worker_id)
+        data.update(meta_data)
+
+        client.delete(job)
+
+        document = gzip.compress(json.dumps({**data, **meta_data}).encode('utf8'))
+
+        if self.blob_store:
+            # Only send a pointer to the document, so the size is not limited by beanstalk
+            document = self.blob_store.pointer(document).encode('utf8')
+
+        logging.info("Worker [%s] waiting to post result.", worker_id)
+        try:
+            client.put(document)
+            logging.info("Worker [%s] job done.", worker_id)
+        except greenstalk.JobTooBigError:
+            logging.error("Job to big: %s. Use --blob-store to send large documents.",
+                          meta_data['filename'])
+
+    def worker(self, worker_id: int) -> None:
+        """Main worker code. Listening to its own beanstalk connection for ready work,
+        and extracting the documents, until the server is stopped"""
+
+        client = self.connect()
+
+        while not self.stopped.is_set():
             logging.info("Worker [%s] waiting for work.", worker_id)
             try:
-                job = await self.reserve()
+                job = client.reserve(timeout=RESERVE_TIMEOUT)
             except greenstalk.TimedOutError:
                 continue
+            except (OSError, ConnectionError) as err:
+                logging.warning("Worker [%s] lost connection to beanstalk: %s", worker_id, err)
+                client = self.connect(client)
+                continue
 
             logging.info("Worker [%s] got job.", worker_id)
             try:
-                meta_data = json.loads(job.body)
-            except json.decoder.JSONDecodeError as err:
-                logging.warning("Unable to decode body %s [%s ...]", err, job.body[:25])
-                self.client.delete(job)  # type: ignore
-                continue
+                self.extract(client, job, worker_id)
+            except Exception:  # pylint: disable=broad-except
+                # Bury the job, so the failing document is not retried forever,
+                # and keep the worker running
+                logging.exception("Worker [%s] failed to extract job %s", worker_id, job.id)
+                try:
+                    client.bury(job)
+                except (OSError, ConnectionError, greenstalk.NotFoundError) as err:
+                    logging.warning("Worker [%s] unable to bury job: %s", worker_id, err)
+
+        client.close()
 
-            if "filename" not in meta_data:
-                logging.warning("No 'filename' field in meta data : %s", meta_data)
-                self.client.delete(job)  # type: ignore
-                continue
+    def start(self, n: int = 4) -> None:
+        """Start the server with n workers, each with their own thread and beanstalk
+        connection, and wait for the workers to finish"""
 
-            if not os.path.isfile(meta_data['filename']):
-                logging.warning("Could not find file '%s'", meta_data['filename'])
-                self.client.delete(job)  # type: ignore
-                continue
+        with ThreadPoolExecutor(max_workers=n, thread_name_prefix="tika-worker") as executor:
+            workers = {}
 
-            with open(meta_data['filename'], 'rb') as fh:
-                content = fh.read()
-                if meta_data['filename'].endswith(".html"):
-                    content = html.unescape(content.decode("utf8")).encode("utf8")
-                data = parser.from_buffer(content)
-                data.update(meta_data)
+            for i in range(n):
+                logging.info("Starting worker [%s]", i)
+                workers[executor.submit(self.worker, i)] = i
 
-            self.client.delete(job)  # type: ignore
-            logging.info("Worker [%s] waiting to post result.", worker_id)
             try:
-                self.client.put(gzip.compress(json.dumps({**data, **meta_data}).encode('utf8')))  # type: ignore
-                logging.info("Worker [%s] job done.", worker_id)
-            except greenstalk.JobTooBigError:
-                logging.error("Job to big: %s.", meta_data['filename'])
-
-    async def _start(self, n: int) -> None:
-        """Start the server, create n number of workers and wait for data on the queue"""
-
-        loop = asyncio.get_event_loop()
-        workers = []
+                for future in as_completed(workers):
+                    if future.exception():
+                        logging.error("Worker [%s] ended with exception %s",
+                                      workers[future], future.exception())
+            except KeyboardInterrupt:
+                logging.info("Stopping workers")
+                self.stopped.set()
 
-        for i in range(n):
-            logging.info("Starting worker [%s]", i)
-            workers.append((n, loop.create_task(self.worker(i))))
+        if self.extraction_cache:
+            logging.info("Extraction cache stats: %s", self.extraction_cache.stats())
 
-        logging.info("Gather all workers")
-        asyncio.gather(*[w for (_, w) in workers])
-
-        for i, worker in workers:
-            if worker.exception():
-                logging.error("Worker [%s] ended with exception %s", i, worker.exception())
-
-    def start(self, n: int = 4) -> None:
-        """start the server"""
+        logging.info("Server ended")
 
-        loop = asyncio.get_event_loop()
-        loop.run_until_complete(asyncio.wait([self._start(n)]))
+    def stop(self) -> None:
+        """Stop the workers after their current job"""
 
-        logging.info("Server ended")
+        self.stopped.set()
 
 
 def main() -> None:
@@ -155,10 +292,22 @@ def main() -> None:
 
     act.scio.logsetup.setup_logging(args.loglevel, args.logfile, "scio-tika-server")
 
-    server = Server(args.beanstalk, args.beanstalk_port)
+    blob_store = BlobStore(args.blob_store) if args.blob_store else None
+
+    extraction_cache = None
+
+    if args.extraction_cache:
+        extraction_cache = ExtractionCache(os.path.expanduser(args.extraction_cache),
+                                           max_bytes=args.extraction_cache_size * 1024 * 1024)
+
+    server = Server(args.beanstalk, args.beanstalk_port, blob_store, extraction_cache,
+                    args.tika_only)
 
     logging.info("Starting Tika server")
-    server.start()
+    server.start(args.workers)
+
+    if extraction_cache:
+        extraction_cache.close()
 
     logging.info("Finnished Tika server")
 
@@ -34,12 +34,12 @@ import hashlib
 import json
 import logging
 import os
-import sqlite3
 from typing import IO, Dict, List, Text, Tuple
 
 import magic  # type: ignore
 import requests
 
+from act.scio.cache import Cache
 from act.scio.config import get_cache_dir
 
 LOGGER = logging.getLogger('root')
@@ -87,68 +87,6 @@ class CandidateFile():
         return self._sha256
 
 
-class Cache:
-    """Cache handles the caching database logic"""
-
-    def __init__(self, filename="upload.sqlite"):
-        """Initiate database, creating connection to file"""
-
-        LOGGER.info("Connecting to %s", filename)
-
-        self.conn = sqlite3.connect(filename)
-
-        self.conn.execute("""
-        CREATE TABLE IF NOT EXISTS upload (
-            id integer PRIMARY KEY,
-            filename text NOT NULL,
-            sha256 text NOT NULL,
-            description text)
-        """)
-
-    def uploaded(self, sha256):
-        """Check if a particular digest is allready uploaded. Returns
-        True/False"""
-
-        sql = "SELECT * FROM upload WHERE sha256 = ?"
-
-        cur = self.conn.execute(sql, (sha256,))
-
-        if cur.fetchall():
-            LOGGER.debug("Query for %s returns True", sha256)
-            return True
-
-        LOGGER.debug("Query for %s returns False", sha256)
-        return False
-
-    def insert(self, filename, sha256, description=""):
-        """insert a new file in the metadata cache"""
-
-        sql = "INSERT INTO upload(filename, sha256, description) VALUES(?,?,?)"
-        LOGGER.debug("Inserting %s, %s, %s into database",
-                     filename, sha256, description)
-        self.conn.execute(sql, (filename, sha256, description))
-        self.conn.commit()
-
-    def info(self, sha256):
-        """Get stored info about a digest. Returns a list of Dictionaries"""
-
-        sql = "SELECT filename, sha256, description FROM upload WHERE sha256 = ?"  # NOQA
-
-        cur = self.conn.execute(sql, (sha256,))
-
-        results = cur.fetchall()
-        LOGGER.debug("Found %d resultsults for %s", len(results), sha256)
-
-        result_dictionaries = []
-
-        for result in results:
-            key_value_pairs = list(zip(["filename", "sha256", "description"],
-                                       result))
-            result_dictionaries.append(dict(key_value_pairs))
-
-        return result_dictionaries
-
-
 def init() -> argparse.Namespace:
     """initialize argument parser"""
 
@@ -241,6 +179,8 @@ def upload(args: argparse.Namespace) -> None:
 
     LOGGER.info("Found %d files", len(candidates))
 
+    hexdigests = []
+
     for candidate in candidates:
 
         partial_feed = candidate.metadata.get("partial_feed", False)
@@ -251,7 +191,19 @@ def upload(args: argparse.Namespace) -> None:
         else:
             hexdigest = candidate.sha256()
 
-        if not submit_cache.uploaded(hexdigest):
+        hexdigests.append(hexdigest)
+
+    # Digests are looked up in bulk, and digests added to
+    # uploaded to skip duplicates within this run
+    uploaded = submit_cache.contains_many(hexdigests)
+
+    with submit_cache.batch():
+        for candidate, hexdigest in zip(candidates, hexdigests):
+            if hexdigest in uploaded:
+                continue
+
+            uploaded.add(hexdigest)
+
             LOGGER.debug("submit %s", candidate.filename)
             submit_cache.insert(candidate.filename, hexdigest,
                                 candidate.metadata.get("creation-date", "NA"))
@@ -267,6 +219,8 @@ def upload(args: argparse.Namespace) -> None:
             else:
                 LOGGER.info("Not uploading %s (wrong mimetype)", candidate.filename)  # NOQA
 
+    submit_cache.close()
+
 
 def main() -> None:
     args = init()
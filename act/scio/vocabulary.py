@@ -16,6 +16,7 @@ from logging import info
 import nltk  # type: ignore
 
 from act.scio.alias import parse_aliases
+from act.scio.aliasmatcher import AliasMatcher
 import addict
 import act.scio.aliasregex as aliasregex
 
@@ -92,6 +93,7 @@ class Vocabulary:
         self.config = addict.Dict(DEFAULT_CONFIG)
         self.config.update(config)
         self.regex: List[Pattern] = []
+        self.alias_matcher: Optional[AliasMatcher] = None
         self.vocab: Dict[str, Dict[str, addict.Dict]] = addict.Dict(
             none=addict.Dict(),
             lower=addict.Dict(),
@@ -111,7 +113,11 @@ class Vocabulary:
             self.regex = []
 
         if self.config.regexfromalias:
-            for aliasre in aliasregex.get_reg_ex_set(self.config.alias):
+            # Regular expressions from aliases are matched with a single scan by the
+            # alias matcher, except the few using syntax not supported by the matcher
+            self.alias_matcher = AliasMatcher(sorted(aliasregex.get_reg_ex_set(self.config.alias)))
+
+            for aliasre in self.alias_matcher.unsupported_patterns:
                 try:
                     self.regex.append(re.compile(aliasre, re.IGNORECASE))
                 except re.error:
@@ -176,7 +182,13 @@ class Vocabulary:
         for regex in self.regex:
             for match in regex.findall(text):
                 if debug:
-                    logging.info("%s found by regex %s", match, regex)
+                    info("%s found by regex %s", match, regex)
+                result.append(normalize_result(match))
+
+        if self.alias_matcher:
+            for match in self.alias_matcher.findall(text):
+                if debug:
+                    info("%s found by alias matcher", match)
                 result.append(normalize_result(match))
 
         return result
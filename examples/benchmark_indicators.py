@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+
+"""Benchmark of the indicator scanner (act.scio.scanner).
+
+Generates a report of prose with a block of indicators every 50 sentences,
+and compares the time of scanner.scan() with running each indicator pattern
+over the full text (as the indicators plugin did before the scanner), and
+verifies that both find the same indicators.
+
+Usage: python examples/benchmark_indicators.py [--size MB] [--repeat N]"""
+
+from typing import Dict, List, Text
+import argparse
+import random
+import re
+import time
+
+from act.scio import scanner
+from act.scio.plugins.indicators import TLDS
+
+WORDS = """the actor used a spear phishing email with a malicious attachment to gain
+initial access to the network of the victim and later moved laterally using stolen
+credentials before the data was exfiltrated to a server controlled by the group""".split()
+
+INDICATORS = [
+    lambda r: "{}.{}.{}.{}".format(*[r.randint(1, 254) for _ in range(4)]),
+    lambda r: "{}.{}.{}.0/24".format(*[r.randint(1, 254) for _ in range(3)]),
+    lambda r: "%032x" % r.getrandbits(128),
+    lambda r: "%040x" % r.getrandbits(160),
+    lambda r: "%064x" % r.getrandbits(256),
+    lambda r: "update{}.example.com".format(r.randint(1, 1000)),
+    lambda r: "hxxp://cdn{}.example.net/payload.bin".format(r.randint(1, 1000)),
+    lambda r: "admin{}@example.org".format(r.randint(1, 1000)),
+    lambda r: "2001:db8::{:x}".format(r.randint(1, 65535)),
+]
+
+
+def report(size: int, seed: int = 0) -> Text:
+    """Generated report of at least size characters"""
+
+    r = random.Random(seed)
+    parts: List[Text] = []
+    length = 0
+    sentences = 0
+
+    while length < size:
+        sentence = " ".join(r.choice(WORDS) for _ in range(r.randint(8, 25))).capitalize() + ". "
+        sentences += 1
+
+        if sentences % 50 == 0:
+            sentence += "\n" + "\n".join(r.choice(INDICATORS)(r) for _ in range(10)) + "\n"
+
+        parts.append(sentence)
+        length += len(sentence)
+
+    return "".join(parts)
+
+
+def full_text(text: Text) -> Dict[Text, List[Text]]:
+    """Run each indicator pattern over the full text"""
+
+    res: Dict[Text, List[Text]] = {indicator_type: [] for indicator_type in scanner.INDICATOR_TYPES}
+
+    for indicator_type, pattern in scanner.PATTERNS:
+        for m in pattern.finditer(text):
+            value = m.group(0)
+
+            if not scanner.valid(indicator_type, value, TLDS):
+                continue
+
+            if indicator_type == "uri":
+                value = re.sub("^hxxp", "http", value, 0, re.I)
+
+            res[indicator_type].append(value)
+
+    return res
+
+
+def scanned(text: Text) -> Dict[Text, List[Text]]:
+    """Find indicators with the scanner"""
+
+    res: Dict[Text, List[Text]] = {indicator_type: [] for indicator_type in scanner.INDICATOR_TYPES}
+
+    for match in scanner.scan(text, TLDS):
+        res[match.type].append(match.value)
+
+    return res
+
+
+def best_of(func, text: Text, repeat: int) -> float:  # type: ignore
+    """Best time of repeat runs of func(text)"""
+
+    times = []
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(text)
+        times.append(time.perf_counter() - start)
+
+    return min(times)
+
+
+def main() -> None:
+    """Main entry point"""
+
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", type=float, default=6.2, help="Report size in MB")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs of each method")
+    args = parser.parse_args()
+
+    text = report(int(args.size * 1024 * 1024))
+
+    expected = full_text(text)
+    found = scanned(text)
+
+    for indicator_type in scanner.INDICATOR_TYPES:
+        # The patterns are run per type, so compare the values of each type as multisets
+        if sorted(expected[indicator_type]) != sorted(found[indicator_type]):
+            raise SystemExit("Scanner differs from full text patterns for {}".format(
+                indicator_type))
+
+    print("Report: {:.1f} MB, {} indicators".format(
+        len(text) / 1024 / 1024, sum(len(values) for values in found.values())))
+    print("Full text patterns: {:.2f} s".format(best_of(full_text, text, args.repeat)))
+    print("Scanner:            {:.2f} s".format(best_of(scanned, text, args.repeat)))
+
+
+if __name__ == "__main__":
+    main()
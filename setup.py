@@ -64,7 +64,7 @@ setup(
         "urllib3",
         "uvicorn",
     ],
-    python_requires='>=3.6, <4',
+    python_requires='>=3.7, <4',
     classifiers=[
         "Development Status :: 4 - Beta",
         "Topic :: Utilities",
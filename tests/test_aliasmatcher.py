@@ -0,0 +1,72 @@
+"""
+Alias matcher tests
+"""
+
+import os
+import re
+
+from act.scio.aliasmatcher import AliasMatcher
+from act.scio.aliasregex import get_reg_ex_set, regex_from_alias
+
+VOCABULARY_DATADIR = os.path.join(os.path.dirname(__file__), "vocabulary")
+
+TEST_TEXT = """
+Observed threat actors apt_32, APT-28 and Sofacy Group, also known as
+sofacyGroup, Fancy Bear and APT 3102. APT281 is not a match, and the
+OceanLotus\tGroup is. Apt.6 and apt6 are both matches."""
+
+
+def test_alias_matcher_same_as_regex() -> None:
+    """ matches are the same as findall with the regular expressions from aliases """
+
+    patterns = sorted(get_reg_ex_set(os.path.join(VOCABULARY_DATADIR, "ta_aliases.cfg")))
+
+    matcher = AliasMatcher(patterns)
+
+    expected = [match
+                for pattern in matcher.patterns
+                for match in re.findall(pattern, TEST_TEXT, re.IGNORECASE)]
+
+    assert sorted(matcher.findall(TEST_TEXT)) == sorted(expected)
+    assert "APT-28" in expected
+    assert "OceanLotus\tGroup" in expected
+
+
+def test_alias_matcher_separators() -> None:
+    """ separators and word boundaries are handled as in regex_from_alias """
+
+    matcher = AliasMatcher([regex_from_alias("WannaCry"), regex_from_alias("APT28")])
+
+    assert matcher.findall("wanna -cry, wannacry and WANNA_CRY") == \
+        ["wanna -cry", "wannacry", "WANNA_CRY"]
+    assert matcher.findall("apt 28 apt-29 xapt28 apt288") == ["apt 28", "apt-29"]
+
+
+def test_alias_matcher_unsupported() -> None:
+    """ patterns with unsupported syntax are returned as unsupported """
+
+    matcher = AliasMatcher([regex_from_alias("Sakula (variant)"), regex_from_alias("Agent.BTZ")])
+
+    assert matcher.unsupported_patterns == [regex_from_alias("Sakula (variant)")]
+    assert matcher.findall("Agent.btz and agent-btz") == ["Agent.btz", "agent-btz"]
+
+
+def test_alias_matcher_case_folding() -> None:
+    """ case insensitive matching is the same as re, also for non-ASCII characters """
+
+    aliases = ["Ayyıldız Tim", "Sath-ı Müdafaa", "Sisters", "Kimsuky"]
+    text = "Ayyildiz Tim, AYYILDIZ TIM, ayyıldız tim, SATH-I MÜDAFAA, Sath-ı müdafaa, " + \
+        "ſiſters, Kimſuky, \u212aimsuky and \u0130ndia"
+
+    matcher = AliasMatcher([regex_from_alias(alias) for alias in aliases])
+
+    expected = [match
+                for alias in aliases
+                for match in re.findall(regex_from_alias(alias), text, re.IGNORECASE)]
+
+    assert sorted(matcher.findall(text) + [match
+                                           for pattern in matcher.unsupported_patterns
+                                           for match in re.findall(pattern, text, re.IGNORECASE)]) \
+        == sorted(expected)
+    assert "AYYILDIZ TIM" in expected
+    assert "Kimſuky" in expected
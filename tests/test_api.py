@@ -0,0 +1,324 @@
+""" test api """
+
+import argparse
+import asyncio
+import base64
+import hashlib
+import json
+import os
+import time
+from typing import AsyncIterator, List, Optional
+
+import pytest
+from fastapi import HTTPException
+
+from act.scio import api
+from act.scio.producer import BeanstalkProducer
+from act.scio.queue_stats import QueueStats
+from act.scio.response_cache import ResponseCache
+
+
+class FakeBeanstalk:
+    """ beanstalk client recording jobs """
+
+    def __init__(self, ready: int = 0, jobs: Optional[List[bytes]] = None,
+                 delay: float = 0) -> None:
+        self.jobs: List[bytes] = [] if jobs is None else jobs
+        self.ready = ready
+        self.delay = delay
+        self.polls = 0
+
+    def tubes(self) -> List[str]:
+        self.polls += 1
+        return ["scio_doc"]
+
+    def stats_tube(self, tube: str) -> dict:
+        return {"current-jobs-ready": self.ready}
+
+    def put(self, body: bytes) -> None:
+        time.sleep(self.delay)
+        self.jobs.append(body)
+
+    def close(self) -> None:
+        pass
+
+
+class FakeElasticsearch:
+    """ slow elasticsearch client """
+
+    def __init__(self, filename: str, delay: float = 0) -> None:
+        self.filename = filename
+        self.delay = delay
+
+    def get(self, index: str, id: str) -> dict:  # pylint: disable=redefined-builtin
+        time.sleep(self.delay)
+        return {"_source": {"filename": self.filename,
+                            "metadata": {"Content-Type": "application/pdf"}}}
+
+
+class FakeIndicatorIndex:
+    """ elasticsearch client with indicators in the indicator index """
+
+    def __init__(self, values: List[str]) -> None:
+        self.values = sorted(values)
+        self.searches = 0
+
+    def search(self, index: str, body: dict, request_timeout: float = 0) -> dict:
+        if "aggs" in body:
+            return {"hits": {"total": {"value": len(self.values)}},
+                    "aggregations": {"max_date": {"value": 1600000000000}}}
+
+        self.searches += 1
+        after = body.get("search_after", [""])[0]
+        values = [value for value in self.values if value > after][:body["size"]]
+        return {"hits": {"hits": [{"_source": {"value": value}, "sort": [value]}
+                                  for value in values]}}
+
+
+class FakeRequest:
+    """ request streaming the body in chunks """
+
+    def __init__(self, chunks: List[bytes], headers: Optional[dict] = None) -> None:
+        self.chunks = chunks
+        self.headers: dict = headers or {}
+
+    async def stream(self) -> AsyncIterator[bytes]:
+        for chunk in self.chunks:
+            yield chunk
+
+
+def api_args(tmp_path, ready: int = 0, delay: float = 0) -> argparse.Namespace:
+    jobs: List[bytes] = []
+    return argparse.Namespace(jobs=jobs,
+                              producer=BeanstalkProducer(
+                                  lambda: FakeBeanstalk(jobs=jobs, delay=delay)),
+                              document_path=str(tmp_path),
+                              max_jobs=10,
+                              max_size=1,
+                              queue_stats=QueueStats(FakeBeanstalk(ready), api.QUEUE_TUBES))
+
+
+@pytest.mark.asyncio
+async def test_submit(tmp_path) -> None:
+    """ base64 encoded documents are decoded, stored and sent to tika """
+
+    args = api_args(tmp_path)
+    content = b"x" * 1000
+
+    doc = api.Document(filename="report.pdf", content=base64.b64encode(content).decode(),
+                       uri=None)
+
+    res = await api.submit(doc, args)
+
+    assert res.hexdigest == hashlib.sha256(content).hexdigest()
+    assert res.count == 1000
+    assert open(res.filename, "rb").read() == content
+    assert json.loads(args.jobs[0])["hexdigest"] == res.hexdigest
+
+
+@pytest.mark.asyncio
+async def test_submit_raw(tmp_path) -> None:
+    """ raw documents are streamed to disk and sent to tika """
+
+    args = api_args(tmp_path)
+    chunks = [b"x" * 1000, b"y" * 1000]
+
+    res = await api.submit_raw(FakeRequest(chunks), "../report.pdf", None, args)
+
+    assert res.filename == os.path.join(str(tmp_path), "report.pdf")
+    assert res.hexdigest == hashlib.sha256(b"".join(chunks)).hexdigest()
+    assert res.count == 2000
+    assert open(res.filename, "rb").read() == b"".join(chunks)
+    assert json.loads(args.jobs[0])["hexdigest"] == res.hexdigest
+
+
+@pytest.mark.asyncio
+async def test_submit_raw_too_large(tmp_path) -> None:
+    """ documents larger than max size are rejected """
+
+    args = api_args(tmp_path)
+    chunks = [b"x" * 1024 * 1024, b"y"]
+
+    with pytest.raises(HTTPException) as err:
+        await api.submit_raw(FakeRequest(chunks), "report.pdf", None, args)
+
+    assert err.value.status_code == 413
+    assert os.listdir(str(tmp_path)) == []
+    assert not args.jobs
+
+
+@pytest.mark.asyncio
+async def test_submit_backpressure(tmp_path) -> None:
+    """ submit responds with 429 when there are too many jobs in queue """
+
+    args = api_args(tmp_path, ready=10)
+
+    with pytest.raises(HTTPException) as err:
+        await api.submit_raw(FakeRequest([b"x"]), "report.pdf", None, args)
+
+    assert err.value.status_code == 429
+    assert not args.jobs
+
+
+def test_queue_stats() -> None:
+    """ queue stats are served from the snapshot until it is stale """
+
+    client = FakeBeanstalk(ready=3)
+    stats = QueueStats(client, api.QUEUE_TUBES, interval=60)
+
+    assert stats.max_jobs_ready() == 3
+    assert stats.max_jobs_ready() == 3
+    assert client.polls == 1
+
+    res = api.queue(argparse.Namespace(queue_stats=stats, max_jobs=10))
+
+    assert res["tubes"] == {"scio_doc": {"current-jobs-ready": 3}}
+    assert res["max_jobs"] == 10
+    assert client.polls == 1
+
+    stats.updated = 0
+    assert stats.snapshot()["age"] < 60
+    assert client.polls == 2
+
+
+@pytest.mark.asyncio
+async def test_queue_stats_poller() -> None:
+    """ queue stats are polled in the background """
+
+    client = FakeBeanstalk(ready=1)
+    stats = QueueStats(client, api.QUEUE_TUBES, interval=0.01)
+
+    task = asyncio.ensure_future(stats.run())
+    await asyncio.sleep(0.1)
+    task.cancel()
+
+    assert client.polls > 1
+    assert stats.max_jobs_ready() == 1
+
+
+@pytest.mark.asyncio
+async def test_download_json(tmp_path) -> None:
+    """ documents are streamed base64 encoded in json """
+
+    content = os.urandom(api.CHUNK_SIZE * 2 + 1)
+    filename = tmp_path / "report.pdf"
+    filename.write_bytes(content)
+
+    args = argparse.Namespace(elasticsearch_client=FakeElasticsearch(str(filename)))
+
+    res = await api.download_json("a" * 64, args)
+    body = b"".join([chunk async for chunk in res.body_iterator])
+
+    assert json.loads(body) == {
+        "error": None,
+        "bytes": len(content),
+        "content": base64.b64encode(content).decode("ascii"),
+        "encoding": "base64"}
+
+
+@pytest.mark.asyncio
+async def test_concurrent_requests(tmp_path) -> None:
+    """ slow elasticsearch and beanstalk calls do not block concurrent requests """
+
+    filename = tmp_path / "report.pdf"
+    filename.write_bytes(b"report")
+
+    args = api_args(tmp_path, delay=0.2)
+    args.elasticsearch_client = FakeElasticsearch(str(filename), delay=0.2)
+
+    start = time.time()
+
+    await asyncio.gather(
+        *[api.download_json("a" * 64, args) for _ in range(10)],
+        *[api.submit_raw(FakeRequest([b"x"]), "doc{}.txt".format(i), None, args)
+          for i in range(8)])
+
+    # 10 lookups and 8 puts of 0.2 seconds each, with 4 beanstalk connections
+    assert time.time() - start < 1.2
+    assert len(args.jobs) == 8
+    assert len(args.producer.clients) == 4
+
+
+class BrokenBeanstalk(FakeBeanstalk):
+    """ beanstalk client with a broken connection """
+
+    def put(self, body: bytes) -> None:
+        raise ConnectionResetError("Connection reset by peer")
+
+
+@pytest.mark.asyncio
+async def test_producer_reconnect(tmp_path) -> None:
+    """ broken connections are replaced, and requests are not blocked forever """
+
+    args = api_args(tmp_path)
+    connections = [BrokenBeanstalk(), FakeBeanstalk(jobs=args.jobs)]
+    args.producer = BeanstalkProducer(lambda: connections.pop(0), size=1, timeout=0.1)
+
+    with pytest.raises(HTTPException) as err:
+        await api.submit_raw(FakeRequest([b"x"]), "doc1.txt", None, args)
+
+    assert err.value.status_code == 503
+
+    # The broken connection is replaced by a new connection
+    await api.submit_raw(FakeRequest([b"x"]), "doc2.txt", None, args)
+
+    assert len(args.jobs) == 1
+    assert len(args.producer.clients) == 1
+
+    # All connections in use
+    client = args.producer.acquire()
+
+    with pytest.raises(HTTPException) as err:
+        await api.submit_raw(FakeRequest([b"x"]), "doc3.txt", None, args)
+
+    assert err.value.status_code == 503
+    assert client in args.producer.clients
+
+
+@pytest.mark.asyncio
+async def test_indicators() -> None:
+    """ indicators are streamed, and cached with an etag """
+
+    values = ["{:05}.example.com".format(i) for i in range(2500)]
+    client = FakeIndicatorIndex(values)
+
+    args = argparse.Namespace(elasticsearch_client=client,
+                              indicator_index="scio2-indicators",
+                              indicator_cache=ResponseCache(ttl=60),
+                              indicator_cache_ttl=60,
+                              es_page_size=1000,
+                              es_timeout=10)
+
+    res = api.indicators(FakeRequest([]), "fqdn", "90d", args)
+    chunks = [chunk async for chunk in res.body_iterator]
+
+    assert len(chunks) == 3
+    assert b"".join(chunks).decode("utf8") == "\n".join(values)
+
+    tag = res.headers["etag"]
+    searches = client.searches
+
+    res = api.indicators(FakeRequest([]), "fqdn", "90d", args)
+
+    assert res.body.decode("utf8") == "\n".join(values)
+    assert res.headers["etag"] == tag
+    assert client.searches == searches
+
+    res = api.indicators(FakeRequest([], {"if-none-match": res.headers["etag"]}),
+                         "fqdn", "90d", args)
+
+    assert res.status_code == 304
+
+    # Other windows are not served from the cache, and have another etag
+    res = api.indicators(FakeRequest([]), "fqdn", "7d", args)
+
+    assert res.headers["etag"] != tag
+
+    # Exports that are not cached get 304 without reading the indicators
+    args.indicator_cache_ttl = 0
+    searches = client.searches
+
+    res = api.indicators(FakeRequest([], {"if-none-match": tag}), "fqdn", "90d", args)
+
+    assert res.status_code == 304
+    assert client.searches == searches
@@ -0,0 +1,95 @@
+""" test blob store """
+
+import gzip
+import json
+import os
+
+import greenstalk
+
+from act.scio import analyze
+from act.scio.blobstore import BlobStore, blob_name
+
+
+class FakeClient:
+    """ beanstalk client with a single job """
+
+    def __init__(self, body: bytes) -> None:
+        self.job = greenstalk.Job(1, body)
+        self.deleted = False
+        self.buried = False
+
+    def reserve(self, timeout=None) -> greenstalk.Job:
+        return self.job
+
+    def delete(self, job: greenstalk.Job) -> None:
+        self.deleted = True
+
+    def bury(self, job: greenstalk.Job) -> None:
+        self.buried = True
+
+
+def test_blob_store(tmp_path) -> None:
+    """ blobs are stored by sha256, sharded in directories """
+
+    store = BlobStore(str(tmp_path))
+
+    name = store.put(b"data")
+
+    assert name.startswith("3a6eb0790f39ac87c94f3856b2dd2c5d110e6811602261a9a923d3bb23adc8b7-")
+    assert os.path.isfile(os.path.join(str(tmp_path), "3a", "6e", name))
+    assert store.get(name) == b"data"
+
+    # Each put has its own blob, so deleting one does not delete the other
+    other = store.put(b"data")
+
+    assert other != name
+
+    store.delete(name)
+
+    assert not os.path.isfile(store.path(name))
+    assert store.get(other) == b"data"
+
+
+def test_get_input_blob(tmp_path) -> None:
+    """ documents are read from the blob store when the job is a pointer """
+
+    store = BlobStore(str(tmp_path))
+    document = gzip.compress(json.dumps({"content": "text", "hexdigest": "abc"}).encode("utf8"))
+
+    pointer = store.pointer(document).encode("utf8")
+
+    assert store.get(blob_name(pointer)) == document
+    assert blob_name(document) is None
+
+    client = FakeClient(pointer)
+    nlpdata = analyze.get_input(client, blob_store=store)
+
+    assert nlpdata == {"content": "text", "hexdigest": "abc"}
+    assert client.deleted
+    assert not os.path.isfile(store.path(blob_name(pointer)))
+
+    # Inline documents are still supported
+    assert analyze.get_input(FakeClient(document), blob_store=store).content == "text"
+
+
+def test_get_input_missing_blob(tmp_path) -> None:
+    """ jobs pointing to blobs that can not be read are buried """
+
+    store = BlobStore(str(tmp_path))
+    document = gzip.compress(json.dumps({"content": "text"}).encode("utf8"))
+
+    pointer = store.pointer(document).encode("utf8")
+
+    # No blob store configured
+    client = FakeClient(pointer)
+
+    assert analyze.get_input(client) == {}
+    assert client.buried and not client.deleted
+    assert store.get(blob_name(pointer)) == document
+
+    # Missing blob
+    store.delete(blob_name(pointer))
+    client = FakeClient(pointer)
+
+    assert analyze.get_input(client, blob_store=store) == {}
+    assert client.buried and not client.deleted
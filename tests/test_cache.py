@@ -0,0 +1,59 @@
+""" test upload cache """
+
+import sqlite3
+
+from act.scio import cache
+
+
+def test_cache(tmp_path) -> None:
+    """ digests are looked up in bulk and inserted in batches """
+
+    upload_cache = cache.Cache(str(tmp_path / "upload.db"))
+
+    with upload_cache.batch():
+        for i in range(10):
+            upload_cache.insert("file{}".format(i), "digest{}".format(i), "desc")
+
+        # Duplicate digests are ignored
+        upload_cache.insert("other", "digest0")
+
+    assert upload_cache.contains("digest0")
+    assert not upload_cache.contains("digest10")
+    assert upload_cache.contains_many(["digest{}".format(i) for i in range(5, 1005)]) == \
+        {"digest{}".format(i) for i in range(5, 10)}
+    assert upload_cache.info("digest0") == [
+        {"filename": "file0", "sha256": "digest0", "description": "desc"}]
+
+    upload_cache.close()
+
+    conn = sqlite3.connect(str(tmp_path / "upload.db"))
+    assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    assert conn.execute("SELECT COUNT(*) FROM upload").fetchone()[0] == 10
+
+
+def test_cache_migration(tmp_path) -> None:
+    """ existing databases are deduplicated and indexed """
+
+    filename = str(tmp_path / "upload.db")
+
+    conn = sqlite3.connect(filename)
+    conn.execute("""CREATE TABLE upload (
+                        id integer PRIMARY KEY,
+                        filename text NOT NULL,
+                        sha256 text NOT NULL,
+                        description text)""")
+    conn.executemany("INSERT INTO upload(filename, sha256, description) VALUES(?,?,?)",
+                     [("a", "digest0", ""), ("b", "digest0", ""), ("c", "digest1", "")])
+    conn.commit()
+    conn.close()
+
+    upload_cache = cache.Cache(filename)
+
+    assert upload_cache.info("digest0") == [
+        {"filename": "a", "sha256": "digest0", "description": ""}]
+    assert upload_cache.conn.execute("PRAGMA user_version").fetchone()[0] == \
+        cache.SCHEMA_VERSION
+
+    plan = upload_cache.conn.execute(
+        "EXPLAIN QUERY PLAN SELECT 1 FROM upload WHERE sha256 = ?", ("digest0",)).fetchall()
+    assert "upload_sha256" in str(plan)
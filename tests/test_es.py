@@ -0,0 +1,333 @@
+""" test elasticsearch utilities """
+
+import json
+import re
+import textwrap
+from typing import Any, Dict, List
+
+import pytest
+
+from act.scio import es
+
+
+class FakeClient:
+    """ Fake elasticsearch client rejecting documents in the reject list once """
+
+    def __init__(self, reject: List[str]) -> None:
+        self.reject = reject
+        self.requests: List[List[Dict]] = []
+        self.stored: List[str] = []
+
+    def bulk(self, body: str) -> Dict[str, Any]:
+        lines = [json.loads(line) for line in body.splitlines()]
+        actions = lines[::2]
+        self.requests.append(actions)
+
+        items = []
+        for action in actions:
+            doc_id = next(iter(action.values()))["_id"]
+            if doc_id in self.reject:
+                self.reject.remove(doc_id)
+                items.append({"index": {"_id": doc_id, "status": 429}})
+            else:
+                self.stored.append(doc_id)
+                items.append({"index": {"_id": doc_id, "status": 201}})
+
+        return {"errors": False, "items": items}
+
+
+def test_bulk_indexer_batch() -> None:
+    """ documents are sent when the buffer is full """
+
+    client = FakeClient(reject=[])
+    indexer = es.BulkIndexer(client, max_docs=2, flush_interval=3600)  # type: ignore
+
+    indexer.index("scio2", "a", {"content": "a"})
+    assert not client.requests
+
+    indexer.index("scio2", "b", {"content": "b"})
+    indexer.index("scio2", "c", {"content": "c"})
+    assert client.stored == ["a", "b"]
+
+    indexer.flush()
+    assert client.stored == ["a", "b", "c"]
+    assert len(client.requests) == 2
+
+
+def test_bulk_indexer_retry() -> None:
+    """ rejected documents are retried """
+
+    client = FakeClient(reject=["b"])
+    indexer = es.BulkIndexer(client, max_docs=10, backoff=0)  # type: ignore
+
+    indexer.index("scio2", "a", {"content": "a"})
+    indexer.index("scio2", "b", {"content": "b"})
+    indexer.flush()
+
+    assert client.stored == ["a", "b"]
+    assert [len(r) for r in client.requests] == [2, 1]
+
+
+def test_bulk_indexer_error() -> None:
+    """ documents rejected after all retries raise BulkError """
+
+    client = FakeClient(reject=["a"] * 3)
+    indexer = es.BulkIndexer(client, max_retries=2, backoff=0)  # type: ignore
+
+    indexer.index("scio2", "a", {"content": "a"})
+
+    with pytest.raises(es.BulkError):
+        indexer.flush()
+
+
+class FakeSearchClient:
+    """ Fake elasticsearch client returning sorted indicators """
+
+    def __init__(self, values: List[str]) -> None:
+        self.values = sorted(values)
+        self.bodies: List[Dict] = []
+
+    def search(self, index: str, body: Dict) -> Dict[str, Any]:
+        self.bodies.append(json.loads(json.dumps(body)))
+        after = body.get("search_after", [""])[0]
+        values = [value for value in self.values if value > after][:body["size"]]
+        return {"hits": {"hits": [{"_source": {"value": value}, "sort": [value]}
+                                  for value in values]}}
+
+
+def test_index_indicators() -> None:
+    """ indicators are upserted with a document per type and value """
+
+    client = FakeClient(reject=[])
+    indexer = es.BulkIndexer(client, max_docs=10)  # type: ignore
+
+    indexer.index_indicators(
+        es.INDICATOR_INDEX,
+        {"fqdn": ["example.com", "example.com"], "md5": []},
+        "2020-01-01T00:00:00+00:00",
+        "abc")
+
+    lines = [json.loads(line) for line in indexer.buffer[0][1].splitlines()]
+
+    assert len(indexer.buffer) == 1
+    assert lines[0]["update"]["_id"] == es.indicator_id("fqdn", "example.com")
+    assert lines[1]["upsert"] == {
+        "type": "fqdn",
+        "value": "example.com",
+        "first_seen": "2020-01-01T00:00:00+00:00",
+        "last_seen": "2020-01-01T00:00:00+00:00",
+        "count": 1,
+        "documents": ["abc"]}
+    assert lines[1]["script"]["params"] == {
+        "seen": "2020-01-01T00:00:00+00:00",
+        "document": "abc",
+        "max_documents": es.INDICATOR_DOCUMENTS}
+
+
+class Source:
+    """ attribute access to an indicator, as ctx._source in painless """
+
+    def __init__(self, **fields: Any) -> None:
+        self.__dict__.update(fields)
+
+
+class JavaList(list):
+    """ the list methods used by the indicator script """
+
+    def contains(self, value: Any) -> bool:
+        return value in self
+
+    def add(self, value: Any) -> None:
+        self.append(value)
+
+    def size(self) -> int:
+        return len(self)
+
+    def remove(self, index: int) -> None:  # type: ignore
+        del self[index]
+
+
+class JavaString(str):
+    """ the string methods used by the indicator script """
+
+    def compareTo(self, other: str) -> int:  # pylint: disable=invalid-name
+        return (self > other) - (self < other)
+
+
+def run_indicator_script(source: Dict[str, Any], params: Dict[str, Any]) -> Source:
+    """ run the painless indicator script, translated to python, on source """
+
+    lines = []
+    for line in es.INDICATOR_SCRIPT["source"].splitlines():
+        line = line.rstrip()
+        if not line.strip() or line.strip() == "}":
+            continue
+        line = re.sub(r"^(\s*)if \((.*)\) \{$", r"\1if \2:", line)
+        line = line.replace("boolean ", "").replace("!", "not ").rstrip(";")
+        line = line.replace("null", "None").replace("[]", "JavaList()")
+        line = line.replace("true", "True").replace("false", "False")
+        lines.append(line)
+
+    ctx = Source(op="index", _source=Source(**{
+        key: JavaList(value) if isinstance(value, list) else
+        JavaString(value) if isinstance(value, str) else value
+        for key, value in source.items()}))
+
+    params = {key: JavaString(value) if isinstance(value, str) else value
+              for key, value in params.items()}
+
+    exec(textwrap.dedent("\n".join(lines)),  # pylint: disable=exec-used
+         {"JavaList": JavaList, "ctx": ctx, "params": Source(**params)})
+
+    return ctx
+
+
+def test_indicator_script_reindex() -> None:
+    """ reindexed documents are not counted twice, but update first and last seen """
+
+    indicator = {"first_seen": "2020-01-02", "last_seen": "2020-01-02", "count": 1,
+                 "documents": ["abc"]}
+
+    ctx = run_indicator_script(
+        indicator, {"seen": "2020-01-03", "document": "abc", "max_documents": 2})
+
+    assert ctx.op == "index"
+    assert ctx._source.count == 1
+    assert ctx._source.last_seen == "2020-01-03"
+    assert ctx._source.documents == ["abc"]
+
+    ctx = run_indicator_script(
+        indicator, {"seen": "2020-01-01", "document": "abc", "max_documents": 2})
+
+    assert ctx._source.first_seen == "2020-01-01"
+
+    # Retried update
+    ctx = run_indicator_script(
+        indicator, {"seen": "2020-01-02", "document": "abc", "max_documents": 2})
+
+    assert ctx.op == "noop"
+
+    # New documents are counted, keeping the last max_documents
+    ctx = run_indicator_script(
+        dict(indicator, documents=["abc", "def"]),
+        {"seen": "2020-01-02", "document": "ghi", "max_documents": 2})
+
+    assert ctx.op == "index"
+    assert ctx._source.count == 2
+    assert ctx._source.documents == ["def", "ghi"]
+
+
+class FakeIndices:
+    """ Fake indices client of an existing indicator index """
+
+    def exists(self, index: str) -> bool:
+        return True
+
+    def get_settings(self, index: str, name: str) -> Dict[str, Any]:
+        return {index: {"settings": {"index": {"creation_date": "1600000000000"}}}}
+
+
+def test_backfill_indicators(monkeypatch) -> None:
+    """ indicators of documents analyzed before the index was created are added """
+
+    client = FakeClient(reject=[])
+    client.indices = FakeIndices()  # type: ignore
+    queries: List[Dict] = []
+
+    def scan(client: Any, index: str, query: Dict) -> List[Dict]:
+        queries.append(query)
+        return [
+            {"_id": "doc1", "_source": {
+                "hexdigest": "doc1",
+                "Analyzed-Date": "2020-01-01T00:00:00+00:00",
+                "indicators": {"fqdn": ["example.com"], "md5": []}}},
+            {"_id": "doc2", "_source": {
+                "hexdigest": "doc2",
+                "Analyzed-Date": "2020-01-02T00:00:00+00:00"}},
+        ]
+
+    monkeypatch.setattr("elasticsearch.helpers.scan", scan)
+
+    indexer = es.BulkIndexer(client)  # type: ignore
+
+    assert es.backfill_indicators(client, indexer) == 2  # type: ignore
+
+    assert queries[0]["query"]["range"]["Analyzed-Date"] == {
+        "lt": "1600000000000", "format": "epoch_millis"}
+    assert client.stored == [es.indicator_id("fqdn", "example.com")]
+
+
+def test_indicator_values() -> None:
+    """ all indicators are returned, paging with search_after """
+
+    values = ["{}.example.com".format(i) for i in range(25)]
+    client = FakeSearchClient(values)
+
+    assert list(es.indicator_values(client, "fqdn", "now-90d", size=10)) == \
+        sorted(values)  # type: ignore
+
+    assert len(client.bodies) == 3
+    assert client.bodies[2]["search_after"] == [sorted(values)[19]]
+    assert client.bodies[0]["query"]["bool"]["filter"][0] == {"term": {"type": "fqdn"}}
+
+
+def test_parallel_aggregation(monkeypatch) -> None:
+    """ time slices are aggregated in parallel and merged in order """
+
+    term = "indicators.fqdn.keyword"
+
+    slices = {
+        "0": [("a.com", 1), ("c.com", 2)],
+        "10": [("b.com", 1), ("c.com", 1), ("d.com", 3)],
+    }
+
+    def aggregation(client: Any, terms: List[str], start: str, *args: Any) -> Any:
+        for value, doc_count in slices[start]:
+            yield ({term: value, "path": value}, doc_count)
+
+    monkeypatch.setattr(es, "time_slices", lambda *args: [(0, 9), (10, 19)])
+    monkeypatch.setattr(es, "aggregation", aggregation)
+
+    res = list(es.parallel_aggregation(None, [term], "now-90d", "now"))  # type: ignore
+
+    assert [(path[term], doc_count) for path, doc_count in res] == [
+        ("a.com", 1), ("b.com", 1), ("c.com", 3), ("d.com", 3)]
+
+
+def test_parallel_aggregation_lazy(monkeypatch) -> None:
+    """ slices are merged as they are read, without reading all buckets first """
+
+    term = "indicators.fqdn.keyword"
+    produced = {"0": 0, "10": 0}
+
+    def aggregation(client: Any, terms: List[str], start: str, *args: Any) -> Any:
+        for i in range(10000):
+            produced[start] += 1
+            yield ({term: "{}.{:05}.com".format(start, i), "path": ""}, 1)
+
+    monkeypatch.setattr(es, "time_slices", lambda *args: [(0, 9), (10, 19)])
+    monkeypatch.setattr(es, "aggregation", aggregation)
+
+    res = es.parallel_aggregation(None, [term], "now-90d", "now", size=10)  # type: ignore
+
+    assert next(res)[0][term] == "0.00000.com"
+
+    # Close the merge before all buckets are read, stopping the threads
+    res.close()
+
+    assert max(produced.values()) <= (es.SLICE_BUFFER + 2) * 10
+
+
+def test_parallel_aggregation_error(monkeypatch) -> None:
+    """ errors in a slice are raised by the merge """
+
+    def aggregation(client: Any, terms: List[str], start: str, *args: Any) -> Any:
+        if start == "10":
+            raise ValueError("Slice failed")
+        yield ({"term": "a.com", "path": ""}, 1)
+
+    monkeypatch.setattr(es, "time_slices", lambda *args: [(0, 9), (10, 19)])
+    monkeypatch.setattr(es, "aggregation", aggregation)
+
+    with pytest.raises(ValueError):
+        list(es.parallel_aggregation(None, ["term"], "now-90d", "now"))  # type: ignore
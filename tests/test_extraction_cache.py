@@ -0,0 +1,53 @@
+""" test extraction cache """
+
+import os
+
+from act.scio import tika_engine
+from act.scio.extraction_cache import ExtractionCache
+
+
+def test_extraction_cache_eviction(tmp_path) -> None:
+    """ least recently used extractions are evicted when the cache is full """
+
+    # Random data is not compressible, so each extraction is about 170 bytes
+    values = [os.urandom(120).hex() for _ in range(3)]
+
+    cache = ExtractionCache(str(tmp_path / "extractions.db"), max_bytes=400)
+
+    cache.put("doc1", {"content": values[0]})
+    cache.put("doc2", {"content": values[1]})
+
+    assert cache.get("doc1") == {"content": values[0]}
+
+    # doc2 is now the least recently used extraction
+    cache.put("doc3", {"content": values[2]})
+
+    assert cache.get("doc2") is None
+    assert cache.get("doc3") == {"content": values[2]}
+
+    assert cache.stats()["hits"] == 2
+    assert cache.stats()["misses"] == 1
+
+
+def test_cached_extraction(monkeypatch, tmp_path) -> None:
+    """ duplicate documents are only sent to tika once """
+
+    calls = []
+
+    def from_buffer(content: bytes) -> dict:
+        calls.append(content)
+        return {"content": content.decode("utf8"), "metadata": {}, "status": 200}
+
+    monkeypatch.setattr(tika_engine.parser, "from_buffer", from_buffer)
+
+    cache = ExtractionCache(str(tmp_path / "extractions.db"))
+    server = tika_engine.Server(extraction_cache=cache)
+
+    meta_data = {"filename": "report.pdf", "hexdigest": "abc"}
+
+    for _ in range(3):
+        data = server.extract_content(meta_data, b"%PDF-1.4 document", 0)
+        assert data["content"] == "%PDF-1.4 document"
+
+    assert len(calls) == 1
+    assert cache.stats()["hit_rate"] == 2 / 3
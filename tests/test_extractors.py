@@ -0,0 +1,43 @@
+""" test in-process extractors """
+
+from act.scio import extractors
+
+HTML = b"""<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>APT28  report</title>
+<meta name="author" content="mnemonic">
+<style>p { color: red; }</style><script>var x = "<p>";</script></head>
+<body><h1>Heading</h1><p>First  paragraph &amp; more<br>next line</p>
+<ul><li>one</li><li>two</li></ul></body></html>"""
+
+
+def test_extract_html() -> None:
+    """ text and metadata from html """
+
+    res = extractors.extract(HTML, "text/html")
+
+    assert res["status"] == 200
+    assert res["content"] == "APT28 report\nHeading\nFirst paragraph & more\nnext line\none\ntwo"
+    assert res["metadata"]["title"] == "APT28 report"
+    assert res["metadata"]["author"] == "mnemonic"
+    assert res["metadata"]["Content-Type"] == "text/html; charset=UTF-8"
+
+
+def test_extract_text() -> None:
+    """ text is decoded, and binary formats are left for tika """
+
+    assert extractors.extract(b"caf\xc3\xa9", "text/plain", "a.txt")["content"] == "café"
+    assert extractors.extract(b"caf\xe9", "text/plain", "a.txt")["metadata"][
+        "Content-Encoding"] == "WINDOWS-1252"
+    assert extractors.extract(b"<a><b>x</b><c>y</c></a>", "text/xml")["content"] == "x\ny"
+    assert extractors.extract(b"%PDF-1.4", "application/pdf") is None
+
+
+def test_extract_unknown_text() -> None:
+    """ text/plain from libmagic is only trusted if the filename agrees """
+
+    fragment = b"<p>APT28 &amp; <b>Sofacy</b></p>"
+
+    assert extractors.extract(fragment, "text/plain", "fragment.html")["content"] == \
+        "APT28 & Sofacy"
+    assert extractors.extract(fragment, "text/plain", "fragment") is None
+    assert extractors.extract(b"text", "text/plain") is None
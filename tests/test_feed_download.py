@@ -1,8 +1,416 @@
 """ test feed download """
 
-from act.scio.feeds import extract
+import argparse
+import io
+import threading
+import time
+import urllib.parse
+from typing import Any, Dict, List
+
+import pytest
+import requests
+
+from act.scio.feeds import crawler, download, extract, feeds, state
+from act.scio.feeds.scheduler import Scheduler
+from act.scio.feeds.state import FeedState, FeedUpdate, Validator
 
 
 def test_safe_download() -> None:
     """ test for safe download """
     assert extract.safe_filename("test%.[x y z]") == "test.x_y_z"
+
+
+def feed_response(status_code: int, body: bytes, etag: str) -> requests.Response:
+    response = requests.Response()
+    response.status_code = status_code
+    response._content = body  # pylint: disable=protected-access
+    response.raw = io.BytesIO(body)
+    response.headers["ETag"] = etag
+    return response
+
+
+def test_conditional_feed_download(monkeypatch, tmp_path) -> None:
+    """ unmodified feeds are not parsed """
+
+    feed = b"<rss version='2.0'><channel><title>{}</title></channel></rss>"
+    server = {"body": feed.replace(b"{}", b"v1"), "etag": '"v1"', "conditional": True}
+    requests_headers = []
+
+    def get(url: str, headers: dict, **kwargs: Any) -> requests.Response:
+        requests_headers.append(headers)
+        if server["conditional"] and headers.get("If-None-Match") == server["etag"]:
+            return feed_response(304, b"", server["etag"])
+        return feed_response(200, server["body"], server["etag"])
+
+    monkeypatch.setattr(download.requests, "get", get)
+
+    args = argparse.Namespace(feed_state=FeedState(str(tmp_path / "state.db")),
+                              proxy_string=None,
+                              scheduler=None)
+
+    assert download.handle_feed(args, "https://example.com/feed", False)[0] == "OK"
+    assert "If-None-Match" not in requests_headers[-1]
+
+    # The state is stored when the files of the feed are uploaded
+    assert args.feed_state.validator("https://example.com/feed") is None
+    args.feed_state.store_pending()
+
+    # Server responds 304
+    assert download.handle_feed(args, "https://example.com/feed", False)[0] == "NOT MODIFIED"
+    assert requests_headers[-1]["If-None-Match"] == '"v1"'
+
+    # Server ignores conditional requests, but the body is unchanged
+    server["conditional"] = False
+    assert download.handle_feed(args, "https://example.com/feed", False)[0] == "NOT MODIFIED"
+
+    server.update(body=feed.replace(b"{}", b"v2"), etag='"v2"')
+    assert download.handle_feed(args, "https://example.com/feed", False)[0] == "OK"
+    args.feed_state.store_pending()
+    assert args.feed_state.validator("https://example.com/feed").etag == '"v2"'
+
+
+def test_not_modified_seen_entries(monkeypatch, tmp_path) -> None:
+    """ entries of feeds that are not modified do not expire """
+
+    body = b"<rss version='2.0'><channel><item><guid>urn:a</guid></item></channel></rss>"
+    now = [1000000.0]
+
+    def get(url: str, headers: dict, **kwargs: Any) -> requests.Response:
+        if headers.get("If-None-Match") == '"v1"':
+            return feed_response(304, b"", '"v1"')
+        return feed_response(200, body, '"v1"')
+
+    monkeypatch.setattr(download.requests, "get", get)
+    monkeypatch.setattr(extract, "partial_entry_text_to_file",
+                        lambda args, entry: (entry["id"], None))
+    monkeypatch.setattr(state.time, "time", lambda: now[0])
+
+    args = argparse.Namespace(feed_state=FeedState(str(tmp_path / "state.db")),
+                              proxy_string=None,
+                              scheduler=None)
+
+    assert download.handle_feed(args, "https://example.com/feed", True)[0] == "OK"
+    args.feed_state.store_pending()
+
+    now[0] += 3600
+    assert download.handle_feed(args, "https://example.com/feed", True)[0] == "NOT MODIFIED"
+    args.feed_state.store_pending()
+
+    now[0] += 3600
+    args.feed_state.expire_seen(5400)
+
+    assert args.feed_state.seen("https://example.com/feed", "urn:a")
+
+
+def test_seen_entries(monkeypatch, tmp_path) -> None:
+    """ entries are only downloaded the first time they are seen """
+
+    item = "<item><title>{0}</title><guid>urn:{0}</guid><link>https://example.com/{0}</link></item>"
+    server = {"items": ["a", "b"]}
+    downloaded = []
+
+    def get(url: str, headers: dict, **kwargs: Any) -> requests.Response:
+        items = "".join(item.format(i) for i in server["items"])
+        body = "<rss version='2.0'><channel>{}</channel></rss>".format(items)
+        return feed_response(200, body.encode("utf8"), "")
+
+    def partial_entry_text_to_file(args: argparse.Namespace, entry: dict) -> Any:
+        downloaded.append(entry["id"])
+        return entry["id"], None
+
+    monkeypatch.setattr(download.requests, "get", get)
+    monkeypatch.setattr(extract, "partial_entry_text_to_file", partial_entry_text_to_file)
+
+    args = argparse.Namespace(feed_state=FeedState(str(tmp_path / "state.db")),
+                              proxy_string=None,
+                              scheduler=None)
+
+    download.handle_feed(args, "https://example.com/feed", True)
+    args.feed_state.store_pending()
+    assert downloaded == ["urn:a", "urn:b"]
+
+    server["items"].append("c")
+    download.handle_feed(args, "https://example.com/feed", True)
+    args.feed_state.store_pending()
+    assert downloaded == ["urn:a", "urn:b", "urn:c"]
+
+    # Feeds with files that failed to upload are handled again
+    server["items"].append("d")
+    download.handle_feed(args, "https://example.com/feed", True)
+    args.feed_state.store_pending(failed=["urn:d"])
+    download.handle_feed(args, "https://example.com/feed", True)
+    assert downloaded == ["urn:a", "urn:b", "urn:c", "urn:d", "urn:d"]
+
+    # Entries not in the feed for the retention period are forgotten
+    args.feed_state.expire_seen(-1)
+    assert not args.feed_state.seen("https://example.com/feed", "urn:a")
+
+
+@pytest.mark.parametrize("engine", ["threads", "async"])
+def test_failed_entry_retried(monkeypatch, tmp_path, engine: str) -> None:
+    """ feeds with failed entries are not skipped as not modified """
+
+    body = b"<rss version='2.0'><channel><item><guid>urn:a</guid></item></channel></rss>"
+    attempts = []
+
+    def get(url: str, headers: dict, **kwargs: Any) -> requests.Response:
+        if headers.get("If-None-Match") == '"v1"':
+            return feed_response(304, b"", '"v1"')
+        return feed_response(200, body, '"v1"')
+
+    def entry_text_to_file(args: argparse.Namespace, entry: dict) -> Any:
+        attempts.append(entry["id"])
+        # The first attempt fails, with an exception for the async engine
+        if len(attempts) == 1:
+            if engine == "async":
+                raise IOError("Entry failed")
+            return None, None
+        return entry["id"], None
+
+    monkeypatch.setattr(download.requests, "get", get)
+    monkeypatch.setattr(extract, "entry_text_to_file", entry_text_to_file)
+
+    args = argparse.Namespace(feed_state=FeedState(str(tmp_path / "state.db")),
+                              proxy_string=None,
+                              scheduler=None,
+                              max_connections=4,
+                              host_connections=2)
+
+    def handle_feed() -> None:
+        if engine == "async":
+            crawler.crawl(args, ["https://example.com/feed"], [])
+        else:
+            download.handle_feed(args, "https://example.com/feed", False)
+        args.feed_state.store_pending()
+
+    handle_feed()
+
+    assert args.feed_state.validator("https://example.com/feed") is None
+
+    handle_feed()
+
+    assert attempts == ["urn:a", "urn:a"]
+    assert args.feed_state.validator("https://example.com/feed").etag == '"v1"'
+
+    handle_feed()
+
+    assert attempts == ["urn:a", "urn:a"]
+
+
+def test_scheduler_retry(monkeypatch) -> None:
+    """ 429 responses are retried after Retry-After seconds """
+
+    responses = [feed_response(429, b"", ""), feed_response(200, b"ok", "")]
+    responses[0].headers["Retry-After"] = "0"
+
+    monkeypatch.setattr(requests.Session, "request",
+                        lambda session, method, url, **kwargs: responses.pop(0))
+
+    scheduler = Scheduler(backoff=60)
+
+    assert scheduler.get("https://example.com/feed").content == b"ok"
+    assert not responses
+
+
+def test_scheduler_host_connections(monkeypatch) -> None:
+    """ concurrent requests per host are limited, and sessions are reused """
+
+    lock = threading.Lock()
+    in_flight: Dict[str, int] = {}
+    max_in_flight: Dict[str, int] = {}
+    sessions: List[int] = []
+
+    def request(session: requests.Session, method: str, url: str, **kwargs: Any) -> Any:
+        host = url.split("/")[2]
+        with lock:
+            sessions.append(id(session))
+            in_flight[host] = in_flight.get(host, 0) + 1
+            max_in_flight[host] = max(max_in_flight.get(host, 0), in_flight[host])
+        time.sleep(0.05)
+        with lock:
+            in_flight[host] -= 1
+        return feed_response(200, b"ok", "")
+
+    monkeypatch.setattr(requests.Session, "request", request)
+
+    scheduler = Scheduler(max_connections=8, host_connections=2)
+
+    threads = [threading.Thread(target=scheduler.get, args=(url,))
+               for url in ["https://a.example.com/{}".format(i) for i in range(6)] +
+               ["https://b.example.com/{}".format(i) for i in range(6)]]
+
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert max_in_flight == {"a.example.com": 2, "b.example.com": 2}
+    assert len(set(sessions)) == 4
+
+
+def test_scheduler_busy_host(monkeypatch) -> None:
+    """ requests queued for a busy host do not block requests to other hosts """
+
+    def request(session: requests.Session, method: str, url: str, **kwargs: Any) -> Any:
+        time.sleep(0.2)
+        return feed_response(200, b"ok", "")
+
+    monkeypatch.setattr(requests.Session, "request", request)
+
+    scheduler = Scheduler(max_connections=2, host_connections=1)
+
+    threads = [threading.Thread(target=scheduler.get, args=("https://a.example.com/{}".format(i),))
+               for i in range(4)]
+
+    for thread in threads:
+        thread.start()
+
+    time.sleep(0.05)
+
+    start = time.time()
+    scheduler.get("https://b.example.com/")
+
+    assert time.time() - start < 0.35
+
+    for thread in threads:
+        thread.join()
+
+
+def test_download_holds_session(monkeypatch, tmp_path) -> None:
+    """ streamed downloads are read while the request holds its session """
+
+    scheduler = Scheduler(max_connections=1)
+    idle_sessions = []
+
+    class Body(io.BytesIO):
+        """ body recording the idle sessions of the host while read """
+
+        def read(self, *args: Any, **kwargs: Any) -> bytes:
+            idle_sessions.append(len(scheduler.hosts["example.com"].sessions))
+            return super().read(*args)
+
+    def request(session: requests.Session, method: str, url: str, **kwargs: Any) -> Any:
+        response = feed_response(200, b"", "")
+        response.raw = Body(b"%PDF")
+        return response
+
+    monkeypatch.setattr(requests.Session, "request", request)
+    (tmp_path / "download").mkdir()
+
+    link = urllib.parse.urlparse("https://example.com/report.pdf")
+    res = download.download_and_store("https://example.com/feed", None, str(tmp_path),
+                                      None, link, scheduler)
+
+    assert open(res["filename"], "rb").read() == b"%PDF"
+    assert idle_sessions and not any(idle_sessions)
+    assert len(scheduler.hosts["example.com"].sessions) == 1
+
+
+def test_async_engine(monkeypatch, tmp_path) -> None:
+    """ the async engine returns the same files as the thread engine """
+
+    def get(url: str, headers: dict, **kwargs: Any) -> requests.Response:
+        items = "".join("<item><title>{0}</title><guid>{1}/{0}</guid></item>".format(i, url)
+                        for i in range(2))
+        body = "<rss version='2.0'><channel>{}</channel></rss>".format(items)
+        return feed_response(200, body.encode("utf8"), "")
+
+    def entry_text_to_file(args: argparse.Namespace, entry: dict) -> Any:
+        links = "".join("<a href='https://example.com/{}/{}.pdf'>x</a>".format(entry["id"], i)
+                        for i in range(5))
+        return entry["id"], "<html><body>{}</body></html>".format(links)
+
+    def download_and_store(feed_url: str, *args: Any) -> dict:
+        time.sleep(0.05)
+        return {"filename": args[3].path, "uri": args[3].geturl()}
+
+    monkeypatch.setattr(download.requests, "get", get)
+    monkeypatch.setattr(extract, "entry_text_to_file", entry_text_to_file)
+    monkeypatch.setattr(download, "download_and_store", download_and_store)
+
+    args = argparse.Namespace(feed_state=None, proxy_string=None, scheduler=None,
+                              file_format=["pdf"], ignore=None, store_path=str(tmp_path),
+                              max_connections=32, host_connections=8)
+
+    feeds = ["https://example.com/feed{}".format(i) for i in range(3)]
+
+    start = time.time()
+    files = download.download_feed_list(args, feeds, partial=False)
+    threads_time = time.time() - start
+
+    start = time.time()
+    async_files = crawler.crawl(args, feeds, [])
+    async_time = time.time() - start
+
+    def key(file_map: dict) -> tuple:
+        return (file_map["filename"], file_map["uri"])
+
+    # 3 feeds with 2 entries, each with 5 links
+    assert len(files) == 3 * 2 * 6
+    assert sorted(async_files, key=key) == sorted(files, key=key)
+    assert async_time < threads_time
+
+
+def test_async_engine_busy_host(monkeypatch, tmp_path) -> None:
+    """ downloads queued for a busy host do not delay feeds on other hosts """
+
+    start = time.time()
+    requested: Dict[str, float] = {}
+
+    def request(session: requests.Session, method: str, url: str, **kwargs: Any) -> Any:
+        requested[url] = time.time() - start
+        if url == "https://b.example.com/feed":
+            time.sleep(0.3)
+        elif url.startswith("https://a.example.com/"):
+            time.sleep(0.2)
+        if url.endswith("/feed"):
+            body = "<rss version='2.0'><channel><item><guid>{}</guid></item></channel></rss>"
+            return feed_response(200, body.format(url).encode("utf8"), "")
+        return feed_response(200, b"%PDF", "")
+
+    def entry_text_to_file(args: argparse.Namespace, entry: dict) -> Any:
+        host = urllib.parse.urlparse(entry["id"]).netloc
+        links = "".join("<a href='https://{}/{}.pdf'>x</a>".format(host, i)
+                        for i in range(6 if host == "a.example.com" else 1))
+        return entry["id"], "<html><body>{}</body></html>".format(links)
+
+    monkeypatch.setattr(requests.Session, "request", request)
+    monkeypatch.setattr(extract, "entry_text_to_file", entry_text_to_file)
+    (tmp_path / "download").mkdir()
+
+    args = argparse.Namespace(feed_state=None, proxy_string=None,
+                              scheduler=Scheduler(max_connections=2, host_connections=1),
+                              file_format=["pdf"], ignore=None, store_path=str(tmp_path),
+                              max_connections=2, host_connections=1)
+
+    files = crawler.crawl(args, ["https://a.example.com/feed", "https://b.example.com/feed"], [])
+
+    assert len(files) == 2 + 6 + 1
+    # The document on b is downloaded when the feed of b is handled, and not
+    # after the 6 documents queued for a (0.2 seconds each)
+    assert requested["https://b.example.com/0.pdf"] < 0.6
+
+
+def test_download_without_scio(monkeypatch, tmp_path) -> None:
+    """ the feed state is stored when the files are only downloaded """
+
+    feed_file = tmp_path / "feeds.txt"
+    feed_file.write_text("f https://example.com/feed\n")
+
+    args = argparse.Namespace(feed_state=FeedState(str(tmp_path / "state.db")),
+                              feeds=str(feed_file),
+                              engine="threads",
+                              scheduler=Scheduler(),
+                              scio="")
+
+    def download_feed_list(args: argparse.Namespace, feeds: List[str], partial: bool) -> List:
+        for url in feeds:
+            args.feed_state.defer(FeedUpdate(url, Validator('"v1"', None, "abc"), ["urn:a"], []))
+        return []
+
+    monkeypatch.setattr(download, "download_feed_list", download_feed_list)
+
+    feeds.download_and_upload(args)
+
+    assert args.feed_state.validator("https://example.com/feed") == Validator('"v1"', None, "abc")
+    assert args.feed_state.seen("https://example.com/feed", "urn:a")
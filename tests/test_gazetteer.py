@@ -0,0 +1,51 @@
+""" test gazetteer """
+
+import json
+
+from act.scio.gazetteer import Gazetteer, build
+
+CITIES = [
+    # geonameid, name, asciiname, alternatenames, lat, lon, feature class, feature code,
+    # country code, cc2, admin1-4, population, elevation, dem, timezone, modified
+    ["1", "London", "London", "", "51.5", "-0.1", "P", "PPLC", "GB", "", "ENG", "", "", "",
+     "8961989", "", "25", "Europe/London", "2019-09-18"],
+    ["2", "London", "London", "", "43.0", "-81.2", "P", "PPL", "CA", "", "08", "", "", "",
+     "346765", "", "252", "America/Toronto", "2019-08-18"],
+    ["3", "Thames", "Thames", "", "51.5", "0.5", "H", "STM", "GB", "", "ENG", "", "", "",
+     "0", "", "1", "Europe/London", "2019-08-18"],
+]
+
+COUNTRIES = [
+    {"name": "United Kingdom of Great Britain and Northern Ireland", "alpha-2": "GB"},
+    {"name": "Canada", "alpha-2": "CA"},
+]
+
+
+def test_gazetteer(tmp_path) -> None:
+    """ build gazetteer and lookup cities and countries """
+
+    cities = tmp_path / "cities.txt"
+    cities.write_text("\n".join("\t".join(row) for row in CITIES) + "\n")
+
+    countries = tmp_path / "countries.json"
+    countries.write_text(json.dumps(COUNTRIES))
+
+    build(str(cities), str(countries), str(tmp_path / "gazetteer.db")).close()
+
+    gazetteer = Gazetteer.open(str(tmp_path / "gazetteer.db"))
+
+    # The city with the largest population is kept
+    assert gazetteer.city("London") == {
+        "name": "London",
+        "population": 8961989,
+        "country code": "GB",
+        "area": "Europe/London"}
+
+    # Only populated places are cities
+    assert gazetteer.city("Thames") is None
+
+    assert gazetteer.country("Canada").to_dict() == COUNTRIES[1]
+    assert gazetteer.country_by_code("GB").name == COUNTRIES[0]["name"]
+    assert gazetteer.country_by_code("NO") is None
+
+    assert gazetteer.stats() == {"cities": 1, "countries": 2}
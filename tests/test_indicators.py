@@ -4,6 +4,7 @@ import os
 
 import addict
 import pytest
+from act.scio import scanner
 from act.scio.plugins import indicators
 
 TEST_TEXT = """
@@ -68,3 +69,30 @@ async def test_sectors() -> None:
     assert "5.6.7.8/9" in res.result.ipv4net
     assert "user@fastmail.fm" in res.result.email
     assert "fe80::ea39:35ff:fe12:2d71" in res.result.ipv6
+
+
+def test_scanner_offsets() -> None:
+    """ matches are typed and have offsets in the scanned text """
+
+    text = "Connects to evil.com and 10.0.0.1. Done."
+
+    matches = scanner.scan(text, indicators.TLDS)
+
+    assert [(m.type, m.value) for m in matches] == [("fqdn", "evil.com"), ("ipv4", "10.0.0.1")]
+
+    for m in matches:
+        assert text[m.start:m.end] == m.value
+
+
+def test_scanner_equivalent() -> None:
+    """ scanning candidate tokens gives the same matches as scanning the full text """
+
+    text = (TEST_TEXT + "Lorem ipsum dolor sit amet. Consectetur: adipiscing elit.\n") * 50
+
+    matches = scanner.scan(text, indicators.TLDS)
+
+    for indicator_type, pattern in scanner.PATTERNS:
+        expected = [(m.start(), m.end()) for m in pattern.finditer(text)
+                    if scanner.valid(indicator_type, m.group(0), indicators.TLDS)]
+
+        assert [(m.start, m.end) for m in matches if m.type == indicator_type] == expected
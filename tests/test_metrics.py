@@ -0,0 +1,89 @@
+""" test plugin metrics """
+
+import os
+import stat
+import tracemalloc
+
+import addict
+import pytest
+
+from act.scio import analyze
+from act.scio import metrics
+from act.scio import plugin
+
+
+@pytest.mark.asyncio
+async def test_metrics() -> None:
+    """ plugin executions are measured and rendered in prometheus format """
+
+    plugin_dir = os.path.join(os.path.dirname(os.path.realpath(__file__)), "plugins_deps")
+
+    plugins = plugin.load_external_plugins(plugin_dir)
+
+    collector = metrics.Metrics(attach_timings=True)
+
+    nlpdata = addict.Dict(content="This is a test. And this is another one.")
+
+    res = await analyze.analyze_document(plugins, nlpdata, metrics=collector)
+
+    assert set(res["_timings"].keys()) == {"count", "sentences"}
+    assert res["_timings"]["sentences"]["wall"] >= 0
+    assert res["_timings"]["count"]["output_bytes"] > 0
+
+    rendered = collector.render()
+
+    assert 'scio_plugin_invocations_total{plugin="count"} 1' in rendered
+    assert 'scio_plugin_errors_total{plugin="sentences"} 0' in rendered
+
+
+@pytest.mark.asyncio
+async def test_measure_peak_memory() -> None:
+    """ peak memory is the memory allocated during the plugin call """
+
+    class Allocate(plugin.BasePlugin):
+        name = "allocate"
+
+        async def analyze(self, nlpdata: addict.Dict) -> plugin.Result:
+            data = bytearray(10 * 1024 * 1024)
+            del data
+            return plugin.Result(name=self.name, version=self.version, result=addict.Dict())
+
+    class Noop(plugin.BasePlugin):
+        name = "noop"
+
+        async def analyze(self, nlpdata: addict.Dict) -> plugin.Result:
+            return plugin.Result(name=self.name, version=self.version, result=addict.Dict())
+
+    # Memory is not measured unless traced
+    _, timing = await metrics.measure(Allocate(), addict.Dict())
+
+    assert "peak_memory" not in timing
+
+    metrics.start_memory_tracing()
+
+    try:
+        _, timing = await metrics.measure(Allocate(), addict.Dict())
+
+        assert timing["peak_memory"] >= 10 * 1024 * 1024
+
+        # The peak of an earlier call is not counted
+        _, timing = await metrics.measure(Noop(), addict.Dict())
+
+        assert timing["peak_memory"] < 1024 * 1024
+    finally:
+        metrics.stop_memory_tracing()
+
+    assert not tracemalloc.is_tracing()
+
+
+def test_write_metrics(tmp_path) -> None:
+    """ metrics file is readable by other users """
+
+    collector = metrics.Metrics()
+    collector.record("count", {"wall": 1.0, "cpu": 0.5, "output_bytes": 10})
+
+    filename = str(tmp_path / "scio.prom")
+    collector.write(filename)
+
+    assert stat.S_IMODE(os.stat(filename).st_mode) == 0o644
+    assert 'scio_plugin_peak_memory_bytes_total{plugin="count"} 0' in open(filename).read()
@@ -1,11 +1,18 @@
 """ test feed download """
 
+import argparse
+import asyncio
 import io
+import json
 import os
+from typing import List
+
+import addict
 import pytest
 
 from act.scio import analyze
 from act.scio import plugin
+from act.scio.plugin_pool import PluginPool
 
 
 @pytest.mark.asyncio
@@ -30,3 +37,198 @@ async def test_plugins(monkeypatch) -> None:
 
     assert res["count"]["This is a test"] == 14
     assert res["count"]["And this is another one"] == 23
+
+
+def test_setup_plugins() -> None:
+    """ plugins failing in setup should not be used for analyzis """
+
+    class Broken(plugin.BasePlugin):
+        name = "broken"
+
+        def setup(self) -> None:
+            raise FileNotFoundError("missing.ini")
+
+    working = plugin.BasePlugin()
+
+    assert plugin.setup_plugins([Broken(), working]) == [working]
+
+
+def test_setup_optional(tmp_path) -> None:
+    """ plugins without setup/teardown are loaded, and setup runs once """
+
+    plugin_file = tmp_path / "minimal.py"
+    plugin_file.write_text("""
+class Plugin:
+    name = "minimal"
+    info = "Plugin without setup and teardown"
+    version = "0.1"
+    dependencies = []
+
+    async def analyze(self, nlpdata):
+        return None
+""")
+
+    minimal = plugin.load_plugin(str(plugin_file))
+
+    assert minimal is not None
+    assert plugin.setup_plugins([minimal]) == [minimal]
+    plugin.teardown_plugins([minimal])
+
+    class Counting(plugin.BasePlugin):
+        setups = 0
+
+        def setup(self) -> None:
+            self.setups += 1
+
+    counting = Counting()
+    counting.ensure_setup()
+    plugin.setup_plugins([counting])
+
+    assert counting.setups == 1
+
+
+@pytest.mark.asyncio
+async def test_plugin_pool(monkeypatch) -> None:
+    """ plugins executed in worker processes """
+
+    plugin_dir = os.path.join(os.path.dirname(os.path.realpath(__file__)), "plugins_deps")
+
+    plugins = plugin.load_external_plugins(plugin_dir)
+
+    pool = PluginPool(2, plugin_dir, "", [p.name for p in plugins])
+    assert pool.warmup() == {p.name for p in plugins}
+
+    monkeypatch.setattr('sys.stdin', io.StringIO('This is a test. And this is another one.'))
+
+    try:
+        res = await analyze.analyze(plugins, beanstalk_client=False, pool=pool)
+    finally:
+        pool.shutdown()
+
+    assert res["count"]["This is a test"] == 14
+    assert res["count"]["And this is another one"] == 23
+
+
+@pytest.mark.asyncio
+async def test_analyze_loop(monkeypatch, capsys) -> None:
+    """ analyze document from stdin with concurrency and print result """
+
+    plugin_dir = os.path.join(os.path.dirname(os.path.realpath(__file__)), "plugins_deps")
+
+    plugins = plugin.load_external_plugins(plugin_dir)
+
+    monkeypatch.setattr('sys.stdin', io.StringIO('This is a test. And this is another one.'))
+
+    args = argparse.Namespace(beanstalk=None, elasticsearch=None, webdump=None, concurrency=4,
+                              result_cache=None, blob_store=None)
+
+    await analyze.analyze_loop(args, plugins)
+
+    res = json.loads(capsys.readouterr().out)
+
+    assert res["count"]["This is a test"] == 14
+
+
+class FakeIndexer:
+    """ indexer buffering documents until flushed """
+
+    def __init__(self) -> None:
+        self.buffer: List[str] = []
+        self.flushed: List[str] = []
+
+    def index(self, index: str, doc_id: str, body: dict) -> None:
+        self.buffer.append(doc_id)
+
+    def due(self) -> bool:
+        return False
+
+    def flush(self) -> None:
+        self.flushed += self.buffer
+        self.buffer = []
+
+
+@pytest.mark.asyncio
+async def test_write_results_flush_on_cancel() -> None:
+    """ buffered results are flushed when the writer is cancelled """
+
+    args = argparse.Namespace(webdump=None, metadata_date_fields=[], indicator_index=None)
+    indexer = FakeIndexer()
+    results: asyncio.Queue = asyncio.Queue()
+
+    await results.put(addict.Dict(hexdigest="abc", metadata={}))
+
+    writer = asyncio.ensure_future(analyze.write_results(args, indexer, results, 1))
+
+    while not results.empty():
+        await asyncio.sleep(0.01)
+
+    writer.cancel()
+
+    with pytest.raises(asyncio.CancelledError):
+        await writer
+
+    assert indexer.flushed == ["abc"]
+
+
+@pytest.mark.asyncio
+async def test_read_documents_stop() -> None:
+    """ reader stops reserving jobs when stop is set """
+
+    stop = asyncio.Event()
+    stop.set()
+
+    documents: asyncio.Queue = asyncio.Queue()
+
+    await analyze.read_documents(object(), documents, 2, stop=stop)  # type: ignore
+
+    assert [documents.get_nowait() for _ in range(documents.qsize())] == [None, None]
+
+
+def test_resolve_dependencies() -> None:
+    """ plugins with missing or circular dependencies are removed """
+
+    def make_plugin(plugin_name: str, deps: List[str]) -> plugin.BasePlugin:
+        p = plugin.BasePlugin()
+        p.name = plugin_name
+        p.dependencies = deps
+        return p
+
+    plugins = [
+        make_plugin("sectors", ["pos_tag"]),
+        make_plugin("pos_tag", []),
+        make_plugin("missing", ["does_not_exist"]),
+        make_plugin("depends_on_missing", ["missing"]),
+        make_plugin("cycle_a", ["cycle_b"]),
+        make_plugin("cycle_b", ["cycle_a"]),
+    ]
+
+    resolved = [p.name for p in plugin.resolve_dependencies(plugins)]
+
+    assert resolved == ["pos_tag", "sectors"]
+
+
+@pytest.mark.asyncio
+async def test_dependent_plugin_starts_early() -> None:
+    """ dependent plugins do not wait for unrelated slow plugins """
+
+    class Slow(plugin.BasePlugin):
+        name = "slow"
+
+        async def analyze(self, nlpdata: addict.Dict) -> plugin.Result:
+            await asyncio.sleep(0.1)
+            return plugin.Result(name=self.name, version=self.version, result=addict.Dict())
+
+    class Dependent(plugin.BasePlugin):
+        name = "dependent"
+        dependencies = ["BasePlugin"]
+
+        async def analyze(self, nlpdata: addict.Dict) -> plugin.Result:
+            return plugin.Result(name=self.name, version=self.version,
+                                 result=addict.Dict(slow_done="slow" in nlpdata))
+
+    nlpdata = addict.Dict(content="This is a test")
+
+    res = await analyze.analyze_document([Slow(), plugin.BasePlugin(), Dependent()], nlpdata)
+
+    assert "slow" in res
+    assert res.dependent.slow_done is False
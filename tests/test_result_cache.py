@@ -0,0 +1,76 @@
+""" test plugin result cache """
+
+import os
+
+import addict
+import pytest
+
+from act.scio import analyze
+from act.scio import plugin
+from act.scio.result_cache import ResultCache, plugin_versions
+
+PLUGIN_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), "plugins_deps")
+
+
+def test_plugin_versions() -> None:
+    """ versions includes versions of dependencies """
+
+    versions = plugin_versions(plugin.load_external_plugins(PLUGIN_DIR))
+
+    assert versions["sentences"] == "0.1"
+    assert versions["count"] == "0.1;sentences=0.1"
+
+
+def test_result_cache_eviction(tmp_path) -> None:
+    """ least recently used results are evicted when the cache is full """
+
+    # Random data is not compressible, so each result is about 170 bytes
+    values = [os.urandom(120).hex() for _ in range(3)]
+
+    cache = ResultCache(str(tmp_path / "results.db"), max_bytes=400)
+
+    cache.put("doc1", "count", "0.1", addict.Dict(value=values[0]))
+    cache.put("doc2", "count", "0.1", addict.Dict(value=values[1]))
+
+    assert cache.get("doc1", "count", "0.1").value == values[0]
+    assert cache.get("doc1", "count", "0.2") is None
+
+    # doc2 is now the least recently used result
+    cache.put("doc3", "count", "0.1", addict.Dict(value=values[2]))
+
+    assert cache.get("doc2", "count", "0.1") is None
+    assert cache.get("doc1", "count", "0.1").value == values[0]
+    assert cache.get("doc3", "count", "0.1").value == values[2]
+
+
+def test_result_cache_batched_commit(tmp_path) -> None:
+    """ writes are committed in batches and when the cache is closed """
+
+    filename = str(tmp_path / "results.db")
+
+    cache = ResultCache(filename)
+    cache.put("doc1", "count", "0.1", addict.Dict(value=1))
+    cache.get("doc1", "count", "0.1")
+
+    # Not committed yet, so not visible to other connections
+    assert ResultCache(filename).get("doc1", "count", "0.1") is None
+
+    cache.close()
+
+    assert ResultCache(filename).get("doc1", "count", "0.1") == {"value": 1}
+
+
+@pytest.mark.asyncio
+async def test_analyze_cached(tmp_path) -> None:
+    """ cached results are used instead of running the plugin """
+
+    plugins = plugin.load_external_plugins(PLUGIN_DIR)
+    cache = ResultCache(str(tmp_path / "results.db"))
+
+    cache.put("abc", "sentences", "0.1", addict.Dict(split=["From cache"]))
+
+    nlpdata = addict.Dict(content="This is a test.", hexdigest="abc")
+    res = await analyze.analyze_document(plugins, nlpdata, cache=cache)
+
+    assert res["count"] == {"From cache": 10}
+    assert cache.get("abc", "count", "0.1;sentences=0.1") == {"From cache": 10}
@@ -0,0 +1,93 @@
+""" test tika server """
+
+from typing import Any, List, Optional, Text, Tuple
+import gzip
+import json
+import queue
+import threading
+import time
+
+import greenstalk
+
+from act.scio import tika_engine
+
+
+class FakeClient:
+    """ beanstalk client reading jobs from a shared queue """
+
+    jobs: queue.Queue = queue.Queue()
+    results: List[bytes] = []
+    connections = 0
+
+    def __init__(self, address: Tuple[Text, int]) -> None:
+        FakeClient.connections += 1
+
+    def stats(self) -> dict:
+        return {}
+
+    def watch(self, tube: Text) -> None:
+        pass
+
+    def ignore(self, tube: Text) -> None:
+        pass
+
+    def use(self, tube: Text) -> None:
+        pass
+
+    def reserve(self, timeout: Optional[int] = None) -> greenstalk.Job:
+        try:
+            return self.jobs.get(timeout=0.1)
+        except queue.Empty:
+            raise greenstalk.TimedOutError()
+
+    def delete(self, job: greenstalk.Job) -> None:
+        pass
+
+    def put(self, body: bytes) -> None:
+        self.results.append(body)
+
+    def close(self) -> None:
+        pass
+
+
+def test_tika_workers(monkeypatch, tmp_path) -> None:
+    """ documents are extracted in parallel, with a beanstalk connection per worker """
+
+    in_flight = []
+    lock = threading.Lock()
+
+    def from_buffer(content: bytes) -> Any:
+        with lock:
+            in_flight.append(1)
+            max_in_flight = len(in_flight)
+        time.sleep(0.2)
+        with lock:
+            in_flight.pop()
+        return {"content": content.decode("utf8"), "max_in_flight": max_in_flight}
+
+    monkeypatch.setattr(tika_engine.greenstalk, "Client", FakeClient)
+    monkeypatch.setattr(tika_engine.parser, "from_buffer", from_buffer)
+
+    for i in range(8):
+        filename = tmp_path / "doc{}.txt".format(i)
+        filename.write_text("document {}".format(i))
+        FakeClient.jobs.put(greenstalk.Job(i, json.dumps({"filename": str(filename)})))
+
+    server = tika_engine.Server(tika_only=True)
+
+    thread = threading.Thread(target=server.start, args=(4,))
+    thread.start()
+
+    deadline = time.time() + 10
+    while len(FakeClient.results) < 8 and time.time() < deadline:
+        time.sleep(0.1)
+
+    server.stop()
+    thread.join()
+
+    results = [json.loads(gzip.decompress(result)) for result in FakeClient.results]
+
+    assert FakeClient.connections == 4
+    assert sorted(result["content"] for result in results) == \
+        ["document {}".format(i) for i in range(8)]
+    assert max(result["max_in_flight"] for result in results) > 1